@@ -11,15 +11,12 @@ from __future__ import unicode_literals
 import argparse
 import os
 import sys
-import tarfile
 import time
 import traceback
-import zipfile
 import logging
 
 import PIL.Image
 import numpy as np
-import requests
 import six
 import tensorflow as tf
 # contrib ops are registered only when the module is imported, the following import statement is needed,
@@ -106,40 +103,7 @@ class Test(object):
 
     def download_file(self):
         """Download file from url."""
-        cache_dir = Test.cache_dir
-        if not os.path.exists(cache_dir):
-            os.makedirs(cache_dir)
-        url = self.url
-        k = url.rfind('/')
-        fname = self.url[k + 1:]
-        dir_name = fname + "_dir"
-        ftype = None
-        if url.endswith(".tar.gz") or url.endswith(".tgz"):
-            ftype = 'tgz'
-            dir_name = fname.replace(".tar.gz", "").replace(".tgz", "")
-        elif url.endswith('.zip'):
-            ftype = 'zip'
-            dir_name = fname.replace(".zip", "")
-        dir_name = os.path.join(cache_dir, dir_name)
-        os.makedirs(dir_name, exist_ok=True)
-        fpath = os.path.join(dir_name, fname)
-        if not os.path.exists(fpath):
-            response = requests.get(url)
-            if response.status_code not in [200]:
-                response.raise_for_status()
-            with open(fpath, "wb") as f:
-                f.write(response.content)
-        model_path = os.path.join(dir_name, self.local)
-        if not os.path.exists(model_path):
-            if ftype == 'tgz':
-                tar = tarfile.open(fpath)
-                tar.extractall(dir_name)
-                tar.close()
-            elif ftype == 'zip':
-                zip_ref = zipfile.ZipFile(fpath, 'r')
-                zip_ref.extractall(dir_name)
-                zip_ref.close()
-        return fpath, dir_name
+        return utils.download_model(self.url, self.local, Test.cache_dir)
 
     def run_tensorflow(self, sess, inputs):
         """Run model on tensorflow so we have a reference output."""
@@ -779,6 +779,31 @@ class BackendTests(Tf2OnnxBackendTestBase):
         _ = tf.identity(x_, name=_TFOUTPUT)
         self._run_test_case([_OUTPUT], {_INPUT: x_val})
 
+    @check_opset_min_version(10, "QuantizeLinear")
+    def test_fake_quant_with_min_max_args(self):
+        x_val = np.linspace(-8, 8, 24, dtype=np.float32).reshape((2, 3, 4))
+        x = tf.placeholder(tf.float32, [2, 3, 4], name=_TFINPUT)
+        x_ = tf.quantization.fake_quant_with_min_max_args(x, min=-6., max=6.)
+        _ = tf.identity(x_, name=_TFOUTPUT)
+        self._run_test_case([_OUTPUT], {_INPUT: x_val})
+
+    @check_opset_min_version(10, "QuantizeLinear")
+    def test_fake_quant_with_min_max_vars(self):
+        x_val = np.linspace(-1, 4, 24, dtype=np.float32).reshape((2, 3, 4))
+        x = tf.placeholder(tf.float32, [2, 3, 4], name=_TFINPUT)
+        x_ = tf.quantization.fake_quant_with_min_max_vars(x, tf.constant(0.), tf.constant(3.))
+        _ = tf.identity(x_, name=_TFOUTPUT)
+        self._run_test_case([_OUTPUT], {_INPUT: x_val})
+
+    @check_opset_min_version(10, "QuantizeLinear")
+    def test_fake_quant_with_min_max_vars_narrow_range(self):
+        # values below min must saturate to the nudged min, not one step lower
+        x_val = np.linspace(-8, 8, 24, dtype=np.float32).reshape((2, 3, 4))
+        x = tf.placeholder(tf.float32, [2, 3, 4], name=_TFINPUT)
+        x_ = tf.quantization.fake_quant_with_min_max_vars(x, tf.constant(-6.), tf.constant(6.), narrow_range=True)
+        _ = tf.identity(x_, name=_TFOUTPUT)
+        self._run_test_case([_OUTPUT], {_INPUT: x_val})
+
     @check_onnxruntime_incompatibility("Sub")
     def test_relu6_dynamic(self):
         x_val = np.array([0.5, 1.0, -0.5, -1.0], dtype=np.float32).reshape((2, 2))
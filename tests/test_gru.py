@@ -316,6 +316,32 @@ class GRUTests(Tf2OnnxBackendTestBase):
         self.run_test_case(feed_dict, input_names_with_port, output_names_with_port, rtol=0.0001, atol=1e-06,
                            graph_validator=lambda g: check_gru_count(g, 1))
 
+    def test_static_gru(self):
+        units = 5
+        batch_size = 1
+        x_val = np.array([[1., 1.], [2., 2.], [3., 3.], [4., 4.]], dtype=np.float32)
+        x_val = np.stack([x_val] * batch_size)
+
+        x = tf.placeholder(tf.float32, x_val.shape, name="input_1")
+
+        # the cell is repeated for each of the 4 time steps
+        cell = rnn.GRUCell(
+            units,
+            activation=None)
+        outputs, cell_state = tf.nn.static_rnn(
+            cell,
+            tf.unstack(x, axis=1),
+            dtype=tf.float32)
+
+        _ = tf.identity(tf.stack(outputs, axis=1), name="output")
+        _ = tf.identity(cell_state, name="cell_state")
+
+        input_names_with_port = ["input_1:0"]
+        feed_dict = {"input_1:0": x_val}
+        output_names_with_port = ["output:0", "cell_state:0"]
+        self.run_test_case(feed_dict, input_names_with_port, output_names_with_port, rtol=1e-03, atol=1e-06,
+                           graph_validator=lambda g: check_gru_count(g, 1))
+
     def test_dynamic_bigru(self):
         units = 5
         batch_size = 1
@@ -7,19 +7,37 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
+import json
+import multiprocessing
 import os
+import subprocess
+import sys
+import threading
+import time
 import unittest
+from unittest import mock
 from collections import namedtuple
 
 import graphviz as gv
 import numpy as np
+import onnx
 from onnx import TensorProto
 from onnx import helper, numpy_helper
+import yaml
 
 import tensorflow as tf
-from tf2onnx import utils
+from tf2onnx import convert_batch, shape_inference, utils
+from tf2onnx.cache import ConversionCache
+from tf2onnx.context import ConversionContext
 from tf2onnx.graph_matcher import OpTypePattern, GraphMatcher
-from tf2onnx.graph import GraphUtil
+from tf2onnx.handler import tf_op
+from tf2onnx.graph import Graph, GraphUtil, TensorValueCache
+from tf2onnx import optimizer
+from tf2onnx.optimizer import OPTIMIZER_NAMES, PassManager, get_optimizer_names
+from tf2onnx.optimizer.optimizer_base import GraphOptimizerBase
+from tf2onnx.profiler import Profiler
+from tf2onnx.server import ConversionServer, request
+from tf2onnx.shape_inference import infer_shape_for_graph
 from common import unittest_main
 
 
@@ -49,6 +67,24 @@ def onnx_pretty(g, args=None):
     return helper.printable_graph(graph_proto.graph)
 
 
+def _crash_in_worker(name, started):
+    started[name] = (os.getpid(), time.time())
+    os._exit(1)  # pylint: disable=protected-access
+
+
+def _hang_in_worker(name, started):
+    started[name] = (os.getpid(), time.time())
+    time.sleep(600)
+
+
+def _crash_job(argv, graphdef=None, job_id=None, started=None):
+    _crash_in_worker(job_id, started)
+
+
+def _hang_job(argv, graphdef=None, job_id=None, started=None):
+    _hang_in_worker(job_id, started)
+
+
 class Tf2OnnxInternalTests(unittest.TestCase):
     def setUp(self):
         """Setup test."""
@@ -91,12 +127,11 @@ class Tf2OnnxInternalTests(unittest.TestCase):
         ops = g.get_nodes()
         g.topological_sort(ops)
         result = onnx_to_graphviz(g)
-        expected = 'digraph { Placeholder__4 [op_type=Placeholder] ' \
-                   'n1 [op_type=Abs] n7 [op_type=Abs] n2 [op_type=Abs] n3 [op_type=Abs] ' \
-                   'n4 [op_type=Add] n5 [op_type=Abs] n5_graph_outputs_Identity__3 [op_type=Identity] ' \
-                   'n6 [op_type=Identity] input -> n1 n1:0 -> n7 n7:0 -> n2 n1:0 -> n3 ' \
-                   'n2:0 -> n4 n3:0 -> n4 n4:0 -> n5 n5_raw_output___2:0 -> n5_graph_outputs_Identity__3 ' \
-                   'n5_raw_output___2:0 -> n6 }'
+        expected = 'digraph { Placeholder__4 [op_type=Placeholder] n1 [op_type=Abs] n3 [op_type=Abs] n7 ' \
+                   '[op_type=Abs] n2 [op_type=Abs] n4 [op_type=Add] n5 [op_type=Abs] n6 [op_type=Identity] ' \
+                   'n5_graph_outputs_Identity__3 [op_type=Identity] input -> n1 n1:0 -> n3 n1:0 -> n7 n7:0 ' \
+                   '-> n2 n2:0 -> n4 n3:0 -> n4 n4:0 -> n5 n5_raw_output___2:0 -> n6 n5_raw_output___2:0 -> ' \
+                   'n5_graph_outputs_Identity__3 }'
         self.assertEqual(expected, result)
 
     def test_insert_node2(self):
@@ -106,11 +141,11 @@ class Tf2OnnxInternalTests(unittest.TestCase):
         ops = g.get_nodes()
         g.topological_sort(ops)
         result = onnx_to_graphviz(g)
-        expected = 'digraph { Placeholder__4 [op_type=Placeholder] n1 [op_type=Abs] n7 [op_type=Abs] ' \
-                   'n3 [op_type=Abs] n2 [op_type=Abs] n4 [op_type=Add] n5 [op_type=Abs] ' \
-                   'n5_graph_outputs_Identity__3 [op_type=Identity] n6 [op_type=Identity] ' \
-                   'input -> n1 n1:0 -> n7 n7:0 -> n3 n7:0 -> n2 n2:0 -> n4 n3:0 -> n4 ' \
-                   'n4:0 -> n5 n5_raw_output___2:0 -> n5_graph_outputs_Identity__3 n5_raw_output___2:0 -> n6 }'
+        expected = 'digraph { Placeholder__4 [op_type=Placeholder] n1 [op_type=Abs] n7 [op_type=Abs] n2 ' \
+                   '[op_type=Abs] n3 [op_type=Abs] n4 [op_type=Add] n5 [op_type=Abs] n6 [op_type=Identity] ' \
+                   'n5_graph_outputs_Identity__3 [op_type=Identity] input -> n1 n1:0 -> n7 n7:0 -> n2 n7:0 ' \
+                   '-> n3 n2:0 -> n4 n3:0 -> n4 n4:0 -> n5 n5_raw_output___2:0 -> n6 n5_raw_output___2:0 -> ' \
+                   'n5_graph_outputs_Identity__3 }'
         self.assertEqual(expected, result)
 
     def test_remove_input(self):
@@ -121,13 +156,429 @@ class Tf2OnnxInternalTests(unittest.TestCase):
         ops = g.get_nodes()
         g.topological_sort(ops)
         result = onnx_to_graphviz(g)
-        expected = 'digraph { Placeholder__4 [op_type=Placeholder] n1 [op_type=Abs] n3 [op_type=Abs] ' \
-                   'n2 [op_type=Abs] n4 [op_type=Add] n5 [op_type=Abs] ' \
-                   'n5_graph_outputs_Identity__3 [op_type=Identity] n6 [op_type=Identity] ' \
-                   'input -> n1 n1:0 -> n3 n1:0 -> n2 n2:0 -> n4 n4:0 -> n5 ' \
-                   'n5_raw_output___2:0 -> n5_graph_outputs_Identity__3 n5_raw_output___2:0 -> n6 }'
+        expected = 'digraph { Placeholder__4 [op_type=Placeholder] n1 [op_type=Abs] n2 [op_type=Abs] n3 ' \
+                   '[op_type=Abs] n4 [op_type=Add] n5 [op_type=Abs] n6 [op_type=Identity] ' \
+                   'n5_graph_outputs_Identity__3 [op_type=Identity] input -> n1 n1:0 -> n2 n1:0 -> n3 n2:0 ' \
+                   '-> n4 n4:0 -> n5 n5_raw_output___2:0 -> n6 n5_raw_output___2:0 -> ' \
+                   'n5_graph_outputs_Identity__3 }'
         self.assertEqual(expected, result)
 
+    def test_find_output_consumers(self):
+        graph_proto = self.sample_net()
+        g = GraphUtil.create_graph_from_onnx_graph(graph_proto)
+        n2 = g.get_node_by_name("n2")
+        n3 = g.get_node_by_name("n3")
+        n4 = g.get_node_by_name("n4")
+        self.assertEqual([n2, n3], g.find_output_consumers("n1:0"))
+
+        n7 = g.insert_new_node_on_input(n2, "Abs", "n1:0", name="n7")
+        self.assertEqual([n3, n7], g.find_output_consumers("n1:0"))
+        self.assertEqual([n2], g.find_output_consumers("n7:0"))
+
+        g.replace_all_inputs("n3:0", "n2:0")
+        self.assertEqual([], g.find_output_consumers("n3:0"))
+        self.assertEqual([n4], g.find_output_consumers("n2:0"))
+
+        g.remove_input(n4, n4.input[1])
+        self.assertEqual([n4], g.find_output_consumers("n2:0"))
+        n4.input = ["n3:0"]
+        self.assertEqual([], g.find_output_consumers("n2:0"))
+        self.assertEqual([n4], g.find_output_consumers("n3:0"))
+
+        g.remove_node(n4.name)
+        self.assertEqual([], g.find_output_consumers("n3:0"))
+
+    def test_topological_sort(self):
+        graph_proto = self.sample_net()
+        g = GraphUtil.create_graph_from_onnx_graph(graph_proto)
+        g.topological_sort(g.get_nodes())
+        order = [n.name for n in g.get_nodes()]
+        # sorting a sorted graph keeps the order
+        g.topological_sort(g.get_nodes())
+        self.assertEqual(order, [n.name for n in g.get_nodes()])
+
+        # a new node consumed by n2 is appended to the end and must move before n2
+        g.insert_new_node_on_input(g.get_node_by_name("n2"), "Abs", "n1:0", name="n7")
+        self.assertEqual("n7", g.get_nodes()[-1].name)
+        g.topological_sort(g.get_nodes())
+        names = [n.name for n in g.get_nodes()]
+        self.assertLess(names.index("n1"), names.index("n7"))
+        self.assertLess(names.index("n7"), names.index("n2"))
+
+        # cycles are detected
+        n1 = g.get_node_by_name("n1")
+        g.replace_input(n1, n1.input[0], "n2:0")
+        with self.assertRaises(ValueError):
+            g.topological_sort(g.get_nodes())
+
+    def test_profiler(self):
+        graph_proto = self.sample_net()
+        g = GraphUtil.create_graph_from_onnx_graph(graph_proto)
+        profiler = Profiler(trace_memory=False)
+        g = GraphUtil.optimize_graph(g, profiler=profiler)
+        with profiler.phase("Abs", lambda: len(g.get_nodes()), category="handler"):
+            g.make_node("Abs", ["n1:0"])
+        with profiler.phase("Abs", lambda: len(g.get_nodes()), category="handler"):
+            pass
+        report = profiler.report()
+
+        # the passes run again after changes of later passes, the first round has all of them in order
+        optimizers = get_optimizer_names()
+        self.assertEqual(optimizers, [p["name"] for p in report["phases"]][:len(optimizers)])
+        self.assertTrue(all(p["category"] == "optimizer" and p["time"] >= 0 for p in report["phases"]))
+        self.assertEqual(1, len(report["handlers"]))
+        self.assertEqual(2, report["handlers"][0]["calls"])
+        self.assertEqual(1, report["handlers"][0]["node_delta"])
+
+    def test_pass_manager_levels(self):
+        self.assertEqual([], get_optimizer_names(0))
+        self.assertEqual(OPTIMIZER_NAMES, get_optimizer_names(3))
+        self.assertNotIn("transpose_opt", get_optimizer_names(1))
+        with self.assertRaises(ValueError):
+            get_optimizer_names(4)
+        with self.assertRaises(ValueError):
+            PassManager(["no_such_pass"])
+
+    def test_pass_manager_rollback(self):
+        class BrokenOptimizer(GraphOptimizerBase):
+            def __init__(self, debug=False):
+                super(BrokenOptimizer, self).__init__("BrokenOptimizer", debug)
+
+            def _optimize(self, graph):
+                graph.replace_input(graph.get_node_by_name("n3"), "n1:0", "input")
+                graph.remove_node("n2")
+                graph.make_node("Neg", ["n1:0"])
+                raise ValueError("broken")
+
+        optimizer._optimizers["broken"] = BrokenOptimizer
+        self.addCleanup(optimizer._optimizers.pop, "broken")
+        g = GraphUtil.create_graph_from_onnx_graph(self.sample_net())
+        pass_manager = PassManager(["broken", "merge_duplicated_nodes", "identity_opt"])
+        g = pass_manager.run(g)
+
+        # changes of the failing pass are undone, the other passes still run
+        self.assertEqual(1, pass_manager.stats["broken"]["failures"])
+        self.assertEqual(1, pass_manager.stats["broken"]["runs"])
+        # n3 duplicates n2, the unused n6 is deleted as well
+        self.assertEqual(2, pass_manager.stats["merge_duplicated_nodes"]["nodes_removed"])
+        self.assertEqual("Abs:3,Add:1,Placeholder:1",
+                         ",".join("{}:{}".format(k, v) for k, v in sorted(g.dump_node_statistics().items())))
+        self.assertTrue(all(n.graph is g for n in g.get_nodes()))
+
+        # the consumer index is rolled back with the inputs, later passes rely on it
+        g = GraphUtil.create_graph_from_onnx_graph(self.sample_net())
+        g = PassManager(["broken"]).run(g)
+        self.assertEqual(["n1:0"], g.get_node_by_name("n3").input)
+        self.assertEqual(["n2", "n3"], sorted(n.name for n in g.find_output_consumers("n1:0")))
+        self.assertEqual(["n1"], [n.name for n in g.find_output_consumers("input")])
+
+    def test_conversion_cache(self):
+        model_proto = helper.make_model(self.sample_net())
+        size = len(model_proto.SerializeToString())
+        cache_dir = os.path.join(utils.get_temp_directory(), "cache")
+        self.addCleanup(utils.delete_directory, cache_dir)
+        # room for two models only
+        cache = ConversionCache(cache_dir, max_size=2 * size + size // 2)
+        self.assertIsNone(cache.get("a"))
+
+        cache.put("a", model_proto)
+        cache.put("b", model_proto)
+        self.assertEqual(model_proto, cache.get("a"))
+        # make sure mtime of b is older than the one of a
+        os.utime(os.path.join(cache_dir, "b.onnx"), (0, 0))
+        cache.put("c", model_proto)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(model_proto, cache.get("a"))
+        self.assertEqual(model_proto, cache.get("c"))
+
+    def test_tensor_value_cache(self):
+        g = Graph([], opset=10)
+        node1 = g.make_const("c1", np.ones((4, 4), dtype=np.float32))
+        node2 = g.make_const("c2", np.zeros((4, 4), dtype=np.float32))
+
+        val = node1.get_tensor_value(as_list=False)
+        self.assertFalse(val.flags.writeable)
+        self.assertIs(val.base, node1.get_tensor_value(as_list=False).base)
+        copied = node1.get_tensor_value(as_list=False, copy=True)
+        copied[0, 0] = 5
+        self.assertEqual(1, node1.get_tensor_value()[0][0])
+
+        # changes of the value invalidate the cache
+        node1.set_tensor_value(np.full((2, 2), 2, dtype=np.float32))
+        self.assertEqual([[2, 2], [2, 2]], node1.get_tensor_value())
+        node1.set_attr("value", numpy_helper.from_array(np.array([3], dtype=np.float32), "c1"))
+        self.assertEqual([3], node1.get_tensor_value())
+
+        # budget for a single 4x4 float tensor, the least recently used value is dropped
+        cache = TensorValueCache(max_size=64)
+        node1._tensor_value = None
+        cache.put(node1, node1.get_tensor_value(as_list=False))
+        cache.put(node2, node2.get_tensor_value(as_list=False))
+        self.assertIsNone(node1._tensor_value)
+        self.assertIsNotNone(cache.get(node2))
+        self.assertEqual(64, cache.size)
+
+    def test_save_model_with_external_data(self):
+        large = np.random.randn(64, 64).astype(np.float32)
+        small = np.array([1, 2], dtype=np.int64)
+        typed = helper.make_tensor("typed", TensorProto.FLOAT, [32, 32], np.ones(1024, dtype=np.float32).tolist())
+        graph_proto = helper.make_graph(
+            [helper.make_node("Add", ["large", "typed"], ["res"])],
+            "test_external_data",
+            [],
+            [helper.make_tensor_value_info("res", TensorProto.FLOAT, [64, 64])],
+            initializer=[numpy_helper.from_array(large, "large"), numpy_helper.from_array(small, "small"), typed])
+        model_proto = helper.make_model(graph_proto)
+        model_dir = os.path.join(utils.get_temp_directory(), "external_data")
+        self.addCleanup(utils.delete_directory, model_dir)
+        model_path = os.path.join(model_dir, "model.onnx")
+
+        data_path = utils.save_model_with_external_data(model_path, model_proto, threshold=1024)
+        self.assertEqual(os.path.join(model_dir, "model.onnx.data"), data_path)
+        self.assertLess(os.path.getsize(model_path), 1024)
+        loaded = onnx.load(model_path)
+        values = {t.name: numpy_helper.to_array(t) for t in loaded.graph.initializer}
+        self.assertTrue(np.array_equal(large, values["large"]))
+        self.assertTrue(np.array_equal(np.ones([32, 32]), values["typed"]))
+        self.assertTrue(np.array_equal(small, values["small"]))
+        external = [t.name for t in model_proto.graph.initializer if t.data_location == TensorProto.EXTERNAL]
+        self.assertEqual(["large", "typed"], external)
+
+    def test_make_model_with_external_data(self):
+        large = np.random.randn(64, 64).astype(np.float32)
+        small = np.array([1, 2], dtype=np.int64)
+        graph_proto = helper.make_graph(
+            [helper.make_node("Add", ["large", "large"], ["res"])],
+            "test_external_data",
+            [],
+            [helper.make_tensor_value_info("res", TensorProto.FLOAT, [64, 64])],
+            initializer=[numpy_helper.from_array(large, "large"), numpy_helper.from_array(small, "small")])
+        g = GraphUtil.create_graph_from_onnx_graph(graph_proto)
+        model_dir = os.path.join(utils.get_temp_directory(), "external_data_make_model")
+        self.addCleanup(utils.delete_directory, model_dir)
+        model_path = os.path.join(model_dir, "model.onnx")
+
+        with utils.ExternalDataWriter(model_path, threshold=1024) as writer:
+            model_proto = g.make_model("test", external_data=writer)
+        utils.save_protobuf(model_path, model_proto)
+        external = [t.name for t in model_proto.graph.initializer if t.data_location == TensorProto.EXTERNAL]
+        self.assertEqual(["large"], external)
+        # the const node of the graph keeps its value
+        self.assertTrue(np.array_equal(large, g.get_node_by_output("large").get_tensor_value(as_list=False)))
+        loaded = onnx.load(model_path)
+        values = {t.name: numpy_helper.to_array(t) for t in loaded.graph.initializer}
+        self.assertTrue(np.array_equal(large, values["large"]))
+
+    def test_conversion_context(self):
+        context = ConversionContext(unknown_dimension=1)
+        with context.activate():
+            self.assertEqual("a__2", utils.make_name("a"))
+            self.assertEqual(1, utils.get_unknown_dimension())
+            # nested contexts don't share state
+            with ConversionContext().activate():
+                self.assertEqual("a__2", utils.make_name("a"))
+                self.assertEqual(-1, utils.get_unknown_dimension())
+            self.assertEqual("a__3", utils.make_name("a"))
+            mapping = tf_op.create_mapping(7, None)
+            self.assertIs(mapping, context.ops_mapping)
+            self.assertIs(mapping.get("Add"), tf_op.find_effective_op("Add"))
+        # the module globals are used without an active context
+        self.assertEqual("a__2", utils.make_name("a"))
+        self.assertEqual(-1, utils.get_unknown_dimension())
+
+    def test_conversion_server(self):
+        server = ConversionServer(workers=1)
+        ready = threading.Event()
+        thread = threading.Thread(target=server.serve, kwargs={"port": 0, "ready": ready})
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(server.shutdown)
+        ready.wait()
+        port = server.address[1]
+
+        self.assertEqual((200, {"workers": 1, "jobs_done": 0, "jobs_failed": 0}), request("/status", port=port))
+        status, response = request("/convert", {"args": ["--unknown-option"]}, port=port)
+        self.assertEqual(400, status)
+        self.assertEqual("FAIL", response["status"])
+
+    def test_conversion_server_worker_crash_and_timeout(self):
+        server = ConversionServer(workers=1, timeout=1)
+        self.addCleanup(server.shutdown)
+        job = {"args": ["--graphdef", "model.pb", "--inputs", "X:0", "--outputs", "Y:0"]}
+        # the job function is sent to the workers by reference, they run the test functions
+        with mock.patch("tf2onnx.server.convert_job", _crash_job):
+            status, response = server.convert(job)
+        self.assertEqual(500, status)
+        self.assertEqual("CRASH", response["status"])
+        # the pool replaced the crashed worker, the hanging job is killed after the timeout
+        with mock.patch("tf2onnx.server.convert_job", _hang_job):
+            status, response = server.convert(job)
+        self.assertEqual(504, status)
+        self.assertEqual("TIMEOUT", response["status"])
+        self.assertEqual({"workers": 1, "jobs_done": 2, "jobs_failed": 2}, server.status())
+
+    def _write_manifest(self, config):
+        path = os.path.join(utils.get_temp_directory(), "manifest.yaml")
+        self.addCleanup(os.remove, path)
+        with open(path, "w") as f:
+            f.write(yaml.safe_dump(config))
+        return path
+
+    def test_convert_batch_load_manifest(self):
+        path = self._write_manifest({
+            "m1": {"model": "m1.pb"},
+            "m2": {"model": "m2.pb", "disabled": True},
+            "m3": {"model": "m3.pb"},
+        })
+        self.assertEqual(["m1", "m3"], sorted(name for name, _ in convert_batch.load_manifest(path)))
+        models = convert_batch.load_manifest(path, include_disabled=True)
+        self.assertEqual(["m1", "m2", "m3"], sorted(name for name, _ in models))
+        # models given by name are converted even if disabled, in the given order
+        models = convert_batch.load_manifest(path, names=["m3", "m2"])
+        self.assertEqual([("m3", {"model": "m3.pb"}), ("m2", {"model": "m2.pb", "disabled": True})], models)
+        with self.assertRaises(ValueError):
+            convert_batch.load_manifest(path, names=["m4"])
+
+    def test_convert_batch_write_summary(self):
+        results = [
+            {"name": "m1", "status": "OK", "time": 1.0, "output": "m1.onnx", "error": None},
+            {"name": "m2", "status": "TIMEOUT", "time": 2.0, "output": None, "error": "no result"},
+        ]
+        out_dir = os.path.join(utils.get_temp_directory(), "convert_batch_summary")
+        self.addCleanup(utils.delete_directory, out_dir)
+        path = os.path.join(out_dir, "summary.json")
+        summary = convert_batch.write_summary(path, results, 3.0)
+        with open(path, "r") as f:
+            self.assertEqual(summary, json.load(f))
+        self.assertEqual(1, summary["converted"])
+        self.assertEqual(["m2"], summary["failed"])
+        self.assertEqual(results, summary["models"])
+
+    def test_convert_batch_isolates_failed_models(self):
+        out_dir = os.path.join(utils.get_temp_directory(), "convert_batch")
+        self.addCleanup(utils.delete_directory, out_dir)
+        with tf.Graph().as_default() as g:
+            x = tf.placeholder(tf.float32, shape=[1, 2], name="input")
+            tf.identity(tf.abs(x), name="output")
+        model_path = os.path.join(out_dir, "good.pb")
+        utils.save_protobuf(model_path, g.as_graph_def())
+        path = self._write_manifest({
+            "good": {"model": model_path, "inputs": {"input:0": [1, 2]}, "outputs": ["output:0"]},
+            "missing": {"model": os.path.join(out_dir, "missing.pb"), "inputs": {"input:0": [1, 2]},
+                        "outputs": ["output:0"]},
+        })
+        args = convert_batch.get_args([path, "--output-dir", out_dir, "--jobs", "2"])
+        results = {r["name"]: r for r in convert_batch.run(args)}
+        self.assertEqual("OK", results["good"]["status"])
+        self.assertTrue(os.path.exists(results["good"]["output"]))
+        self.assertEqual("FAIL", results["missing"]["status"])
+        self.assertIsNotNone(results["missing"]["error"])
+
+    def test_convert_batch_worker_crash_and_timeout(self):
+        manager = multiprocessing.Manager()
+        self.addCleanup(manager.shutdown)
+        pool = multiprocessing.Pool(2)
+        self.addCleanup(pool.join)
+        self.addCleanup(pool.terminate)
+        started = manager.dict()
+        pending = {"crash": pool.apply_async(_crash_in_worker, ("crash", started)),
+                   "hang": pool.apply_async(_hang_in_worker, ("hang", started))}
+        results = {}
+        deadline = time.time() + 60
+        while pending and time.time() < deadline:
+            for name, async_result in list(pending.items()):
+                result = convert_batch._poll(name, async_result, started, 1)  # pylint: disable=protected-access
+                if result is not None:
+                    results[name] = result
+                    del pending[name]
+            time.sleep(0.1)
+        self.assertEqual("CRASH", results["crash"]["status"])
+        self.assertEqual("TIMEOUT", results["hang"]["status"])
+
+    def test_import_without_tensorflow(self):
+        # graph, optimizer and GraphUtil only need onnx, importing them must not pull in tensorflow
+        script = ("import sys; import tf2onnx.optimizer; from tf2onnx.graph import GraphUtil; "
+                  "print('tensorflow' in sys.modules)")
+        package_dir = os.path.dirname(os.path.dirname(os.path.abspath(utils.__file__)))
+        out = subprocess.check_output([sys.executable, "-c", script], cwd=package_dir)
+        self.assertEqual("False", out.decode("utf-8").strip())
+        # tfonnx and loader are imported on first attribute access
+        script = ("import sys; import tf2onnx; print('tensorflow' in sys.modules, 'tfonnx' in dir(tf2onnx)); "
+                  "print(callable(tf2onnx.tfonnx.process_tf_graph), callable(tf2onnx.loader.from_graphdef))")
+        out = subprocess.check_output([sys.executable, "-c", script], cwd=package_dir)
+        self.assertEqual(["False True", "True True"], out.decode("utf-8").split("\n")[:2])
+        with self.assertRaises(AttributeError):
+            getattr(sys.modules["tf2onnx"], "no_such_module")
+
+    def test_infer_shape_for_graph(self):
+        # chain of nodes given in reverse order, shapes need to travel against the node order
+        nodes = [helper.make_node("Identity", ["t%d" % (i - 1)], ["t%d" % i], name="n%d" % i) for i in range(10, 0, -1)]
+        nodes.append(helper.make_node("Placeholder", [], ["t0"], name="p"))
+        dtypes = {"t%d" % i: TensorProto.FLOAT for i in range(11)}
+        g = Graph(nodes, output_shapes={"t0": [1, 2]}, dtypes=dtypes)
+        infer_shape_for_graph(g)
+        for i in range(11):
+            self.assertEqual([1, 2], g.get_shape("t%d" % i))
+
+        # chain in node order: each node changes its output once and is visited again once, no second sweep
+        nodes = [helper.make_node("Placeholder", [], ["t0"], name="p")]
+        nodes += [helper.make_node("Identity", ["t%d" % (i - 1)], ["t%d" % i], name="n%d" % i) for i in range(1, 11)]
+        g = Graph(nodes, output_shapes={"t0": [1, 2]}, dtypes=dtypes)
+        with mock.patch("tf2onnx.shape_inference.infer_shape_for_node",
+                        wraps=shape_inference.infer_shape_for_node) as infer_node:
+            infer_shape_for_graph(g)
+        self.assertEqual([1, 2], g.get_shape("t10"))
+        self.assertEqual(11 + 10, infer_node.call_count)
+
+    def test_infer_shape_for_graph_tensorarray(self):
+        # the gather reads the shape of the written value, which is inferred after the gather was visited
+        nodes = [helper.make_node("TensorArrayGatherV3", ["ta", "indices", "flow"], ["gathered"], name="gather"),
+                 helper.make_node("TensorArrayWriteV3", ["enter", "index", "value", "flow"], ["flow_out"],
+                                  name="write"),
+                 helper.make_node("Enter", ["ta"], ["enter"], name="enter"),
+                 helper.make_node("TensorArrayV3", ["size"], ["ta", "flow"], name="ta"),
+                 helper.make_node("Identity", ["x"], ["value"], name="value"),
+                 helper.make_node("Placeholder", [], ["x"], name="x")]
+        g = Graph(nodes, output_shapes={"x": [3, 4]}, dtypes={"x": TensorProto.FLOAT})
+        infer_shape_for_graph(g)
+        self.assertEqual([3, 4], g.get_shape("value"))
+        self.assertEqual([-1, 3, 4], g.get_shape("gathered"))
+
+    def test_infer_missing_shapes(self):
+        nodes = [helper.make_node("Placeholder", [], ["x"], name="x"),
+                 helper.make_node("MatMul", ["x", "c"], ["y"], name="matmul"),
+                 helper.make_node("Relu", ["y"], ["z"], name="relu")]
+        g = Graph(nodes, output_shapes={"x": [2, 3], "z": [2, 400]},
+                  dtypes={"x": TensorProto.FLOAT, "z": TensorProto.FLOAT}, opset=9, output_names=["z"])
+        g.make_const("c", np.ones((3, 400), dtype=np.float32))
+        self.assertEqual(1, GraphUtil.infer_missing_shapes(g))
+        self.assertEqual([2, 400], g.get_shape("y"))
+        self.assertEqual(TensorProto.FLOAT, g.get_dtype("y"))
+        # nothing is missing any more, shape inference is skipped
+        self.assertEqual(0, GraphUtil.infer_missing_shapes(g))
+
+    def test_make_model_for_shape_inference(self):
+        # consts above the limit are only graph inputs with shape and type, their data is not copied
+        nodes = [helper.make_node("Placeholder", [], ["x"], name="x"),
+                 helper.make_node("MatMul", ["x", "c"], ["y"], name="matmul"),
+                 helper.make_node("Reshape", ["y", "shape"], ["z"], name="reshape")]
+        g = Graph(nodes, output_shapes={"x": [2, 3], "y": [2, 400], "z": [800]},
+                  dtypes={"x": TensorProto.FLOAT, "y": TensorProto.FLOAT, "z": TensorProto.FLOAT},
+                  opset=9, output_names=["z"])
+        g.make_const("c", np.ones((3, 400), dtype=np.float32))
+        g.make_const("shape", np.array([800], dtype=np.int64))
+        model_proto = g.make_model("test", max_initializer_size=1024)
+        self.assertEqual(["shape"], [t.name for t in model_proto.graph.initializer])
+        self.assertIn("c", [i.name for i in model_proto.graph.input])
+
+    def test_infer_missing_shapes_skips_other_domains(self):
+        # onnx can't infer the output of a custom op, there is no need to run shape inference for it
+        nodes = [helper.make_node("Placeholder", [], ["x"], name="x"),
+                 helper.make_node("Custom", ["x"], ["y"], name="custom", domain="com.example")]
+        g = Graph(nodes, output_shapes={"x": [2, 3]}, dtypes={"x": TensorProto.FLOAT}, opset=9,
+                  output_names=["y"])
+        self.assertEqual(0, GraphUtil.infer_missing_shapes(g))
+
     def test_rewrite_subgraph(self):
         graph_proto = self.sample_net()
         g = GraphUtil.create_graph_from_onnx_graph(graph_proto)
@@ -144,17 +595,16 @@ class Tf2OnnxInternalTests(unittest.TestCase):
             op_name = utils.make_name("ReplacedOp")
             out_name = utils.port_name(op_name)
             new_node = g.make_node("Sub", inputs=input_node.input, outputs=[out_name], name=op_name)
-            g.replace_all_inputs(ops, output_node.output[0], new_node.output[0])
+            g.replace_all_inputs(output_node.output[0], new_node.output[0])
             for n in set(match.get_nodes()):
                 g.remove_node(n.name)
         g.topological_sort(ops)
         result = onnx_to_graphviz(g)
-        expected = 'digraph { Placeholder__4 [op_type=Placeholder] n1 [op_type=Abs] ' \
-                   'n3 [op_type=Abs] n2 [op_type=Abs] ReplacedOp__5 [op_type=Sub] ' \
-                   'n5_graph_outputs_Identity__3 [op_type=Identity] n6 [op_type=Identity] ' \
-                   'input -> n1 n1:0 -> n3 n1:0 -> n2 n2:0 -> ReplacedOp__5 ' \
-                   'n3:0 -> ReplacedOp__5 ReplacedOp__5:0 -> n5_graph_outputs_Identity__3 ' \
-                   'ReplacedOp__5:0 -> n6 }'
+        expected = 'digraph { Placeholder__4 [op_type=Placeholder] n1 [op_type=Abs] n2 [op_type=Abs] n3 ' \
+                   '[op_type=Abs] ReplacedOp__5 [op_type=Sub] n6 [op_type=Identity] ' \
+                   'n5_graph_outputs_Identity__3 [op_type=Identity] input -> n1 n1:0 -> n2 n1:0 -> n3 n2:0 ' \
+                   '-> ReplacedOp__5 n3:0 -> ReplacedOp__5 ReplacedOp__5:0 -> n6 ReplacedOp__5:0 -> ' \
+                   'n5_graph_outputs_Identity__3 }'
         self.assertEqual(expected, result)
 
     def test_match_flipped(self):
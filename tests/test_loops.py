@@ -13,7 +13,7 @@ import numpy as np
 import tensorflow as tf
 
 from backend_test_base import Tf2OnnxBackendTestBase
-from common import unittest_main
+from common import unittest_main, check_opset_min_version, check_op_count
 
 
 # pylint: disable=missing-docstring,invalid-name,unused-argument,using-constant-test
@@ -198,6 +198,33 @@ class LoopTests(Tf2OnnxBackendTestBase):
         self.run_test_case(feed_dict, input_names_with_port, output_names_with_port, rtol=1e-5)
         tf.reset_default_graph()
 
+    @check_opset_min_version(9, "Scan")
+    def test_map_fn_to_scan(self):
+        x_val = 100 * np.random.random_sample([2, 10]).astype(np.float32)
+        x = tf.placeholder(tf.float32, shape=x_val.shape, name="input_0")
+        x_ = tf.identity(x)
+        res_ = tf.map_fn(lambda elem: elem + elem * elem, x_, dtype=tf.float32)
+        _ = tf.identity(res_, name="output_0")
+        feed_dict = {"input_0:0": x_val}
+        input_names_with_port = ["input_0:0"]
+        output_names_with_port = ["output_0:0"]
+        # the loop only iterates over the elements of x_
+        self.run_test_case(feed_dict, input_names_with_port, output_names_with_port, rtol=1e-5,
+                           graph_validator=lambda g: check_op_count(g, "Scan", 1) and check_op_count(g, "Loop", 0))
+
+    @check_opset_min_version(9, "Scan")
+    def test_map_fn_to_scan_unknown_length(self):
+        x_val = 100 * np.random.random_sample([2, 10]).astype(np.float32)
+        x = tf.placeholder(tf.float32, shape=[None, 10], name="input_0")
+        x_ = tf.identity(x)
+        res_ = tf.map_fn(lambda elem: elem * 2, x_, dtype=tf.float32)
+        _ = tf.identity(res_, name="output_0")
+        feed_dict = {"input_0:0": x_val}
+        input_names_with_port = ["input_0:0"]
+        output_names_with_port = ["output_0:0"]
+        self.run_test_case(feed_dict, input_names_with_port, output_names_with_port, rtol=1e-5,
+                           graph_validator=lambda g: check_op_count(g, "Scan", 1) and check_op_count(g, "Loop", 0))
+
 
 if __name__ == '__main__':
     unittest_main()
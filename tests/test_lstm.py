@@ -454,6 +454,55 @@ class LSTMTests(Tf2OnnxBackendTestBase):
         self.run_test_case(feed_dict, input_names_with_port, output_names_with_port, rtol=0.0001,
                            graph_validator=lambda g: check_lstm_count(g, 1))
 
+    def test_static_lstm(self):
+        units = 5
+        batch_size = 6
+        x_val = np.array([[1., 1.], [2., 2.], [3., 3.], [4., 4.]], dtype=np.float32)
+        x_val = np.stack([x_val] * batch_size)
+
+        x = tf.placeholder(tf.float32, x_val.shape, name="input_1")
+        initializer = init_ops.constant_initializer(0.5)
+
+        # the cell is repeated for each of the 4 time steps
+        cell = rnn.LSTMCell(
+            units,
+            initializer=initializer)
+        outputs, cell_state = tf.nn.static_rnn(
+            cell,
+            tf.unstack(x, axis=1),
+            dtype=tf.float32)
+
+        _ = tf.identity(tf.stack(outputs, axis=1), name="output")
+        _ = tf.identity(cell_state, name="cell_state")
+
+        input_names_with_port = ["input_1:0"]
+        feed_dict = {"input_1:0": x_val}
+
+        output_names_with_port = ["output:0", "cell_state:0"]
+        self.run_test_case(feed_dict, input_names_with_port, output_names_with_port, rtol=1e-06,
+                           graph_validator=lambda g: check_lstm_count(g, 1))
+
+    def test_static_lstm_output_of_step_consumed(self):
+        units = 5
+        batch_size = 6
+        x_val = np.array([[1., 1.], [2., 2.], [3., 3.]], dtype=np.float32)
+        x_val = np.stack([x_val] * batch_size)
+
+        x = tf.placeholder(tf.float32, x_val.shape, name="input_1")
+        cell = rnn.BasicLSTMCell(units)
+        outputs, _ = tf.nn.static_rnn(
+            cell,
+            tf.unstack(x, axis=1),
+            dtype=tf.float32)
+
+        _ = tf.identity(outputs[1], name="output")
+
+        feed_dict = {"input_1:0": x_val}
+        input_names_with_port = ["input_1:0"]
+        output_names_with_port = ["output:0"]
+        self.run_test_case(feed_dict, input_names_with_port, output_names_with_port, rtol=0.0001,
+                           graph_validator=lambda g: check_lstm_count(g, 1))
+
     def test_dynamic_bilstm_state_is_tuple(self):
         self.internal_test_dynamic_bilstm_with_parameters(True)
 
@@ -10,7 +10,11 @@ from __future__ import unicode_literals
 import numpy as np
 from onnx import helper, TensorProto
 from tf2onnx import utils
+from tf2onnx.context import ConversionContext
 from tf2onnx.graph import GraphUtil
+from tf2onnx.optimizer import ConstFoldOptimizer, Float16Optimizer, LayoutOptimizer, QuantizeOptimizer, \
+    get_optimizer_names
+from tf2onnx.optimizer.quantize_optimizer import quantize_per_channel
 from backend_test_base import Tf2OnnxBackendTestBase
 from common import unittest_main, group_nodes_by_type
 
@@ -20,13 +24,13 @@ class OptimizerTests(Tf2OnnxBackendTestBase):
     """Run original model proto and modified model proto with onnxruntime, compare the results."""
 
     def run_and_compare(self, output_names_with_port, onnx_feed_dict, origin_proto, op_type,
-                        remaining_op_num, debug=False, rtol=1e-07):
+                        remaining_op_num, debug=False, rtol=1e-07, optimizers=None):
         utils.make_sure(op_type is not None, "op_type should be specified")
         utils.make_sure(remaining_op_num is not None, "remaining_op_num should be specified")
 
         origin_model_path = self.save_onnx_model(origin_proto, onnx_feed_dict, postfix="_origin")
 
-        new_proto = GraphUtil.optimize_model_proto(origin_proto)
+        new_proto = GraphUtil.optimize_model_proto(origin_proto, optimizers=optimizers)
 
         self.assertTrue(new_proto, msg="model proto after optimizer should not be None")
 
@@ -422,6 +426,122 @@ class OptimizerTests(Tf2OnnxBackendTestBase):
                                                 op_type="Log", remaining_op_num=3)
     # Merge Duplicated Nodes Optimizer Tests End
 
+    # Conv BatchNormalization Fusion Optimizer Tests Start
+
+    def _make_conv_bn_graph(self, conv_type, group, extra_consumer=False):
+        in_channels, out_channels = 4, 6
+        if conv_type == "Conv":
+            weights_shape = (out_channels, in_channels // group, 3, 3)
+        else:
+            weights_shape = (in_channels, out_channels // group, 3, 3)
+        nodes = [
+            self._make_const_node("W", np.random.randn(*weights_shape).astype(np.float32)),
+            self._make_const_node("B", np.random.randn(out_channels).astype(np.float32)),
+            helper.make_node(conv_type, ["X", "W", "B"], ["conv"], group=group, pads=[1, 1, 1, 1]),
+            self._make_const_node("scale", np.random.randn(out_channels).astype(np.float32)),
+            self._make_const_node("bias", np.random.randn(out_channels).astype(np.float32)),
+            self._make_const_node("mean", np.random.randn(out_channels).astype(np.float32)),
+            self._make_const_node("var", np.random.rand(out_channels).astype(np.float32)),
+            helper.make_node("BatchNormalization", ["conv", "scale", "bias", "mean", "var"], ["bn"], epsilon=1e-3),
+            helper.make_node("Relu", ["bn"], ["res"]),
+        ]
+        outputs = [helper.make_tensor_value_info("res", TensorProto.FLOAT, None)]
+        if extra_consumer:
+            nodes.append(helper.make_node("Relu", ["conv"], ["res2"]))
+            outputs.append(helper.make_tensor_value_info("res2", TensorProto.FLOAT, None))
+
+        graph = helper.make_graph(
+            nodes,
+            "test_conv_bn",
+            [helper.make_tensor_value_info("X", TensorProto.FLOAT, (2, in_channels, 5, 5))],
+            outputs,
+        )
+        return helper.make_model(graph, producer_name="onnx-tests", opset_imports=[helper.make_opsetid("", 9)])
+
+    def test_fuse_conv_bn(self):
+        model_proto = self._make_conv_bn_graph("Conv", 1)
+        self.run_and_compare(["res"], {"X": np.random.randn(2, 4, 5, 5).astype(np.float32)},
+                             model_proto, op_type="BatchNormalization", remaining_op_num=0, rtol=1e-05,
+                             optimizers=get_optimizer_names(3))
+
+    def test_fuse_grouped_conv_bn(self):
+        model_proto = self._make_conv_bn_graph("Conv", 2)
+        self.run_and_compare(["res"], {"X": np.random.randn(2, 4, 5, 5).astype(np.float32)},
+                             model_proto, op_type="BatchNormalization", remaining_op_num=0, rtol=1e-05,
+                             optimizers=get_optimizer_names(3))
+
+    def test_fuse_conv_transpose_bn(self):
+        model_proto = self._make_conv_bn_graph("ConvTranspose", 2)
+        self.run_and_compare(["res"], {"X": np.random.randn(2, 4, 5, 5).astype(np.float32)},
+                             model_proto, op_type="BatchNormalization", remaining_op_num=0, rtol=1e-05,
+                             optimizers=get_optimizer_names(3))
+
+    def test_fuse_conv_bn_conv_has_other_consumers(self):
+        model_proto = self._make_conv_bn_graph("Conv", 1, extra_consumer=True)
+        self.run_and_compare(["res", "res2"], {"X": np.random.randn(2, 4, 5, 5).astype(np.float32)},
+                             model_proto, op_type="BatchNormalization", remaining_op_num=1,
+                             optimizers=get_optimizer_names(3))
+
+    # Conv BatchNormalization Fusion Optimizer Tests End
+
+    # Gemm Optimizer Tests Start
+
+    def test_fuse_matmul_add_to_gemm(self):
+        node1 = self._make_const_node("W", np.random.randn(4, 3).astype(np.float32))
+        node2 = helper.make_node("MatMul", ["X", "W"], ["matmul"])
+        node3 = self._make_const_node("B", np.random.randn(3).astype(np.float32))
+        node4 = helper.make_node("Add", ["matmul", "B"], ["res"])
+
+        graph = helper.make_graph(
+            [node1, node2, node3, node4],
+            "test_fuse_matmul_add_to_gemm",
+            [helper.make_tensor_value_info("X", TensorProto.FLOAT, (2, 4))],
+            [helper.make_tensor_value_info("res", TensorProto.FLOAT, (2, 3))],
+        )
+
+        model_proto = helper.make_model(graph, producer_name="onnx-tests", opset_imports=[helper.make_opsetid("", 9)])
+        self.run_and_compare(["res"], {"X": np.random.randn(2, 4).astype(np.float32)},
+                             model_proto, op_type="MatMul", remaining_op_num=0, rtol=1e-05)
+
+    def test_fuse_matmul_add_to_gemm_with_transpose(self):
+        node1 = helper.make_node("Transpose", ["X"], ["x_t"], perm=[1, 0])
+        node2 = helper.make_node("Transpose", ["Y"], ["y_t"], perm=[1, 0])
+        node3 = helper.make_node("MatMul", ["x_t", "y_t"], ["matmul"])
+        node4 = self._make_const_node("B", np.random.randn(2, 1).astype(np.float32))
+        node5 = helper.make_node("Add", ["B", "matmul"], ["res"])
+
+        graph = helper.make_graph(
+            [node1, node2, node3, node4, node5],
+            "test_fuse_matmul_add_to_gemm_with_transpose",
+            [helper.make_tensor_value_info("X", TensorProto.FLOAT, (4, 2)),
+             helper.make_tensor_value_info("Y", TensorProto.FLOAT, (3, 4))],
+            [helper.make_tensor_value_info("res", TensorProto.FLOAT, (2, 3))],
+        )
+
+        model_proto = helper.make_model(graph, producer_name="onnx-tests", opset_imports=[helper.make_opsetid("", 9)])
+        self.run_and_compare(["res"], {"X": np.random.randn(4, 2).astype(np.float32),
+                                       "Y": np.random.randn(3, 4).astype(np.float32)},
+                             model_proto, op_type="Transpose", remaining_op_num=0, rtol=1e-05)
+
+    def test_fuse_matmul_add_to_gemm_rank3(self):
+        node1 = self._make_const_node("W", np.random.randn(4, 3).astype(np.float32))
+        node2 = helper.make_node("MatMul", ["X", "W"], ["matmul"])
+        node3 = self._make_const_node("B", np.random.randn(3).astype(np.float32))
+        node4 = helper.make_node("Add", ["matmul", "B"], ["res"])
+
+        graph = helper.make_graph(
+            [node1, node2, node3, node4],
+            "test_fuse_matmul_add_to_gemm_rank3",
+            [helper.make_tensor_value_info("X", TensorProto.FLOAT, (5, 2, 4))],
+            [helper.make_tensor_value_info("res", TensorProto.FLOAT, (5, 2, 3))],
+        )
+
+        model_proto = helper.make_model(graph, producer_name="onnx-tests", opset_imports=[helper.make_opsetid("", 9)])
+        self.run_and_compare(["res"], {"X": np.random.randn(5, 2, 4).astype(np.float32)},
+                             model_proto, op_type="MatMul", remaining_op_num=1)
+
+    # Gemm Optimizer Tests End
+
     # Const Fold Optimizer Tests Start
 
     def test_const_fold_trans_with_const1(self):
@@ -483,8 +603,695 @@ class OptimizerTests(Tf2OnnxBackendTestBase):
         model_proto = helper.make_model(graph, producer_name="onnx-tests")
         self.run_transpose_compare(["res"], {},
                                    model_proto, remaining_transpose_num=0)
+
+    def _make_const_node(self, name, val):
+        return helper.make_node("Constant", [], [name], value=helper.make_tensor(
+            name=name + "_tensor", data_type=utils.map_numpy_to_onnx_dtype(val.dtype), dims=val.shape,
+            vals=val.flatten()))
+
+    def test_const_fold_shape_computation(self):
+        shape = (2, 3, 4)
+        node1 = helper.make_node("Shape", ["X"], ["shape"])
+        node2 = self._make_const_node("starts", np.array([0], dtype=np.int64))
+        node3 = self._make_const_node("ends", np.array([1], dtype=np.int64))
+        node4 = helper.make_node("Slice", ["shape", "starts", "ends"], ["batch"])
+        node5 = self._make_const_node("minus_one", np.array([-1], dtype=np.int64))
+        node6 = helper.make_node("Concat", ["batch", "minus_one"], ["new_shape"], axis=0)
+        node7 = helper.make_node("Reshape", ["X", "new_shape"], ["res"])
+
+        graph = helper.make_graph(
+            [node1, node2, node3, node4, node5, node6, node7],
+            "test_const_fold_shape_computation",
+            [helper.make_tensor_value_info("X", TensorProto.FLOAT, shape)],
+            [helper.make_tensor_value_info("res", TensorProto.FLOAT, (2, 12))],
+        )
+
+        model_proto = helper.make_model(graph, producer_name="onnx-tests", opset_imports=[helper.make_opsetid("", 10)])
+        self.run_and_compare(["res"], {"X": np.random.randn(*shape).astype(np.float32)},
+                             model_proto, op_type="Concat", remaining_op_num=0)
+
+    def test_const_fold_elementwise(self):
+        shape = (2, 3)
+        node1 = self._make_const_node("data", np.random.randn(4, 3).astype(np.float32))
+        node2 = self._make_const_node("indices", np.array([1, 3], dtype=np.int64))
+        node3 = helper.make_node("Gather", ["data", "indices"], ["gathered"], axis=0)
+        node4 = self._make_const_node("row", np.random.randn(3).astype(np.float32))
+        node5 = helper.make_node("Unsqueeze", ["row"], ["row_2d"], axes=[0])
+        node6 = helper.make_node("Add", ["gathered", "row_2d"], ["v1"])
+        node7 = helper.make_node("Mul", ["v1", "row_2d"], ["v2"])
+        node8 = helper.make_node("Sub", ["v2", "gathered"], ["v3"])
+        node9 = helper.make_node("Div", ["v3", "row"], ["v4"])
+        node10 = helper.make_node("Cast", ["v4"], ["v5"], to=TensorProto.DOUBLE)
+        node11 = helper.make_node("Cast", ["v5"], ["v6"], to=TensorProto.FLOAT)
+        node12 = helper.make_node("Add", ["v6", "X"], ["res"])
+
+        graph = helper.make_graph(
+            [node1, node2, node3, node4, node5, node6, node7, node8, node9, node10, node11, node12],
+            "test_const_fold_elementwise",
+            [helper.make_tensor_value_info("X", TensorProto.FLOAT, shape)],
+            [helper.make_tensor_value_info("res", TensorProto.FLOAT, shape)],
+        )
+
+        model_proto = helper.make_model(graph, producer_name="onnx-tests", opset_imports=[helper.make_opsetid("", 10)])
+        self.run_and_compare(["res"], {"X": np.random.randn(*shape).astype(np.float32)},
+                             model_proto, op_type="Add", remaining_op_num=1, rtol=1e-05)
+
+    def test_const_fold_range_expand_where(self):
+        shape = (2, 6)
+        node1 = self._make_const_node("start", np.array(0, dtype=np.float32))
+        node2 = self._make_const_node("limit", np.array(6, dtype=np.float32))
+        node3 = self._make_const_node("delta", np.array(1, dtype=np.float32))
+        node4 = helper.make_node("Range", ["start", "limit", "delta"], ["range"])
+        node5 = self._make_const_node("expand_shape", np.array([2, 1], dtype=np.int64))
+        node6 = helper.make_node("Expand", ["range", "expand_shape"], ["expanded"])
+        node7 = self._make_const_node("cond", np.random.randn(*shape) > 0)
+        node8 = self._make_const_node("zeros", np.zeros(shape, dtype=np.float32))
+        node9 = helper.make_node("Where", ["cond", "expanded", "zeros"], ["selected"])
+        node10 = helper.make_node("Add", ["selected", "X"], ["res"])
+
+        graph = helper.make_graph(
+            [node1, node2, node3, node4, node5, node6, node7, node8, node9, node10],
+            "test_const_fold_range_expand_where",
+            [helper.make_tensor_value_info("X", TensorProto.FLOAT, shape)],
+            [helper.make_tensor_value_info("res", TensorProto.FLOAT, shape)],
+        )
+
+        model_proto = helper.make_model(graph, producer_name="onnx-tests", opset_imports=[helper.make_opsetid("", 11)])
+        self.run_and_compare(["res"], {"X": np.random.randn(*shape).astype(np.float32)},
+                             model_proto, op_type="Where", remaining_op_num=0)
+
+    def test_const_fold_size_budget(self):
+        # folding would create a 2MB constant from 16 bytes, exceeding the default budget
+        shape = (512, 1024)
+        node1 = self._make_const_node("data", np.random.randn(1, 4).astype(np.float32))
+        node2 = self._make_const_node("repeats", np.array([512, 256], dtype=np.int64))
+        node3 = helper.make_node("Tile", ["data", "repeats"], ["tiled"])
+        node4 = helper.make_node("Add", ["tiled", "X"], ["res"])
+
+        graph = helper.make_graph(
+            [node1, node2, node3, node4],
+            "test_const_fold_size_budget",
+            [helper.make_tensor_value_info("X", TensorProto.FLOAT, shape)],
+            [helper.make_tensor_value_info("res", TensorProto.FLOAT, shape)],
+        )
+
+        model_proto = helper.make_model(graph, producer_name="onnx-tests", opset_imports=[helper.make_opsetid("", 10)])
+        self.run_and_compare(["res"], {"X": np.random.randn(*shape).astype(np.float32)},
+                             model_proto, op_type="Tile", remaining_op_num=1)
+
+    def test_const_fold_size_budget_checked_before_folding(self):
+        # the folded output would have 2**40 elements, it must be rejected before it is allocated
+        node1 = self._make_const_node("data", np.random.randn(1, 4).astype(np.float32))
+        node2 = self._make_const_node("repeats", np.array([2 ** 20, 2 ** 18], dtype=np.int64))
+        node3 = helper.make_node("Tile", ["data", "repeats"], ["tiled"])
+        node4 = helper.make_node("Shape", ["tiled"], ["res"])
+
+        graph_proto = helper.make_graph(
+            [node1, node2, node3, node4],
+            "test_const_fold_size_budget_checked_before_folding",
+            [],
+            [helper.make_tensor_value_info("res", TensorProto.INT64, [2])],
+        )
+        graph = GraphUtil.create_graph_from_onnx_graph(graph_proto)
+        graph = ConstFoldOptimizer().optimize(graph)
+        self.assertEqual(1, len(group_nodes_by_type(graph)["Tile"]))
+
+    def test_const_fold_max_output_size_option(self):
+        shape = (64, 64)
+        node1 = self._make_const_node("data", np.random.randn(1, 64).astype(np.float32))
+        node2 = self._make_const_node("expand_shape", np.array(shape, dtype=np.int64))
+        node3 = helper.make_node("Expand", ["data", "expand_shape"], ["expanded"])
+        node4 = helper.make_node("Add", ["expanded", "X"], ["res"])
+
+        graph_proto = helper.make_graph(
+            [node1, node2, node3, node4],
+            "test_const_fold_max_output_size_option",
+            [helper.make_tensor_value_info("X", TensorProto.FLOAT, shape)],
+            [helper.make_tensor_value_info("res", TensorProto.FLOAT, shape)],
+        )
+        # the 16KB output fits into the default budget, but not into a budget of 1KB
+        graph = GraphUtil.create_graph_from_onnx_graph(graph_proto)
+        graph = GraphUtil.optimize_graph(graph, optimizers=["fold_const"],
+                                         optimizer_options={"fold_const": {"max_output_size": 1024}})
+        self.assertEqual(1, len(group_nodes_by_type(graph)["Expand"]))
+        graph = GraphUtil.create_graph_from_onnx_graph(graph_proto)
+        graph = GraphUtil.optimize_graph(graph, optimizers=["fold_const"])
+        self.assertNotIn("Expand", group_nodes_by_type(graph))
+
+    def test_const_fold_shape_with_unknown_dim_override(self):
+        # the unknown batch dim reads as 1 with --unknown-dim 1, it must not be folded into a const
+        node1 = helper.make_node("Shape", ["X"], ["shape"])
+        node2 = helper.make_node("Reshape", ["X", "shape"], ["res"])
+
+        graph_proto = helper.make_graph(
+            [node1, node2],
+            "test_const_fold_shape_with_unknown_dim_override",
+            [helper.make_tensor_value_info("X", TensorProto.FLOAT, [-1, 3])],
+            [helper.make_tensor_value_info("res", TensorProto.FLOAT, [-1, 3])],
+        )
+        with ConversionContext(unknown_dimension=1).activate():
+            graph = GraphUtil.create_graph_from_onnx_graph(graph_proto)
+            graph = ConstFoldOptimizer().optimize(graph)
+        self.assertEqual(1, len(group_nodes_by_type(graph)["Shape"]))
     # Const Fold Optimizer Tests End
 
+    # Const Dedup Optimizer Tests Start
+
+    def test_const_dedup(self):
+        ones = np.ones((5, 5), dtype=np.float32)
+        node1 = self._make_const_node("ones1", ones)
+        node2 = self._make_const_node("ones2", ones)
+        node3 = self._make_const_node("twos", ones * 2)
+        node4 = helper.make_node("Add", ["X", "ones1"], ["add1"])
+        node5 = helper.make_node("Add", ["X", "ones2"], ["add2"])
+        node6 = helper.make_node("Mul", ["add1", "add2"], ["mul"])
+        node7 = helper.make_node("Add", ["mul", "twos"], ["res"])
+
+        graph = helper.make_graph(
+            [node1, node2, node3, node4, node5, node6, node7],
+            "test_const_dedup",
+            [helper.make_tensor_value_info("X", TensorProto.FLOAT, (5, 5))],
+            [helper.make_tensor_value_info("res", TensorProto.FLOAT, (5, 5))],
+        )
+
+        model_proto = helper.make_model(graph, producer_name="onnx-tests", opset_imports=[helper.make_opsetid("", 10)])
+        # the Adds consuming the merged consts become duplicated as well
+        self.run_and_compare(["res"], {"X": np.random.randn(5, 5).astype(np.float32)},
+                             model_proto, op_type="Add", remaining_op_num=2)
+
+    def _make_loop_with_consts(self, name, inp, out):
+        trip_count = self._make_const_node(name + "_trip_count", np.array(2, dtype=np.int64))
+        cond = self._make_const_node(name + "_cond", np.array(True, dtype=np.bool))
+        body_nodes = [
+            self._make_const_node(name + "_ones", np.ones((2, 2), dtype=np.float32)),
+            self._make_const_node(name + "_twos", np.full((2, 2), 2, dtype=np.float32)),
+            helper.make_node("Add", ["loop_var", name + "_ones"], [name + "_add"]),
+            helper.make_node("Mul", [name + "_add", name + "_twos"], [name + "_loop_var_out"]),
+            helper.make_node("Identity", ["loop_cond"], [name + "_loop_cond_out"]),
+        ]
+        body = helper.make_graph(
+            body_nodes,
+            name + "_body",
+            [helper.make_tensor_value_info("loop_iter_num", TensorProto.INT64, ()),
+             helper.make_tensor_value_info("loop_cond", TensorProto.BOOL, ()),
+             helper.make_tensor_value_info("loop_var", TensorProto.FLOAT, (2, 2))],
+            [helper.make_tensor_value_info(name + "_loop_cond_out", TensorProto.BOOL, ()),
+             helper.make_tensor_value_info(name + "_loop_var_out", TensorProto.FLOAT, (2, 2))],
+        )
+        loop = helper.make_node("Loop", [name + "_trip_count", name + "_cond", inp], [out], name=name, body=body)
+        return [trip_count, cond, loop]
+
+    def test_const_dedup_in_subgraph(self):
+        node1 = self._make_const_node("ones", np.ones((2, 2), dtype=np.float32))
+        node2 = helper.make_node("Add", ["X", "ones"], ["add"])
+        nodes = [node1, node2]
+        nodes.extend(self._make_loop_with_consts("loop1", "add", "loop1_out"))
+        nodes.extend(self._make_loop_with_consts("loop2", "loop1_out", "res"))
+
+        graph = helper.make_graph(
+            nodes,
+            "test_const_dedup_in_subgraph",
+            [helper.make_tensor_value_info("X", TensorProto.FLOAT, (2, 2))],
+            [helper.make_tensor_value_info("res", TensorProto.FLOAT, (2, 2))],
+        )
+
+        model_proto = helper.make_model(graph, producer_name="onnx-tests", opset_imports=[helper.make_opsetid("", 10)])
+        self.run_and_compare(["res"], {"X": np.random.randn(2, 2).astype(np.float32)},
+                             model_proto, op_type="Loop", remaining_op_num=2)
+
+        # consts of the bodies are merged into "ones" or hoisted to the main graph
+        new_proto = GraphUtil.optimize_model_proto(model_proto)
+        loops = [n for n in new_proto.graph.node if n.op_type == "Loop"]
+        for loop in loops:
+            self.assertEqual(len(helper.get_attribute_value(loop.attribute[0]).initializer), 0)
+        float_initializers = [t for t in new_proto.graph.initializer if t.data_type == TensorProto.FLOAT]
+        self.assertEqual(len(float_initializers), 2)
+
+    # Const Dedup Optimizer Tests End
+
+    # Layout Optimizer Tests Start
+
+    def test_layout_propagation(self):
+        # Conv wrapped in transposes like the converter does it, the NHWC ops between them have no
+        # handlers in the transpose optimizer
+        nodes = [
+            self._make_const_node("W1", np.random.randn(4, 3, 1, 1).astype(np.float32)),
+            self._make_const_node("W2", np.random.randn(2, 4, 1, 1).astype(np.float32)),
+            self._make_const_node("bias", np.random.randn(4).astype(np.float32)),
+            helper.make_node("Transpose", ["X"], ["t0"], perm=[0, 3, 1, 2], name="t0"),
+            helper.make_node("Conv", ["t0", "W1"], ["c1"], name="c1"),
+            helper.make_node("Transpose", ["c1"], ["t1"], perm=[0, 2, 3, 1], name="t1"),
+            helper.make_node("Sigmoid", ["t1"], ["sigmoid"], name="sigmoid"),
+            helper.make_node("Sub", ["sigmoid", "bias"], ["sub"], name="sub"),
+            helper.make_node("Concat", ["sub", "t1"], ["concat"], axis=3, name="concat"),
+            helper.make_node("Pad", ["concat"], ["pad"], pads=[0, 1, 2, 0, 0, 2, 1, 0], name="pad"),
+            helper.make_node("Split", ["pad"], ["split1", "split2"], axis=3, name="split"),
+            helper.make_node("Max", ["split1", "split2"], ["max"], name="max"),
+            helper.make_node("ReduceMean", ["max"], ["mean"], axes=[3], keepdims=1, name="mean"),
+            helper.make_node("Mul", ["max", "mean"], ["mul"], name="mul"),
+            helper.make_node("Transpose", ["mul"], ["t2"], perm=[0, 3, 1, 2], name="t2"),
+            helper.make_node("Conv", ["t2", "W2"], ["c2"], name="c2"),
+            helper.make_node("Transpose", ["c2"], ["res"], perm=[0, 2, 3, 1], name="t3"),
+        ]
+
+        graph = helper.make_graph(
+            nodes,
+            "test_layout_propagation",
+            [helper.make_tensor_value_info("X", TensorProto.FLOAT, (1, 5, 5, 3))],
+            [helper.make_tensor_value_info("res", TensorProto.FLOAT, (1, 8, 8, 2))],
+        )
+
+        model_proto = helper.make_model(graph, producer_name="onnx-tests", opset_imports=[helper.make_opsetid("", 10)])
+        # only the transposes of the graph input and output are left
+        self.run_transpose_compare(["res"], {"X": np.random.randn(1, 5, 5, 3).astype(np.float32)},
+                                   model_proto, remaining_transpose_num=2)
+
+    def test_layout_propagation_keeps_nhwc_consumers(self):
+        # the NHWC tensor is a graph output as well, converting the region would not save transposes
+        nodes = [
+            self._make_const_node("W", np.random.randn(3, 3, 1, 1).astype(np.float32)),
+            helper.make_node("Transpose", ["X"], ["t0"], perm=[0, 3, 1, 2], name="t0"),
+            helper.make_node("Conv", ["t0", "W"], ["c"], name="c"),
+            helper.make_node("Transpose", ["c"], ["t1"], perm=[0, 2, 3, 1], name="t1"),
+            helper.make_node("Sigmoid", ["t1"], ["sigmoid"], name="sigmoid"),
+            helper.make_node("Softmax", ["sigmoid"], ["res"], axis=3, name="softmax"),
+        ]
+
+        graph = helper.make_graph(
+            nodes,
+            "test_layout_propagation_keeps_nhwc_consumers",
+            [helper.make_tensor_value_info("X", TensorProto.FLOAT, (1, 5, 5, 3))],
+            [helper.make_tensor_value_info("res", TensorProto.FLOAT, (1, 5, 5, 3))],
+        )
+
+        model_proto = helper.make_model(graph, producer_name="onnx-tests", opset_imports=[helper.make_opsetid("", 10)])
+        self.run_transpose_compare(["res"], {"X": np.random.randn(1, 5, 5, 3).astype(np.float32)},
+                                   model_proto, remaining_transpose_num=2)
+
+    def test_layout_propagation_removes_entry_transposes(self):
+        # the region reads the Conv output directly, the NHWC Transpose in front of it must not be left dangling
+        nodes = [
+            self._make_const_node("W1", np.random.randn(3, 3, 1, 1).astype(np.float32)),
+            self._make_const_node("W2", np.random.randn(3, 3, 1, 1).astype(np.float32)),
+            helper.make_node("Conv", ["X", "W1"], ["c1"], name="c1"),
+            helper.make_node("Transpose", ["c1"], ["t1"], perm=[0, 2, 3, 1], name="t1"),
+            helper.make_node("Sigmoid", ["t1"], ["sigmoid"], name="sigmoid"),
+            helper.make_node("Transpose", ["sigmoid"], ["t2"], perm=[0, 3, 1, 2], name="t2"),
+            helper.make_node("Conv", ["t2", "W2"], ["res"], name="c2"),
+        ]
+
+        graph = helper.make_graph(
+            nodes,
+            "test_layout_propagation_removes_entry_transposes",
+            [helper.make_tensor_value_info("X", TensorProto.FLOAT, (1, 3, 5, 5))],
+            [helper.make_tensor_value_info("res", TensorProto.FLOAT, (1, 3, 5, 5))],
+        )
+
+        model_proto = helper.make_model(graph, producer_name="onnx-tests", opset_imports=[helper.make_opsetid("", 10)])
+        g = GraphUtil.create_graph_from_onnx_model(model_proto)
+        # _optimize skips the final cleanup of unused nodes, later regions must not see the old Transposes
+        g = LayoutOptimizer()._optimize(g)  # pylint: disable=protected-access
+        self.assertEqual([], [n.name for n in g.get_nodes() if n.type == "Transpose"])
+        self.assertEqual(["c1"], g.get_node_by_name("sigmoid").input)
+
+    # Layout Optimizer Tests End
+
+    # Nested Body Graph Tests Start
+
+    @staticmethod
+    def _make_loop(name, inp, out, body_nodes, body_out):
+        trip_count = helper.make_node("Constant", [], [name + "_trip_count"], name=name + "_trip_count",
+                                      value=helper.make_tensor("value", TensorProto.INT64, [], [1]))
+        cond = helper.make_node("Constant", [], [name + "_cond"], name=name + "_cond",
+                                value=helper.make_tensor("value", TensorProto.BOOL, [], [True]))
+        body_nodes = body_nodes + [helper.make_node("Identity", [name + "_loop_cond"], [name + "_loop_cond_out"],
+                                                    name=name + "_cond_identity")]
+        body = helper.make_graph(
+            body_nodes,
+            name + "_body",
+            [helper.make_tensor_value_info(name + "_iter_num", TensorProto.INT64, ()),
+             helper.make_tensor_value_info(name + "_loop_cond", TensorProto.BOOL, ()),
+             helper.make_tensor_value_info(name + "_loop_var", TensorProto.FLOAT, (1, 2, 3, 4))],
+            [helper.make_tensor_value_info(name + "_loop_cond_out", TensorProto.BOOL, ()),
+             helper.make_tensor_value_info(body_out, TensorProto.FLOAT, (1, 2, 3, 4))],
+        )
+        return [trip_count, cond, helper.make_node("Loop", [name + "_trip_count", name + "_cond", inp], [out],
+                                                   name=name, body=body)]
+
+    def test_nested_body_graphs_optimized(self):
+        # a transpose pair and an Identity in the body of a loop which is in the body of another loop
+        inner_body = [
+            helper.make_node("Transpose", ["inner_loop_var"], ["t1"], perm=[0, 2, 3, 1], name="t1"),
+            helper.make_node("Transpose", ["t1"], ["t2"], perm=[0, 3, 1, 2], name="t2"),
+            helper.make_node("Identity", ["t2"], ["id"], name="id"),
+            helper.make_node("Relu", ["id"], ["inner_out"], name="relu"),
+        ]
+        outer_body = self._make_loop("inner", "outer_loop_var", "outer_out", inner_body, "inner_out")
+        nodes = self._make_loop("outer", "X", "res", outer_body, "outer_out")
+
+        graph = helper.make_graph(
+            nodes,
+            "test_nested_body_graphs_optimized",
+            [helper.make_tensor_value_info("X", TensorProto.FLOAT, (1, 2, 3, 4))],
+            [helper.make_tensor_value_info("res", TensorProto.FLOAT, (1, 2, 3, 4))],
+        )
+
+        model_proto = helper.make_model(graph, producer_name="onnx-tests", opset_imports=[helper.make_opsetid("", 10)])
+        self.run_and_compare(["res"], {"X": np.random.randn(1, 2, 3, 4).astype(np.float32)},
+                             model_proto, op_type="Loop", remaining_op_num=1)
+
+        new_proto = GraphUtil.optimize_model_proto(model_proto)
+        outer_loop = [n for n in new_proto.graph.node if n.op_type == "Loop"][0]
+        outer_body = helper.get_attribute_value(outer_loop.attribute[0])
+        inner_loop = [n for n in outer_body.node if n.op_type == "Loop"][0]
+        inner_body = helper.get_attribute_value(inner_loop.attribute[0])
+        # only the Identity between the cond input and output is kept
+        self.assertEqual(["Identity", "Relu"], sorted(n.op_type for n in inner_body.node))
+
+    # Nested Body Graph Tests End
+
+    # Loop Invariant Optimizer Tests Start
+
+    def test_hoist_loop_invariants(self):
+        # the transpose and the reshape of the outer inputs don't depend on the iteration, only the transpose
+        # can't fail and is hoisted, the reshape might be protected by the loop condition
+        body_nodes = [
+            self._make_const_node("shape", np.array([1, 2, 3, 4], dtype=np.int64)),
+            helper.make_node("Transpose", ["Z"], ["z_t"], perm=[0, 1, 3, 2], name="z_t"),
+            helper.make_node("Reshape", ["Y", "shape"], ["y_reshaped"], name="y_reshaped"),
+            helper.make_node("Mul", ["y_reshaped", "z_t"], ["scaled"], name="scaled"),
+            helper.make_node("Add", ["loop_loop_var", "scaled"], ["loop_var_out"], name="add"),
+        ]
+        nodes = self._make_loop("loop", "X", "res", body_nodes, "loop_var_out")
+
+        graph = helper.make_graph(
+            nodes,
+            "test_hoist_loop_invariants",
+            [helper.make_tensor_value_info("X", TensorProto.FLOAT, (1, 2, 3, 4)),
+             helper.make_tensor_value_info("Y", TensorProto.FLOAT, (6, 4)),
+             helper.make_tensor_value_info("Z", TensorProto.FLOAT, (1, 2, 4, 3))],
+            [helper.make_tensor_value_info("res", TensorProto.FLOAT, (1, 2, 3, 4))],
+        )
+
+        model_proto = helper.make_model(graph, producer_name="onnx-tests", opset_imports=[helper.make_opsetid("", 10)])
+        feed_dict = {"X": np.random.randn(1, 2, 3, 4).astype(np.float32),
+                     "Y": np.random.randn(6, 4).astype(np.float32),
+                     "Z": np.random.randn(1, 2, 4, 3).astype(np.float32)}
+        self.run_and_compare(["res"], feed_dict, model_proto, op_type="Transpose", remaining_op_num=1)
+
+        new_proto = GraphUtil.optimize_model_proto(model_proto)
+        loop = [n for n in new_proto.graph.node if n.op_type == "Loop"][0]
+        body = helper.get_attribute_value(loop.attribute[0])
+        self.assertEqual(["Add", "Identity", "Mul", "Reshape"], sorted(n.op_type for n in body.node))
+
+    def test_hoist_loop_invariants_of_body_outputs(self):
+        # the invariant result is an output of the body, an Identity in the body passes it on
+        body_nodes = [
+            helper.make_node("Neg", ["Y"], ["neg"], name="neg"),
+            helper.make_node("Relu", ["neg"], ["loop_var_out"], name="relu"),
+        ]
+        nodes = self._make_loop("loop", "X", "res", body_nodes, "loop_var_out")
+
+        graph = helper.make_graph(
+            nodes,
+            "test_hoist_loop_invariants_of_body_outputs",
+            [helper.make_tensor_value_info("X", TensorProto.FLOAT, (1, 2, 3, 4)),
+             helper.make_tensor_value_info("Y", TensorProto.FLOAT, (1, 2, 3, 4))],
+            [helper.make_tensor_value_info("res", TensorProto.FLOAT, (1, 2, 3, 4))],
+        )
+
+        model_proto = helper.make_model(graph, producer_name="onnx-tests", opset_imports=[helper.make_opsetid("", 10)])
+        feed_dict = {"X": np.random.randn(1, 2, 3, 4).astype(np.float32),
+                     "Y": np.random.randn(1, 2, 3, 4).astype(np.float32)}
+        self.run_and_compare(["res"], feed_dict, model_proto, op_type="Relu", remaining_op_num=1)
+
+        new_proto = GraphUtil.optimize_model_proto(model_proto)
+        loop = [n for n in new_proto.graph.node if n.op_type == "Loop"][0]
+        body = helper.get_attribute_value(loop.attribute[0])
+        self.assertEqual(["Identity", "Identity"], [n.op_type for n in body.node])
+
+    # Loop Invariant Optimizer Tests End
+
+    # Float16 Optimizer Tests Start
+
+    def _make_float16_model(self):
+        nodes = [
+            self._make_const_node("W", np.random.randn(1, 3, 1, 1).astype(np.float32)),
+            self._make_const_node("B", np.random.randn(1, 1, 4, 4).astype(np.float32)),
+            helper.make_node("Mul", ["X", "W"], ["mul"], name="mul"),
+            helper.make_node("Relu", ["mul"], ["relu"], name="relu"),
+            helper.make_node("Softmax", ["relu"], ["softmax"], axis=1, name="softmax"),
+            helper.make_node("ReduceSum", ["softmax"], ["sum"], axes=[1], keepdims=1, name="sum"),
+            helper.make_node("Add", ["sum", "B"], ["res"], name="add"),
+        ]
+
+        graph = helper.make_graph(
+            nodes,
+            "test_float16",
+            [helper.make_tensor_value_info("X", TensorProto.FLOAT, (1, 3, 4, 4))],
+            [helper.make_tensor_value_info("res", TensorProto.FLOAT, (1, 1, 4, 4))],
+        )
+        return helper.make_model(graph, producer_name="onnx-tests", opset_imports=[helper.make_opsetid("", 10)])
+
+    def run_float16_compare(self, model_proto, keep_fp32_ops=None):
+        feed_dict = {"X": np.random.randn(1, 3, 4, 4).astype(np.float32)}
+        origin_model_path = self.save_onnx_model(model_proto, feed_dict, postfix="_origin")
+        g = GraphUtil.create_graph_from_onnx_model(model_proto)
+        g = Float16Optimizer(keep_fp32_ops).optimize(g)
+        new_proto = g.make_model("test_float16")
+        new_model_path = self.save_onnx_model(new_proto, feed_dict, postfix="_fp16")
+
+        expected = self.run_onnxruntime(origin_model_path, feed_dict, ["res"])
+        actual = self.run_onnxruntime(new_model_path, feed_dict, ["res"])
+        self.assertAllClose(expected[0], actual[0], rtol=1e-2, atol=1e-2)
+        self.assertEqual(np.float32, actual[0].dtype)
+        return new_proto
+
+    def test_float16(self):
+        new_proto = self.run_float16_compare(self._make_float16_model())
+        nodes = new_proto.graph.node
+        # casts at the graph input and output and around Softmax -> ReduceSum, which stay float32
+        self.assertEqual(4, len([n for n in nodes if n.op_type == "Cast"]))
+        weights = [i for i in new_proto.graph.initializer if i.name.startswith("W") or i.name.startswith("B")]
+        self.assertEqual([TensorProto.FLOAT16] * 2, [w.data_type for w in weights])
+
+    def test_float16_empty_keep_list(self):
+        new_proto = self.run_float16_compare(self._make_float16_model(), keep_fp32_ops=[])
+        self.assertEqual(2, len([n for n in new_proto.graph.node if n.op_type == "Cast"]))
+
+    # Float16 Optimizer Tests End
+
+    # Quantize Optimizer Tests Start
+
+    def run_quantize_compare(self, model_proto, feed_dict, exclude_nodes=None, atol=0.1):
+        origin_model_path = self.save_onnx_model(model_proto, feed_dict, postfix="_origin")
+        g = GraphUtil.create_graph_from_onnx_model(model_proto)
+        g = QuantizeOptimizer("dynamic", exclude_nodes).optimize(g)
+        new_proto = g.make_model("test_quantize")
+        new_model_path = self.save_onnx_model(new_proto, feed_dict, postfix="_quantized")
+
+        expected = self.run_onnxruntime(origin_model_path, feed_dict, ["res"])
+        actual = self.run_onnxruntime(new_model_path, feed_dict, ["res"])
+        self.assertAllClose(expected[0], actual[0], rtol=0.05, atol=atol)
+        return GraphUtil.get_node_count_from_onnx_graph(new_proto.graph)
+
+    def test_quantize_matmul_gemm(self):
+        # both consume X, so they share the DynamicQuantizeLinear
+        nodes = [
+            self._make_const_node("W", np.random.randn(16, 8).astype(np.float32)),
+            self._make_const_node("W2", np.random.randn(8, 16).astype(np.float32)),
+            self._make_const_node("B", np.random.randn(8).astype(np.float32)),
+            helper.make_node("MatMul", ["X", "W"], ["mm"], name="mm"),
+            helper.make_node("Gemm", ["X", "W2", "B"], ["gemm"], transB=1, alpha=0.5, name="gemm"),
+            helper.make_node("Add", ["mm", "gemm"], ["res"], name="add"),
+        ]
+
+        graph = helper.make_graph(
+            nodes,
+            "test_quantize_matmul_gemm",
+            [helper.make_tensor_value_info("X", TensorProto.FLOAT, (4, 16))],
+            [helper.make_tensor_value_info("res", TensorProto.FLOAT, (4, 8))],
+        )
+
+        model_proto = helper.make_model(graph, producer_name="onnx-tests", opset_imports=[helper.make_opsetid("", 11)])
+        feed_dict = {"X": np.random.randn(4, 16).astype(np.float32)}
+        count = self.run_quantize_compare(model_proto, feed_dict)
+        self.assertEqual(2, count["MatMulInteger"])
+        self.assertEqual(1, count["DynamicQuantizeLinear"])
+        self.assertNotIn("MatMul", count)
+        self.assertNotIn("Gemm", count)
+
+        count = self.run_quantize_compare(model_proto, feed_dict, exclude_nodes=["g*"])
+        self.assertEqual(1, count["MatMulInteger"])
+        self.assertEqual(1, count["Gemm"])
+
+    def test_quantize_conv(self):
+        nodes = [
+            self._make_const_node("W", np.random.randn(4, 3, 3, 3).astype(np.float32)),
+            self._make_const_node("B", np.random.randn(4).astype(np.float32)),
+            helper.make_node("Conv", ["X", "W", "B"], ["res"], pads=[1, 1, 1, 1], name="conv"),
+        ]
+
+        graph = helper.make_graph(
+            nodes,
+            "test_quantize_conv",
+            [helper.make_tensor_value_info("X", TensorProto.FLOAT, (1, 3, 6, 6))],
+            [helper.make_tensor_value_info("res", TensorProto.FLOAT, (1, 4, 6, 6))],
+        )
+
+        model_proto = helper.make_model(graph, producer_name="onnx-tests", opset_imports=[helper.make_opsetid("", 11)])
+        count = self.run_quantize_compare(model_proto, {"X": np.random.rand(1, 3, 6, 6).astype(np.float32)},
+                                          atol=0.2)
+        self.assertEqual(1, count["ConvInteger"])
+        self.assertNotIn("Conv", count)
+
+    def test_quantize_per_channel(self):
+        weights = np.array([[1., -100.], [0.5, 50.]], dtype=np.float32)
+        quantized, scale, zero_point = quantize_per_channel(weights, 1, np.int8)
+        self.assertEqual(0, zero_point)
+        np.testing.assert_allclose([1. / 127, 100. / 127], scale, rtol=1e-6)
+        self.assertEqual([[127, -127], [64, 64]], quantized.tolist())
+
+    # Quantize Optimizer Tests End
+
+    # QLinear Fusion Optimizer Tests Start
+
+    def _make_qdq(self, name, inp, scale, zero_point, dtype=np.uint8, narrow_range=False):
+        nodes = [
+            self._make_const_node(name + "_scale", np.array(scale, dtype=np.float32)),
+            self._make_const_node(name + "_zero_point", np.array(zero_point, dtype=dtype)),
+        ]
+        if narrow_range:
+            # converted narrow_range fake quantization clips to the nudged min before quantizing
+            nodes.append(self._make_const_node(name + "_min", np.array((1 - zero_point) * scale, dtype=np.float32)))
+            nodes.append(helper.make_node("Max", [inp, name + "_min"], [name + "_clipped"], name=name + "_clipped"))
+            inp = name + "_clipped"
+        nodes += [
+            helper.make_node("QuantizeLinear", [inp, name + "_scale", name + "_zero_point"], [name + "_q"],
+                             name=name + "_q"),
+            helper.make_node("DequantizeLinear", [name + "_q", name + "_scale", name + "_zero_point"],
+                             [name + "_dq"], name=name + "_dq"),
+        ]
+        return nodes
+
+    def _check_fuse_qlinear_conv(self, narrow_range):
+        # converted quantization aware trained NHWC model, the HWIO weights are transposed after dequantization
+        weights = np.random.randn(3, 3, 3, 4).astype(np.float32)
+        w_scale = np.abs(weights).max() / 127
+        # narrow_range outputs have no Relu, its zero point is never 0
+        y_zero_point = 128 if narrow_range else 0
+        y_input = "add" if narrow_range else "relu"
+        y_nodes = self._make_qdq("y", y_input, 0.05, y_zero_point, narrow_range=narrow_range)
+        nodes = self._make_qdq("x", "X", 0.02, 128) + \
+            self._make_qdq("w", "W", w_scale, 128, narrow_range=narrow_range) + y_nodes[2:] + [
+                self._make_const_node("W", weights),
+                self._make_const_node("B", np.random.randn(4).astype(np.float32)),
+                helper.make_node("Transpose", ["x_dq"], ["x_nchw"], perm=[0, 3, 1, 2], name="x_nchw"),
+                helper.make_node("Transpose", ["w_dq"], ["w_oihw"], perm=[3, 2, 0, 1], name="w_oihw"),
+                helper.make_node("Conv", ["x_nchw", "w_oihw"], ["conv"], pads=[1, 1, 1, 1], name="conv"),
+                helper.make_node("Transpose", ["conv"], ["conv_nhwc"], perm=[0, 2, 3, 1], name="conv_nhwc"),
+                helper.make_node("Add", ["conv_nhwc", "B"], ["add"], name="add"),
+                self._make_const_node("y_scale", np.array(0.05, dtype=np.float32)),
+                self._make_const_node("y_zero_point", np.array(y_zero_point, dtype=np.uint8)),
+                helper.make_node("Identity", ["y_dq"], ["res"], name="res"),
+            ]
+        if not narrow_range:
+            nodes.append(helper.make_node("Relu", ["add"], ["relu"], name="relu"))
+
+        graph = helper.make_graph(
+            nodes,
+            "test_fuse_qlinear_conv",
+            [helper.make_tensor_value_info("X", TensorProto.FLOAT, (1, 6, 6, 3))],
+            [helper.make_tensor_value_info("res", TensorProto.FLOAT, (1, 6, 6, 4))],
+        )
+
+        # Clip of the quantized output needs opset 12
+        opset = 13 if narrow_range else 10
+        model_proto = helper.make_model(graph, producer_name="onnx-tests",
+                                        opset_imports=[helper.make_opsetid("", opset)])
+        # results may differ by one quantization step of y
+        self.run_and_compare(["res"], {"X": np.random.rand(1, 6, 6, 3).astype(np.float32)}, model_proto,
+                             op_type="QLinearConv", remaining_op_num=1, rtol=0.051,
+                             optimizers=get_optimizer_names(3))
+        new_proto = GraphUtil.optimize_model_proto(model_proto, optimizers=get_optimizer_names(3))
+        count = GraphUtil.get_node_count_from_onnx_graph(new_proto.graph)
+        for op_type in ["Conv", "Add", "Relu", "Max"]:
+            self.assertNotIn(op_type, count)
+        # the weights are folded, only the quantization of X and the transposes of input and output stay
+        self.assertEqual(1, count["QuantizeLinear"])
+        self.assertEqual(2, count["Transpose"])
+        return count
+
+    def test_fuse_qlinear_conv(self):
+        self._check_fuse_qlinear_conv(narrow_range=False)
+
+    def test_fuse_qlinear_conv_narrow_range(self):
+        count = self._check_fuse_qlinear_conv(narrow_range=True)
+        # the clip of the output is done on the quantized values
+        self.assertEqual(1, count["Clip"])
+
+    def test_fuse_qlinear_conv_per_channel_axis(self):
+        # per-channel weights are only fused if their scales are along the output channels
+        weights = np.random.randn(4, 3, 3, 3).astype(np.float32)
+        for axis, remaining in [(0, 1), (1, 0)]:
+            reduce_axes = tuple(a for a in range(4) if a != axis)
+            w_scale = (np.abs(weights).max(axis=reduce_axes) / 127).astype(np.float32)
+            w_zero_point = np.zeros(w_scale.shape, dtype=np.int8)
+            nodes = self._make_qdq("x", "X", 0.02, 128) + self._make_qdq("y", "conv", 0.1, 128) + [
+                self._make_const_node("W", weights),
+                self._make_const_node("w_scale", w_scale),
+                self._make_const_node("w_zero_point", w_zero_point),
+                helper.make_node("QuantizeLinear", ["W", "w_scale", "w_zero_point"], ["w_q"], axis=axis, name="w_q"),
+                helper.make_node("DequantizeLinear", ["w_q", "w_scale", "w_zero_point"], ["w_dq"], axis=axis,
+                                 name="w_dq"),
+                helper.make_node("Conv", ["x_dq", "w_dq"], ["conv"], pads=[1, 1, 1, 1], name="conv"),
+                helper.make_node("Identity", ["y_dq"], ["res"], name="res"),
+            ]
+
+            graph = helper.make_graph(
+                nodes,
+                "test_fuse_qlinear_conv_per_channel_axis",
+                [helper.make_tensor_value_info("X", TensorProto.FLOAT, (1, 3, 6, 6))],
+                [helper.make_tensor_value_info("res", TensorProto.FLOAT, (1, 4, 6, 6))],
+            )
+
+            # per-axis quantization is new in opset 13
+            model_proto = helper.make_model(graph, producer_name="onnx-tests",
+                                            opset_imports=[helper.make_opsetid("", 13)])
+            if remaining:
+                self.run_and_compare(["res"], {"X": np.random.rand(1, 3, 6, 6).astype(np.float32)}, model_proto,
+                                     op_type="QLinearConv", remaining_op_num=remaining, rtol=0.11,
+                                     optimizers=get_optimizer_names(3))
+            else:
+                # onnxruntime's own QDQ fusion can't run the original model either, only check the fusion
+                new_proto = GraphUtil.optimize_model_proto(model_proto, optimizers=get_optimizer_names(3))
+                count = GraphUtil.get_node_count_from_onnx_graph(new_proto.graph)
+                self.assertNotIn("QLinearConv", count)
+                self.assertEqual(1, count["Conv"])
+
+    def test_fuse_qlinear_matmul(self):
+        weights = np.random.randn(16, 8).astype(np.float32)
+        nodes = self._make_qdq("x", "X", 0.02, 128) + self._make_qdq("w", "W", np.abs(weights).max() / 127, 128) + \
+            self._make_qdq("y", "mm", 0.1, 128) + [
+                self._make_const_node("W", weights),
+                helper.make_node("MatMul", ["x_dq", "w_dq"], ["mm"], name="mm"),
+                helper.make_node("Identity", ["y_dq"], ["res"], name="res"),
+            ]
+
+        graph = helper.make_graph(
+            nodes,
+            "test_fuse_qlinear_matmul",
+            [helper.make_tensor_value_info("X", TensorProto.FLOAT, (4, 16))],
+            [helper.make_tensor_value_info("res", TensorProto.FLOAT, (4, 8))],
+        )
+
+        model_proto = helper.make_model(graph, producer_name="onnx-tests", opset_imports=[helper.make_opsetid("", 10)])
+        self.run_and_compare(["res"], {"X": np.random.rand(4, 16).astype(np.float32)}, model_proto,
+                             op_type="QLinearMatMul", remaining_op_num=1, rtol=0.11,
+                             optimizers=get_optimizer_names(3))
+
+    # QLinear Fusion Optimizer Tests End
+
 
 if __name__ == "__main__":
     unittest_main()
@@ -9,5 +9,27 @@ from __future__ import unicode_literals
 
 __all__ = ["utils", "graph_matcher", "graph", "loader", "tfonnx", "shape_inference", "schemas"]
 
+import importlib
+import sys
+import types
+
 from .version import version as __version__
-from tf2onnx import tfonnx, utils, graph, graph_matcher, shape_inference, schemas  # pylint: disable=wrong-import-order
+from tf2onnx import utils, schemas, graph_matcher, graph, shape_inference  # pylint: disable=wrong-import-order
+
+# submodules needing tensorflow, imported on first use so the onnx only parts load without it
+_LAZY_SUBMODULES = ["loader", "tfonnx"]
+
+
+class _LazyModule(types.ModuleType):
+    """Import the submodules needing tensorflow on attribute access, module __getattr__ needs Python 3.7."""
+
+    def __getattr__(self, name):
+        if name in _LAZY_SUBMODULES:
+            return importlib.import_module("." + name, __name__)
+        raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+
+    def __dir__(self):
+        return sorted(set(super(_LazyModule, self).__dir__()) | set(_LAZY_SUBMODULES))
+
+
+sys.modules[__name__].__class__ = _LazyModule
@@ -0,0 +1,239 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT license.
+
+"""
+tf2onnx.cache - on-disk cache of converted models keyed by the tensorflow graph and conversion options
+"""
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+
+from onnx import ModelProto
+
+from tf2onnx.context import activate_context
+from tf2onnx.profiler import Profiler
+from tf2onnx.version import version
+
+log = logging.getLogger("tf2onnx.cache")
+
+# pylint: disable=missing-docstring
+
+DEFAULT_MAX_CACHE_SIZE = 1024 * 1024 * 1024
+_CACHE_FILE_EXT = ".onnx"
+
+
+def _callable_name(func):
+    return "{}.{}".format(getattr(func, "__module__", ""), getattr(func, "__qualname__", repr(func)))
+
+
+def make_cache_key(graph_def, continue_on_error=False, opset=None, target=None, extra_opset=None,
+                   custom_op_handlers=None, custom_rewriter=None, shape_override=None, inputs_as_nchw=None,
+                   input_names=None, output_names=None, unknown_dimension=None):
+    """Hash the tensorflow graph and everything else that has influence on the converted model.
+    Args:
+        graph_def: tensorflow GraphDef, after tf_optimize
+        unknown_dimension: unknown_dimension of the ConversionContext
+        other args: same as for process_tf_graph
+    Return:
+        hex digest used as cache key
+    """
+    custom_ops = {}
+    for op_type, (func, args) in (custom_op_handlers or {}).items():
+        custom_ops[op_type] = [_callable_name(func), [str(a) for a in args]]
+    options = {
+        "tf2onnx": version,
+        "continue_on_error": bool(continue_on_error),
+        "opset": opset,
+        "target": sorted(target) if target else None,
+        "extra_opset": sorted([o.domain, o.version] for o in extra_opset or []),
+        "custom_ops": custom_ops,
+        "custom_rewriter": [_callable_name(f) for f in custom_rewriter or []],
+        "shape_override": {k: list(v) if v is not None else None for k, v in (shape_override or {}).items()},
+        "inputs_as_nchw": sorted(inputs_as_nchw or []),
+        "input_names": input_names,
+        "output_names": output_names,
+        "unknown_dimension": unknown_dimension,
+    }
+    h = hashlib.sha256()
+    h.update(graph_def.SerializeToString(deterministic=True))
+    h.update(json.dumps(options, sort_keys=True).encode("utf-8"))
+    return h.hexdigest()
+
+
+class ConversionCache(object):
+    """Size bounded on-disk cache of onnx models, least recently used entries are evicted first."""
+
+    def __init__(self, cache_dir, max_size=DEFAULT_MAX_CACHE_SIZE):
+        self._cache_dir = cache_dir
+        self._max_size = max_size
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @property
+    def cache_dir(self):
+        return self._cache_dir
+
+    def _path(self, key):
+        return os.path.join(self._cache_dir, key + _CACHE_FILE_EXT)
+
+    def get(self, key):
+        """Return cached ModelProto for key or None."""
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except (IOError, OSError):
+            return None
+        model_proto = ModelProto()
+        try:
+            model_proto.ParseFromString(data)
+        except Exception:  # pylint: disable=broad-except
+            log.warning("removing corrupted cache entry %s", path)
+            self._remove(path)
+            return None
+        # mtime tracks last use for the lru eviction
+        os.utime(path, None)
+        log.info("conversion cache hit %s", key)
+        return model_proto
+
+    def put(self, key, model_proto):
+        """Store model_proto under key and evict old entries if the cache grew too large."""
+        # write to a temp file first so concurrent readers never see a partial model
+        fd, tmp_path = tempfile.mkstemp(dir=self._cache_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(model_proto.SerializeToString())
+            os.replace(tmp_path, self._path(key))
+        except Exception:
+            self._remove(tmp_path)
+            raise
+        self.evict(keep=key)
+
+    def evict(self, keep=None):
+        """Remove least recently used entries until the cache fits into max_size."""
+        entries = []
+        total = 0
+        for name in os.listdir(self._cache_dir):
+            if not name.endswith(_CACHE_FILE_EXT):
+                continue
+            path = os.path.join(self._cache_dir, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, name, path, st.st_size))
+            total += st.st_size
+
+        entries.sort()
+        for _, name, path, size in entries:
+            if total <= self._max_size:
+                break
+            if keep is not None and name == keep + _CACHE_FILE_EXT:
+                continue
+            log.debug("evicting cache entry %s", name)
+            self._remove(path)
+            total -= size
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def process_tf_graph_cached(graph_def, cache=None, doc_string="", optimize=True, context=None, optimizers=None,
+                            optimizer_options=None, float16=False, keep_fp32_ops=None, quantize=None,
+                            quantize_exclude=None, external_data=None, **kwargs):
+    """Convert a tensorflow GraphDef to an optimized onnx ModelProto, reusing earlier conversions.
+    Args:
+        graph_def: tensorflow GraphDef, after tf_optimize
+        cache: ConversionCache, if None the model is always converted
+        doc_string: doc string of the model
+        optimize: run the onnx optimizers on the converted model
+        context: optional tf2onnx.context.ConversionContext, active for the conversion and the optimizers
+        optimizers: names of the onnx optimizers to run, default are the ones of the default optimization level
+        optimizer_options: dict of optimizer name to keyword arguments of the optimizer
+        float16: convert float32 weights and compute to float16 after the optimizers
+        keep_fp32_ops: op types kept in float32 by float16, default is optimizer.DEFAULT_KEEP_FP32_OPS
+        quantize: quantization mode run after the optimizers, one of optimizer.QUANTIZATION_MODES or None
+        quantize_exclude: fnmatch patterns of node names not to quantize
+        external_data: optional utils.ExternalDataWriter, large initializers are written to its side file while
+            the model is made. Such models are not cached, they reference the side file and can exceed 2GB.
+        kwargs: passed to process_tf_graph
+    Return:
+        onnx ModelProto
+    """
+    key = None
+    if cache is not None and external_data is not None:
+        log.info("conversion cache is not used for models with external data")
+        cache = None
+    if cache is not None:
+        key_kwargs = {k: kwargs.get(k) for k in ["continue_on_error", "opset", "target", "extra_opset",
+                                                 "custom_op_handlers", "custom_rewriter", "shape_override",
+                                                 "inputs_as_nchw", "input_names", "output_names"]}
+        key_kwargs["unknown_dimension"] = context.unknown_dimension if context is not None else None
+        key = make_cache_key(graph_def, **key_kwargs)
+        if not optimize:
+            key += "_noopt"
+        elif optimizers is not None:
+            key += "_" + hashlib.sha256(",".join(optimizers).encode("utf-8")).hexdigest()[:16]
+        if optimize and optimizer_options:
+            options = json.dumps(optimizer_options, sort_keys=True)
+            key += "_" + hashlib.sha256(options.encode("utf-8")).hexdigest()[:16]
+        if float16:
+            keep = ",".join(sorted(keep_fp32_ops)) if keep_fp32_ops is not None else "default"
+            key += "_fp16_" + hashlib.sha256(keep.encode("utf-8")).hexdigest()[:16]
+        if quantize:
+            exclude = ",".join(quantize_exclude or [])
+            key += "_" + quantize + "_" + hashlib.sha256(exclude.encode("utf-8")).hexdigest()[:16]
+        model_proto = cache.get(key)
+        if model_proto is not None:
+            return model_proto
+
+    # only needed on a cache miss
+    import tensorflow as tf  # pylint: disable=import-outside-toplevel
+    from tf2onnx.graph import GraphUtil  # pylint: disable=import-outside-toplevel
+    from tf2onnx.optimizer import Float16Optimizer, QuantizeOptimizer  # pylint: disable=import-outside-toplevel
+    from tf2onnx.tfonnx import process_tf_graph  # pylint: disable=import-outside-toplevel
+
+    def _convert():
+        with tf.Graph().as_default() as tf_graph:
+            tf.import_graph_def(graph_def, name='')
+        with tf.Session(graph=tf_graph):
+            return process_tf_graph(tf_graph, **kwargs)
+
+    profiler = kwargs.get("profiler") or Profiler(enabled=False)
+    with activate_context(context):
+        g = _convert()
+        if optimize:
+            # the optimizers run on the converted graph, so the model is serialized only once
+            with profiler.phase("infer_missing_shapes"):
+                GraphUtil.infer_missing_shapes(g)
+            optimized_graph = GraphUtil.optimize_graph(g, profiler=profiler, optimizers=optimizers,
+                                                       optimizer_options=optimizer_options)
+            if optimized_graph is not None:
+                g = optimized_graph
+            else:
+                print("NON-CRITICAL, optimizers are not applied successfully")
+                # the optimizers change the graph in place, convert again to drop their partial changes
+                g = _convert()
+        if quantize:
+            with profiler.phase("quantize", lambda: len(g.get_nodes())):
+                g = QuantizeOptimizer(quantize, quantize_exclude).optimize(g)
+        if float16:
+            with profiler.phase("float16", lambda: len(g.get_nodes())):
+                # the pass needs the dtypes of all tensors, only does work if the optimizers didn't run
+                GraphUtil.infer_missing_shapes(g)
+                g = Float16Optimizer(keep_fp32_ops).optimize(g)
+        model_proto = g.make_model(doc_string, external_data=external_data)
+
+    if cache is not None:
+        cache.put(key, model_proto)
+    return model_proto
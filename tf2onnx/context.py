@@ -0,0 +1,66 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT license.
+
+"""
+tf2onnx.context - state of a single conversion, so conversions can run concurrently in threads
+"""
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import contextlib
+import threading
+
+# pylint: disable=missing-docstring
+
+_local = threading.local()
+
+
+class ConversionContext(object):
+    """State that belongs to one conversion.
+    The context is made active for the current thread with activate(), the helpers reading the state
+    (utils.make_name, utils.get_unknown_dimension, handler.tf_op.find_effective_op) fall back to the
+    module globals if no context is active.
+    """
+
+    def __init__(self, unknown_dimension=None):
+        """Create ConversionContext.
+        Args:
+            unknown_dimension: value of unknown dimensions of graph inputs and outputs,
+                None means utils.ONNX_UNKNOWN_DIMENSION is used
+        """
+        self.unknown_dimension = unknown_dimension
+        # handler mapping of the target opsets, set by handler.tf_op.create_mapping
+        self.ops_mapping = None
+        self._name_counter = 1
+
+    def make_name(self, name):
+        """Make op name unique within this conversion."""
+        self._name_counter += 1
+        return "{}__{}".format(name, self._name_counter)
+
+    @contextlib.contextmanager
+    def activate(self):
+        """Make this context the active one of the current thread, contexts can be nested."""
+        previous = get_current_context()
+        _local.context = self
+        try:
+            yield self
+        finally:
+            _local.context = previous
+
+
+def get_current_context():
+    """Return the active ConversionContext of the current thread or None."""
+    return getattr(_local, "context", None)
+
+
+@contextlib.contextmanager
+def activate_context(context):
+    """Activate context for the current thread, the active context is kept if context is None."""
+    if context is None:
+        yield get_current_context()
+    else:
+        with context.activate():
+            yield context
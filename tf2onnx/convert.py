@@ -10,18 +10,19 @@ from __future__ import print_function
 from __future__ import unicode_literals
 
 import argparse
-import tensorflow as tf
 
-from tf2onnx import constants, loader, utils
-from tf2onnx.graph import GraphUtil
-from tf2onnx.tfonnx import process_tf_graph, tf_optimize
+from tf2onnx import constants, loader, optimizer, utils
+from tf2onnx.cache import ConversionCache, process_tf_graph_cached
+from tf2onnx.context import ConversionContext
+from tf2onnx.profiler import Profiler
+from tf2onnx.tfonnx import tf_optimize
 
 
 # pylint: disable=unused-argument
 
 
-def get_args():
-    """Parse commandline."""
+def get_args(argv=None):
+    """Parse commandline, argv defaults to sys.argv[1:]."""
     parser = argparse.ArgumentParser()
     parser.add_argument("--input", help="input from graphdef")
     parser.add_argument("--graphdef", help="input from graphdef")
@@ -40,11 +41,34 @@ def get_args():
     parser.add_argument("--verbose", help="verbose output", action="store_true")
     parser.add_argument("--fold_const", help="enable tf constant_folding transformation before conversion",
                         action="store_true")
+    parser.add_argument("-O", "--optimization-level", type=int, default=optimizer.DEFAULT_OPTIMIZATION_LEVEL,
+                        choices=optimizer.OPTIMIZATION_LEVELS,
+                        help="onnx optimizers to run: 0 none, 1 cleanups, 2 exact graph rewrites (default), "
+                             "3 also rewrites that may change float results slightly")
+    parser.add_argument("--optimizers", help="comma separated onnx optimizers to run instead of the ones of -O")
+    parser.add_argument("--fold-const-max-size", type=int,
+                        help="max size in bytes of a folded const that is larger than the consts it is computed from, "
+                             "default is {}".format(optimizer.const_fold_optimizer.DEFAULT_MAX_OUTPUT_SIZE))
+    parser.add_argument("--float16", help="convert float32 weights and compute to float16, graph inputs and outputs "
+                                          "stay float32", action="store_true")
+    parser.add_argument("--keep-fp32-ops", help="comma separated op types computed in float32 with --float16, "
+                                                "default is " + ",".join(optimizer.DEFAULT_KEEP_FP32_OPS))
+    parser.add_argument("--quantize", choices=optimizer.QUANTIZATION_MODES,
+                        help="quantize MatMul, Gemm and Conv with const weights to int8, needs opset 11")
+    parser.add_argument("--quantize-exclude", help="comma separated name patterns of nodes not to quantize, "
+                                                   "like 'bert/embeddings/*'")
+    parser.add_argument("--profile", help="write time, node count and memory of each conversion phase as json to file")
+    parser.add_argument("--cache-dir", help="directory to cache converted models in, keyed by graph and options")
+    parser.add_argument("--cache-size", type=int, default=1024, help="max size of the cache directory in MB")
+    parser.add_argument("--external-data", help="write large initializers to a side file next to the output model, "
+                                                "needed for models larger than 2GB", action="store_true")
+    parser.add_argument("--external-data-threshold", type=int, default=utils.DEFAULT_EXTERNAL_DATA_THRESHOLD,
+                        help="min size in bytes of initializers written to the side file")
     # experimental
     parser.add_argument("--inputs-as-nchw", help="transpose inputs as from nhwc to nchw")
     # depreciated, going to be removed some time in the future
     parser.add_argument("--unknown-dim", type=int, default=-1, help="default for unknown dimensions")
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
 
     args.shape_override = None
     if args.input:
@@ -64,6 +88,24 @@ def get_args():
     if args.target:
         args.target = args.target.split(",")
 
+    if args.optimizers is not None:
+        args.optimizers = [name for name in args.optimizers.split(",") if name]
+        unknown = [name for name in args.optimizers if name not in optimizer.OPTIMIZER_NAMES]
+        if unknown:
+            raise ValueError("unknown optimizers {}, valid are {}".format(unknown, optimizer.OPTIMIZER_NAMES))
+    else:
+        args.optimizers = optimizer.get_optimizer_names(args.optimization_level)
+
+    args.optimizer_options = {}
+    if args.fold_const_max_size is not None:
+        args.optimizer_options["fold_const"] = {"max_output_size": args.fold_const_max_size}
+
+    if args.keep_fp32_ops is not None:
+        args.keep_fp32_ops = [op for op in args.keep_fp32_ops.split(",") if op]
+
+    if args.quantize_exclude is not None:
+        args.quantize_exclude = [pattern for pattern in args.quantize_exclude.split(",") if pattern]
+
     if args.extra_opset:
         tokens = args.extra_opset.split(':')
         if len(tokens) != 2:
@@ -77,12 +119,16 @@ def default_custom_op_handler(ctx, node, name, args):
     return node
 
 
-def main():
-    args = get_args()
+def run_conversion(args, profiler=None, external_data=None):
+    """Convert the model given by the parsed commandline args, return the onnx ModelProto.
+    If external_data, a utils.ExternalDataWriter, is given the large initializers are written to its side file.
+    """
+    if profiler is None:
+        profiler = Profiler(enabled=False)
 
     # override unknown dimensions from -1 to 1 (aka batchsize 1) since not every runtime does
     # support unknown dimensions.
-    utils.ONNX_UNKNOWN_DIMENSION = args.unknown_dim
+    context = ConversionContext(unknown_dimension=args.unknown_dim)
 
     extra_opset = args.extra_opset or []
     custom_ops = {}
@@ -103,36 +149,58 @@ def main():
         model_path = args.saved_model
 
     # todo: consider to enable const folding by default?
-    graph_def = tf_optimize(inputs, outputs, graph_def, args.fold_const)
-
-    with tf.Graph().as_default() as tf_graph:
-        tf.import_graph_def(graph_def, name='')
-    with tf.Session(graph=tf_graph):
-        g = process_tf_graph(tf_graph,
-                             continue_on_error=args.continue_on_error,
-                             verbose=args.verbose,
-                             target=args.target,
-                             opset=args.opset,
-                             custom_op_handlers=custom_ops,
-                             extra_opset=extra_opset,
-                             shape_override=args.shape_override,
-                             input_names=inputs,
-                             output_names=outputs,
-                             inputs_as_nchw=args.inputs_as_nchw)
-
-    model_proto = g.make_model("converted from {}".format(model_path))
-
-    new_model_proto = GraphUtil.optimize_model_proto(model_proto)
-    if new_model_proto:
-        model_proto = new_model_proto
+    with profiler.phase("tf_optimize"):
+        graph_def = tf_optimize(inputs, outputs, graph_def, args.fold_const)
+
+    cache = None
+    if args.cache_dir:
+        cache = ConversionCache(args.cache_dir, max_size=args.cache_size * 1024 * 1024)
+
+    model_proto = process_tf_graph_cached(graph_def, cache,
+                                          doc_string="converted from {}".format(model_path),
+                                          optimize=bool(args.optimizers),
+                                          optimizers=args.optimizers,
+                                          optimizer_options=args.optimizer_options,
+                                          float16=args.float16,
+                                          keep_fp32_ops=args.keep_fp32_ops,
+                                          quantize=args.quantize,
+                                          quantize_exclude=args.quantize_exclude,
+                                          external_data=external_data,
+                                          continue_on_error=args.continue_on_error,
+                                          verbose=args.verbose,
+                                          target=args.target,
+                                          opset=args.opset,
+                                          custom_op_handlers=custom_ops,
+                                          extra_opset=extra_opset,
+                                          shape_override=args.shape_override,
+                                          input_names=inputs,
+                                          output_names=outputs,
+                                          inputs_as_nchw=args.inputs_as_nchw,
+                                          profiler=profiler,
+                                          context=context)
+    return model_proto
+
+
+def main():
+    args = get_args()
+    profiler = Profiler(enabled=bool(args.profile))
+    if args.output and args.external_data:
+        # the initializers go to the side file while the model is made, before anything serializes it
+        with utils.ExternalDataWriter(args.output, args.external_data_threshold) as writer:
+            model_proto = run_conversion(args, profiler, external_data=writer)
+        print("initializers are written to " + writer.path)
     else:
-        print("NON-CRITICAL, optimizers are not applied successfully")
+        model_proto = run_conversion(args, profiler)
 
     # write onnx graph
     if args.output:
         utils.save_protobuf(args.output, model_proto)
         print("\nComplete successfully, the onnx model is generated at " + args.output)
 
+    if args.profile:
+        profiler.save(args.profile)
+        print("conversion profile is written to " + args.profile)
+
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,249 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT license.
+
+"""
+python -m tf2onnx.convert_batch : convert all models listed in a yaml manifest with a pool of worker processes
+
+The manifest uses the schema of tests/run_pretrained_models.yaml, for example:
+
+    my-model:
+      model: path/to/frozen.pb     # or the path inside the archive given by url
+      url: http://host/model.tgz  # optional, downloaded and extracted to --download-dir
+      model_type: frozen          # frozen (default), checkpoint or saved_model
+      inputs:
+        "X:0": [1, 784]
+      outputs:
+        - output:0
+      force_input_shape: false    # use the input shapes given above as shape_override
+      disabled: false
+
+Keys only used for validating models (input_get, rtol, atol, ...) are ignored.
+"""
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import time
+import traceback
+from collections import OrderedDict
+
+import yaml
+
+from tf2onnx import constants, utils
+
+# pylint: disable=broad-except
+
+logging.basicConfig(level=logging.INFO)
+log = logging.getLogger("tf2onnx.convert_batch")
+
+# seconds a single model may take, counted from the start of its conversion in a worker
+DEFAULT_TIMEOUT = 3600
+# seconds between checks of the running conversions
+_POLL_INTERVAL = 1
+
+
+def get_args(argv=None):
+    """Parse commandline."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("manifest", help="yaml file listing the models to convert")
+    parser.add_argument("--output-dir", default="converted", help="directory the onnx models are written to")
+    parser.add_argument("--summary", help="summary json file, default is summary.json in output-dir")
+    parser.add_argument("--models", help="comma separated names of models in the manifest to convert")
+    parser.add_argument("--include-disabled", help="include disabled models", action="store_true")
+    parser.add_argument("--jobs", type=int, default=multiprocessing.cpu_count(), help="number of worker processes")
+    parser.add_argument("--max-tasks-per-worker", type=int, default=None,
+                        help="restart a worker process after converting this many models")
+    parser.add_argument("--timeout", type=float, default=DEFAULT_TIMEOUT,
+                        help="seconds a single model may take from the start of its conversion, 0 for no limit")
+    parser.add_argument("--download-dir", default=os.path.join(utils.get_temp_directory(), "pre-trained"),
+                        help="directory models given by url are downloaded to")
+    parser.add_argument("--opset", type=int, default=None, help="opset version to use for onnx domain")
+    parser.add_argument("--target", default=",".join(constants.DEFAULT_TARGET), choices=constants.POSSIBLE_TARGETS,
+                        help="target platform")
+    parser.add_argument("--continue_on_error", help="continue_on_error", action="store_true")
+    parser.add_argument("--fold_const", help="enable tf constant_folding transformation before conversion",
+                        action="store_true")
+    parser.add_argument("--cache-dir", help="directory to cache converted models in, keyed by graph and options")
+    parser.add_argument("--cache-size", type=int, default=1024, help="max size of the cache directory in MB")
+    args = parser.parse_args(argv)
+
+    if args.target:
+        args.target = args.target.split(",")
+    if args.models:
+        args.models = args.models.split(",")
+    if not args.summary:
+        args.summary = os.path.join(args.output_dir, "summary.json")
+    return args
+
+
+def load_manifest(path, names=None, include_disabled=False):
+    """Return OrderedDict like list of (name, config) of the models to convert."""
+    with open(path, "r") as f:
+        config = yaml.safe_load(f)
+    if names:
+        missing = set(names) - set(config.keys())
+        utils.make_sure(not missing, "models %s are not in manifest %s", sorted(missing), path)
+        return [(name, config[name]) for name in names]
+    return [(name, v) for name, v in config.items() if include_disabled or not v.get("disabled")]
+
+
+def _init_worker():
+    """Pay the import cost of tensorflow and the handlers once per worker process."""
+    os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
+    import tensorflow as tf  # pylint: disable=import-outside-toplevel,unused-import
+    import tf2onnx.tfonnx  # pylint: disable=import-outside-toplevel,unused-import
+
+
+def convert_model(name, config, args, started=None):
+    """Convert a single model of the manifest, never raises.
+    Args:
+        started: optional dict shared with the parent process, gets name -> (pid, start time) of the conversion
+    Return:
+        dict with name, status, time, output and error of the conversion
+    """
+    result = {"name": name, "status": "FAIL", "time": None, "output": None, "error": None}
+    start = time.time()
+    if started is not None:
+        started[name] = (os.getpid(), start)
+    try:
+        # pylint: disable=import-outside-toplevel
+        from tf2onnx import loader
+        from tf2onnx.cache import ConversionCache, process_tf_graph_cached
+        from tf2onnx.tfonnx import tf_optimize
+
+        model_path = config["model"]
+        if config.get("url"):
+            _, dir_name = utils.download_model(config["url"], model_path, args.download_dir)
+            model_path = os.path.join(dir_name, model_path)
+
+        input_shapes = config.get("inputs") or {}
+        inputs = list(input_shapes.keys())
+        outputs = config.get("outputs")
+        model_type = config.get("model_type", "frozen")
+        if model_type == "checkpoint":
+            graph_def, inputs, outputs = loader.from_checkpoint(model_path, inputs, outputs)
+        elif model_type == "saved_model":
+            graph_def, inputs, outputs = loader.from_saved_model(model_path, inputs, outputs)
+        else:
+            graph_def, inputs, outputs = loader.from_graphdef(model_path, inputs, outputs)
+
+        shape_override = None
+        if config.get("force_input_shape"):
+            shape_override = {k: list(v) for k, v in input_shapes.items() if utils.is_list_or_tuple(v)}
+
+        graph_def = tf_optimize(inputs, outputs, graph_def, args.fold_const)
+
+        cache = None
+        if args.cache_dir:
+            cache = ConversionCache(args.cache_dir, max_size=args.cache_size * 1024 * 1024)
+        model_proto = process_tf_graph_cached(graph_def, cache,
+                                              doc_string="converted from {}".format(model_path),
+                                              continue_on_error=args.continue_on_error,
+                                              target=args.target,
+                                              opset=args.opset,
+                                              shape_override=shape_override,
+                                              input_names=inputs,
+                                              output_names=outputs)
+
+        output_path = os.path.join(args.output_dir, name + ".onnx")
+        utils.save_protobuf(output_path, model_proto)
+        result["status"] = "OK"
+        result["output"] = output_path
+    except Exception as ex:
+        result["error"] = "{}\n{}".format(ex, traceback.format_exc())
+    result["time"] = time.time() - start
+    return result
+
+
+def _failed_result(name, status, elapsed, error):
+    return {"name": name, "status": status, "time": elapsed, "output": None, "error": error}
+
+
+def _poll(name, async_result, started, timeout):
+    """Return the result of the conversion of model name, or None while it is queued or running.
+    A conversion whose worker process died or which runs longer than timeout seconds fails,
+    the worker of a timed out conversion is killed so the pool replaces it.
+    """
+    try:
+        if not utils.poll_worker(async_result, started, name, timeout, _POLL_INTERVAL):
+            return None
+    except utils.WorkerFailure as ex:
+        return _failed_result(name, ex.status, ex.elapsed, str(ex))
+    try:
+        return async_result.get()
+    except Exception as ex:
+        return _failed_result(name, "FAIL", None, str(ex))
+
+
+def run(args):
+    """Convert all models of the manifest, return the list of per model results."""
+    models = load_manifest(args.manifest, args.models, args.include_disabled)
+    os.makedirs(args.output_dir, exist_ok=True)
+    jobs = max(1, min(args.jobs, len(models)))
+    log.info("converting %d models with %d worker processes", len(models), jobs)
+
+    results = {}
+    manager = multiprocessing.Manager()
+    pool = multiprocessing.Pool(jobs, initializer=_init_worker, maxtasksperchild=args.max_tasks_per_worker)
+    try:
+        started = manager.dict()
+        pending = OrderedDict((name, pool.apply_async(convert_model, (name, config, args, started)))
+                              for name, config in models)
+        while pending:
+            for name, async_result in list(pending.items()):
+                result = _poll(name, async_result, started, args.timeout)
+                if result is None:
+                    continue
+                del pending[name]
+                log.info("%s: %s %s", name, result["status"],
+                         "" if result["time"] is None else "{:.2f}s".format(result["time"]))
+                results[name] = result
+            if pending:
+                next(iter(pending.values())).wait(_POLL_INTERVAL)
+    finally:
+        pool.terminate()
+        pool.join()
+        manager.shutdown()
+    return [results[name] for name, _ in models]
+
+
+def write_summary(path, results, total_time):
+    failed = [r["name"] for r in results if r["status"] != "OK"]
+    summary = {
+        "total_time": total_time,
+        "converted": len(results) - len(failed),
+        "failed": failed,
+        "models": results,
+    }
+    dir_name = os.path.dirname(path)
+    if dir_name:
+        os.makedirs(dir_name, exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(summary, f, indent=2)
+    return summary
+
+
+def main(argv=None):
+    args = get_args(argv)
+    start = time.time()
+    results = run(args)
+    summary = write_summary(args.summary, results, time.time() - start)
+
+    print("\n{:<40} {:<8} {:>10}".format("model", "status", "time(s)"))
+    for r in results:
+        print("{:<40} {:<8} {:>10}".format(r["name"], r["status"],
+                                           "-" if r["time"] is None else "{:.2f}".format(r["time"])))
+    print("=== RESULT: {} failed of {}, summary is written to {}".format(
+        len(summary["failed"]), len(results), args.summary))
+    return len(summary["failed"])
+
+
+if __name__ == "__main__":
+    sys.exit(main())
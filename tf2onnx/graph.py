@@ -13,7 +13,9 @@ import collections
 import copy
 import logging
 import sys
+import threading
 import traceback
+import weakref
 import six
 import numpy as np
 
@@ -30,6 +32,98 @@ log = logging.getLogger("graph")
 # todo(pengwa): remove protected-access later
 # pylint: disable=broad-except,protected-access
 
+# default byte budget of the decoded const values kept by all nodes together
+DEFAULT_TENSOR_VALUE_CACHE_SIZE = 256 * 1024 * 1024
+
+# consts up to this size in bytes are kept in the model onnx shape inference runs on, ops like Reshape need
+# their values, larger ones only need shape and type
+SHAPE_INFERENCE_MAX_INITIALIZER_SIZE = 1024
+
+
+class TensorValueCache(object):
+    """Byte bounded LRU bookkeeping of the decoded const values kept by nodes.
+    The values live on the nodes, so they go away with the nodes, this only decides
+    which node has to drop its value once the budget is exceeded.
+    """
+
+    def __init__(self, max_size=DEFAULT_TENSOR_VALUE_CACHE_SIZE):
+        self._max_size = max_size
+        # id(node) -> (weakref to node, nbytes), least recently used first
+        self._entries = collections.OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def size(self):
+        return self._size
+
+    @property
+    def max_size(self):
+        return self._max_size
+
+    @max_size.setter
+    def max_size(self, val):
+        with self._lock:
+            self._max_size = val
+            self._evict()
+
+    def get(self, node):
+        """Return the cached value of node or None."""
+        val = node._tensor_value
+        with self._lock:
+            if val is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                key = id(node)
+                if key in self._entries:
+                    self._entries.move_to_end(key)
+        return val
+
+    def put(self, node, val):
+        with self._lock:
+            self._remove(node)
+            if self._max_size is not None and val.nbytes > self._max_size:
+                return
+            node._tensor_value = val
+            self._entries[id(node)] = (weakref.ref(node), val.nbytes)
+            self._size += val.nbytes
+            self._evict()
+
+    def invalidate(self, node):
+        with self._lock:
+            self._remove(node)
+            node._tensor_value = None
+
+    def clear(self):
+        with self._lock:
+            for ref, _ in self._entries.values():
+                node = ref()
+                if node is not None:
+                    node._tensor_value = None
+            self._entries.clear()
+            self._size = 0
+
+    def _remove(self, node):
+        entry = self._entries.get(id(node))
+        # the id may belong to a node which doesn't exist anymore
+        if entry is not None and entry[0]() in (node, None):
+            del self._entries[id(node)]
+            self._size -= entry[1]
+
+    def _evict(self):
+        while self._max_size is not None and self._size > self._max_size and self._entries:
+            _, (ref, nbytes) = self._entries.popitem(last=False)
+            self._size -= nbytes
+            node = ref()
+            if node is not None:
+                node._tensor_value = None
+
+
+tensor_value_cache = TensorValueCache()
+
 
 class Node(object):
     """A Node - wrapper around onnx nodes that we use for graph manipulations."""
@@ -45,6 +139,8 @@ class Node(object):
         self._input = [i for i in node.input]
         self._output = [i for i in node.output]
         self._attr = {}
+        # decoded value of Const, managed by tensor_value_cache
+        self._tensor_value = None
 
         graph.set_node_by_name(self)
         # dict to original attributes
@@ -56,6 +152,17 @@ class Node(object):
     def input(self):
         return self._input
 
+    @input.setter
+    def input(self, val):
+        """Set op inputs, the graph's consumer index is updated accordingly.
+        In-place changes of the list returned by input should go through
+        Graph.replace_input instead, otherwise the index misses new consumers.
+        """
+        self._graph_check()
+        self.graph._unregister_node_inputs(self)
+        self._input = list(val)
+        self.graph._register_node_inputs(self)
+
     @property
     def output(self):
         return copy.deepcopy(self._output)
@@ -73,6 +180,7 @@ class Node(object):
         for o in self._output:
             utils.make_sure(o not in self.graph._output_to_node_name, "output %s already in output mapping", o)
             self.graph._output_to_node_name[o] = self.name
+        self.graph.mark_unsorted()
 
     @property
     def inputs(self):
@@ -173,9 +281,13 @@ class Node(object):
 
     def set_attr(self, name, value):
         self.attr[name] = helper.make_attribute(name, value)
+        if name == "value":
+            tensor_value_cache.invalidate(self)
 
     def set_attr_onnx(self, value):
         self.attr[value.name] = value
+        if value.name == "value":
+            tensor_value_cache.invalidate(self)
 
     @property
     def skip_conversion(self):
@@ -203,10 +315,11 @@ class Node(object):
         val = [self.graph.get_dtype(n) for n in self._output]
         return val
 
-    def get_tensor_value(self, as_list=True):
+    def get_tensor_value(self, as_list=True, copy=False):
         """Get value for onnx tensor.
         Args:
             as_list: whether return numpy ndarray in list.
+            copy: return a writable copy of the ndarray, otherwise it is a read-only view of the cached value.
         Returns:
             If as_list=True, return the array as a (possibly nested) list.
             Otherwise, return data of type np.ndarray.
@@ -220,9 +333,17 @@ class Node(object):
 
         t = self.get_attr("value")
         if t:
-            t = numpy_helper.to_array(helper.get_attribute_value(t))
+            val = tensor_value_cache.get(self)
+            if val is None:
+                val = numpy_helper.to_array(helper.get_attribute_value(t))
+                val.flags.writeable = False
+                tensor_value_cache.put(self, val)
             if as_list is True:
-                t = t.tolist()  # t might be scalar after tolist()
+                t = val.tolist()  # t might be scalar after tolist()
+            elif copy:
+                t = val.copy()
+            else:
+                t = val.view()
         return t
 
     def scalar_to_dim1(self):
@@ -235,6 +356,7 @@ class Node(object):
             t = helper.get_attribute_value(t)
             if not t.dims:
                 t.dims.extend([1])
+                tensor_value_cache.invalidate(self)
         return t.dims
 
     def set_tensor_value(self, new_val):
@@ -266,9 +388,15 @@ class Node(object):
 
         self.graph.contained_graphs[self.name].update({attr_name: graph})
         graph.parent_graph = self.graph
+        # implicit inputs of the node may have changed
+        self.graph.mark_unsorted()
 
-    def update_proto(self):
-        """Update protobuf from internal structure."""
+    def update_proto(self, external_data=None, max_initializer_size=None):
+        """Update protobuf from internal structure.
+        Args:
+            external_data: optional utils.ExternalDataWriter for the initializers of body graphs
+            max_initializer_size: optional max size of the initializers of body graphs, see Graph.make_graph
+        """
         nodes = [n for n in self._op.input]
         for node in nodes:
             self._op.input.remove(node)
@@ -285,7 +413,9 @@ class Node(object):
         attr_graphs = self.get_body_graphs()
         if attr_graphs:
             for attr_name, sub_graph in attr_graphs.items():
-                graph_proto = sub_graph.make_graph("graph for " + self.name + " " + attr_name)
+                graph_proto = sub_graph.make_graph("graph for " + self.name + " " + attr_name,
+                                                   external_data=external_data,
+                                                   max_initializer_size=max_initializer_size)
                 self.set_attr(attr_name, graph_proto)
 
         attr = [a for a in self.attr_onnx.values()]
@@ -338,6 +468,10 @@ class Graph(object):
         self._nodes = []
         self._nodes_by_name = {}
         self._output_to_node_name = {}
+        # {tensor name: {consumer node name: None}}, dict keeps consumers in a deterministic order
+        self._output_to_consumers = {}
+        # True if node list is known to be in topological order, reset by any edge change
+        self._is_sorted = False
         self.shapes = {}
 
         self._target = set(target)
@@ -379,7 +513,7 @@ class Graph(object):
                     body_graph.parent_graph = self
                     new_node.set_body_graph_as_attr(attr_name, body_graph)
 
-            self.replace_all_inputs(self.get_nodes(), o, new_output_name)
+            self.replace_all_inputs(o, new_output_name)
             self.make_node("Identity", [new_output_name], outputs=[o], op_name_scope=n.name + "_" + "graph_outputs")
             self.copy_shape(new_output_name, o)
             self.copy_dtype(new_output_name, o)
@@ -389,6 +523,10 @@ class Graph(object):
         return Graph([], output_shapes={}, dtypes={}, target=self._target, opset=self._opset,
                      extra_opset=self.extra_opset, output_names=[])
 
+    def snapshot(self):
+        """Return a GraphSnapshot, snapshot.restore() undoes all later changes of this graph."""
+        return GraphSnapshot(self)
+
     @property
     def opset(self):
         return self._opset
@@ -477,6 +615,7 @@ class Graph(object):
                 self.set_dtype(node.output[i], dtypes[i])
 
         self._nodes.append(node)
+        self._register_node_inputs(node)
         return node
 
     def remove_node(self, node_name):
@@ -490,6 +629,7 @@ class Graph(object):
         if node in self._order_sensitive_inputs:
             self._order_sensitive_inputs.remove(node)
 
+        self._unregister_node_inputs(node)
         for op_output in node.output:
             del self._output_to_node_name[op_output]
 
@@ -521,9 +661,11 @@ class Graph(object):
         self.contained_graphs = remained_sub_graphs
         self._nodes_by_name = {op.name: op for op in ops}
         self._output_to_node_name = {}
+        self._output_to_consumers = {}
         for op in ops:
             for op_output in op.output:
                 self._output_to_node_name[op_output] = op.name
+            self._register_node_inputs(op)
 
         for n in self._order_sensitive_inputs:
             if n not in ops:
@@ -534,11 +676,12 @@ class Graph(object):
 
         self._dtypes = remained_dtypes
         self._output_shapes = remained_shapes
+        self.mark_unsorted()
 
-    def update_proto(self):
+    def update_proto(self, external_data=None, max_initializer_size=None):
         """Update the onnx protobuf from out internal Node structure."""
         for node in self._nodes:
-            node.update_proto()
+            node.update_proto(external_data, max_initializer_size)
 
     def get_nodes(self):
         """Get node list."""
@@ -580,6 +723,32 @@ class Graph(object):
         for op_output in node.output:
             self._output_to_node_name[op_output] = node.name
 
+    def _register_node_inputs(self, node):
+        """Add node to the consumer index of all its inputs."""
+        for input_name in node.input:
+            self._output_to_consumers.setdefault(input_name, {})[node.name] = None
+        self.mark_unsorted()
+
+    def mark_unsorted(self):
+        """Invalidate topological order of this graph and its parent graphs.
+        Parents are included since a new edge in a body graph may be a new implicit input of its owner.
+        """
+        g = self
+        while g is not None:
+            g._is_sorted = False
+            g = g.parent_graph
+
+    def _unregister_node_inputs(self, node, input_names=None):
+        """Remove node from the consumer index of input_names, by default all its inputs."""
+        if input_names is None:
+            input_names = node.input
+        for input_name in input_names:
+            consumers = self._output_to_consumers.get(input_name)
+            if consumers is not None:
+                consumers.pop(node.name, None)
+                if not consumers:
+                    del self._output_to_consumers[input_name]
+
     def add_graph_input(self, name, dtype=None, shape=None):
         """Add placeholder node as graph's input. Order matters only for subgraph.
            Placeholders in original graph are assumed for main graph, order not matters.
@@ -636,10 +805,10 @@ class Graph(object):
             for i, v in enumerate(shape):
                 if v is None:
                     shape[i] = -1
-            # hack to allow utils.ONNX_UNKNOWN_DIMENSION to override batchsize if needed.
+            # hack to allow utils.get_unknown_dimension() to override batchsize if needed.
             # default is -1.
             if shape[0] == -1:
-                shape[0] = utils.ONNX_UNKNOWN_DIMENSION
+                shape[0] = utils.get_unknown_dimension()
             return shape
         return shape
 
@@ -659,74 +828,76 @@ class Graph(object):
             self.set_shape(output_name, shape)
 
     def topological_sort(self, ops):
-        """Topological sort of graph."""
-
-        def _push_stack(stack, node, in_stack):
-            stack.append(node)
-            if node in in_stack:
-                raise ValueError('Graph has cycles.')
-            in_stack[node] = True
-
-        def _get_unvisited_child(g, node, not_visited):
-            for child in g[node]:
-                if child in not_visited:
-                    return child
-            return -1
+        """Topological sort of graph, does nothing if graph nodes are known to be sorted already."""
+        is_graph_nodes = ops is self._nodes
+        if is_graph_nodes and self._is_sorted:
+            return
 
         n = len(ops)
-        g = [[] for _ in range(n)]
         op_name_to_index = {}
         for i, op in enumerate(ops):
             op_name_to_index[op.name] = i
 
+        # Kahn's algorithm, edges are resolved via the producer index of the graph
+        consumers = [[] for _ in range(n)]
+        in_degree = [0] * n
+        # an already sorted list keeps its order
+        in_order = True
         for i, op in enumerate(ops):
             all_input = set(op.input)
-            implicit_inputs = op.get_implicit_inputs()
-            all_input |= set(implicit_inputs)
-            # remove those empty inputs
-            all_input = list(filter(lambda a: a != '', all_input))
+            if op.name in self.contained_graphs:
+                all_input |= set(op.get_implicit_inputs())
             for inp in all_input:
-                j = self.get_node_by_output(inp)
-                if self.parent_graph and j.name not in op_name_to_index:
+                # skip those empty inputs
+                if not inp:
+                    continue
+                j = op_name_to_index.get(self._output_to_node_name.get(inp))
+                if j is None:
                     # there might be some outer-scoped inputs for an inner Graph.
-                    pass
-                else:
-                    g[op_name_to_index[j.name]].append(i)
-
-        # label for each op. highest = sink nodes.
-        label = [-1 for _ in range(n)]
-        stack = []
-        in_stack = dict()
-        not_visited = dict.fromkeys([i for i in range(n)])
-        label_counter = n - 1
-
-        while not_visited:
-            node = list(not_visited.keys())[0]
-            _push_stack(stack, node, in_stack)
-            while stack:
-                node = _get_unvisited_child(g, stack[-1], not_visited)
-                if node != -1:
-                    _push_stack(stack, node, in_stack)
-                else:
-                    node = stack.pop()
-                    in_stack.pop(node)
-                    not_visited.pop(node)
-                    label[node] = label_counter
-                    label_counter -= 1
+                    utils.make_sure(self.parent_graph is not None and self.get_node_by_output(inp) is not None,
+                                    "cannot find producer of %s for node %s", inp, op.name)
+                    continue
+                consumers[j].append(i)
+                in_degree[i] += 1
+                in_order = in_order and j < i
 
-        ret = [x for _, x in sorted(zip(label, ops))]
-        self.reset_nodes(ret)
+        if in_order:
+            ret = list(ops)
+        else:
+            ready = collections.deque(i for i in range(n) if in_degree[i] == 0)
+            ret = []
+            while ready:
+                i = ready.popleft()
+                ret.append(ops[i])
+                for j in consumers[i]:
+                    in_degree[j] -= 1
+                    if in_degree[j] == 0:
+                        ready.append(j)
+
+            if len(ret) != n:
+                raise ValueError("Graph has cycles.")
+
+        if is_graph_nodes:
+            # same nodes in a new order, nothing to prune
+            self._nodes = ret
+        else:
+            self.reset_nodes(ret)
+        self._is_sorted = True
 
-    def make_graph(self, doc, graph_name="tf2onnx"):
+    def make_graph(self, doc, graph_name="tf2onnx", external_data=None, max_initializer_size=None):
         """
         Create GraphProto for onnx from internal graph.
         Args:
             optimize: optimize graph via onnx
             doc: text for doc string of the graph
+            external_data: optional utils.ExternalDataWriter, large initializers are written to its side file
+                instead of being copied into the GraphProto
+            max_initializer_size: if given, consts larger than this many bytes are left out of the initializers,
+                they stay graph inputs with shape and type. Used for models only made for shape inference.
         """
         self.delete_unused_nodes(self.outputs)
         self.topological_sort(self.get_nodes())
-        self.update_proto()
+        self.update_proto(external_data, max_initializer_size)
 
         # TODO: we'd want to do something like this so that transpose optimizer is active
         # for  all (unit) tests
@@ -759,6 +930,8 @@ class Graph(object):
                 # copy the tensor value, set its name to current node's output, add as initializer
                 value = op.inputs[0].get_tensor_value(as_list=False)
                 tensor = numpy_helper.from_array(value, op.output[0])
+                if external_data is not None:
+                    tensor = external_data.make_external(tensor)
                 initializers.append(tensor)
                 placeholder_default_const_ops.append(op.inputs[0])
 
@@ -771,6 +944,10 @@ class Graph(object):
             t = op.get_attr("value")
             tensor = helper.get_attribute_value(t)
             tensor.name = op.output[0]
+            if max_initializer_size is not None and utils.get_tensor_nbytes(tensor) > max_initializer_size:
+                continue
+            if external_data is not None:
+                tensor = external_data.make_external(tensor)
             initializers.append(tensor)
 
         # create input_tensor_values
@@ -790,14 +967,18 @@ class Graph(object):
 
         return graph
 
-    def make_model(self, graph_doc, optimize=False, graph_name="tf2onnx", **kwargs):
+    def make_model(self, graph_doc, optimize=False, graph_name="tf2onnx", external_data=None,
+                   max_initializer_size=None, **kwargs):
         """
         Create final ModelProto for onnx from internal graph.
         Args:
             optimize: optimize graph via onnx
             doc: text for doc string of the model
+            external_data: optional utils.ExternalDataWriter, large initializers are written to its side file
+                while the model is made, so the model never holds them
+            max_initializer_size: leave out consts larger than this many bytes, see make_graph
         """
-        graph = self.make_graph(graph_doc, graph_name)
+        graph = self.make_graph(graph_doc, graph_name, external_data, max_initializer_size)
 
         if "producer_name" not in kwargs:
             kwargs = {"producer_name": "tf2onnx",
@@ -878,6 +1059,8 @@ class Graph(object):
             if name == to_be_removed:
                 del node.input[i]
                 break
+        if node.graph is not None and to_be_removed not in node.input:
+            node.graph._unregister_node_inputs(node, [to_be_removed])
         # don't remove output from parent since others might depend on it
         return True
 
@@ -897,10 +1080,7 @@ class Graph(object):
             name = utils.make_name(node.name)
         new_output = port_name(name)
         new_node = self.make_node(op_type, [input_name], attr=kwargs, outputs=[new_output], name=name, domain=domain)
-        for i, n in enumerate(node.input):
-            if n == input_name:
-                node.input[i] = new_output
-                break
+        self.replace_input(node, input_name, new_output, node.input.index(input_name))
         return new_node
 
     def insert_new_node_on_output(self, op_type, output_name, name, domain=None, **kwargs):
@@ -922,53 +1102,66 @@ class Graph(object):
         new_output = port_name(name)
         new_node = self.make_node(op_type, [output_name], attr=kwargs, outputs=[new_output], name=name, domain=domain)
 
-        to_replace = [n for n in self.get_nodes() if n != new_node]
-        self.replace_all_inputs(to_replace, output_name, new_output)
+        to_replace = [n for n in self.find_output_consumers(output_name) if n != new_node]
+        self.replace_all_inputs(output_name, new_output, ops=to_replace)
         return new_node
 
     def find_output_consumers(self, output_name):
         """Find all nodes consuming a given output."""
         nodes = []
-        for node in self.get_nodes():
-            if output_name in node.input:
+        for name in self._output_to_consumers.get(output_name, {}):
+            node = self._nodes_by_name.get(name)
+            # entries might be stale if an input was dropped in place, for example by "del node.input[i]"
+            if node is not None and output_name in node.input:
                 nodes.append(node)
 
-            # find consumers in sub graphs
-            body_graphs = node.get_body_graphs()
-            if body_graphs:
-                for g in body_graphs.values():
-                    nodes.extend(g.find_output_consumers(output_name))
+        # find consumers in sub graphs
+        for body_graphs in self.contained_graphs.values():
+            for g in body_graphs.values():
+                nodes.extend(g.find_output_consumers(output_name))
         return nodes
 
-    @staticmethod
-    def replace_all_inputs(ops, old_input, new_input):
-        """Replace all inputs pointing to old_input with new_input."""
+    def replace_all_inputs(self, old_input, new_input, ops=None):
+        """Replace all inputs pointing to old_input with new_input.
+        Args:
+            ops: nodes to update, default is all consumers of old_input in current graph and its body graphs
+        """
         if old_input == new_input:
             return
 
+        if ops is None:
+            consumers = [self._nodes_by_name.get(n) for n in self._output_to_consumers.get(old_input, {})]
+            ops = [n for n in consumers if n is not None]
+            body_graphs = [g for b_g in self.contained_graphs.values() for g in b_g.values()]
+        else:
+            body_graphs = []
+            for node in ops:
+                if node.get_body_graphs():
+                    body_graphs.extend(node.get_body_graphs().values())
+
         for node in ops:
             if old_input in node.input and new_input in node.output:
                 raise RuntimeError("creating a circle in the graph is not allowed: " + node.name)
+            self.replace_input(node, old_input, new_input)
 
-            for i, input_name in enumerate(node.input):
-                if input_name == old_input:
-                    node.input[i] = new_input
-
-            # modify references in sub graphs
-            body_graphs = node.get_body_graphs()
-            if body_graphs:
-                for g in body_graphs.values():
-                    g.replace_all_inputs(g.get_nodes(), old_input, new_input)
+        # modify references in sub graphs
+        for g in body_graphs:
+            g.replace_all_inputs(old_input, new_input)
 
     @staticmethod
-    def replace_input(node, old_input, new_input):
-        """Replace node."""
+    def replace_input(node, old_input, new_input, input_index=None):
+        """Replace node input old_input with new_input, at input_index only if it is given."""
         assert isinstance(node, Node) and isinstance(old_input, six.text_type) and isinstance(new_input, six.text_type)
         is_replaced = False
         for i, input_name in enumerate(node.input):
-            if input_name == old_input:
+            if input_name == old_input and (input_index is None or input_index == i):
                 node.input[i] = new_input
                 is_replaced = True
+
+        if is_replaced and node.graph is not None:
+            node.graph._register_node_inputs(node)
+            if old_input not in node.input:
+                node.graph._unregister_node_inputs(node, [old_input])
         return is_replaced
 
     def _extract_sub_graph_nodes(self, dest_node, input_checker=None):
@@ -1045,17 +1238,129 @@ class Graph(object):
             print("WARNING: outputs not specified, delete_unused_nodes not taking effect.")
 
 
+def _copy_state(val):
+    """Copy nested dicts, lists and sets, the other objects in them are shared.
+    The consumer index and contained_graphs are dicts of dicts, a shallow copy would share their inner dicts
+    with the live graph.
+    """
+    if isinstance(val, dict):
+        res = copy.copy(val)
+        for k, v in val.items():
+            res[k] = _copy_state(v)
+        return res
+    if isinstance(val, list):
+        return [_copy_state(v) for v in val]
+    if isinstance(val, set):
+        return copy.copy(val)
+    return val
+
+
+class GraphSnapshot(object):
+    """State of a graph and its body graphs that can be restored after a failed transformation.
+    Only the graph structure is copied, node protos and tensors are shared. Transformations replace
+    attributes with Node.set_attr instead of changing them in place, so sharing them is safe.
+    """
+
+    def __init__(self, graph):
+        self.graph = graph
+        self._graph_states = []
+        self._node_states = []
+        graphs = [graph]
+        for g in graphs:
+            self._graph_states.append((g, _copy_state(g.__dict__)))
+            for node in g.get_nodes():
+                self._node_states.append((node, _copy_state(node.__dict__), node.type, node.domain))
+            for body_graphs in g.contained_graphs.values():
+                graphs.extend(body_graphs.values())
+
+    def restore(self):
+        """Bring the graph back to the state of the snapshot, nodes created since are dropped."""
+        for g, state in self._graph_states:
+            g.__dict__.clear()
+            g.__dict__.update(_copy_state(state))
+        for node, state, op_type, domain in self._node_states:
+            node.__dict__.clear()
+            node.__dict__.update(_copy_state(state))
+            node.type = op_type
+            node.domain = domain
+            # the decoded value may belong to an attribute set after the snapshot
+            tensor_value_cache.invalidate(node)
+        return self.graph
+
+
 class GraphUtil(object):
     """Utilities for Graph manipulation."""
 
     @staticmethod
-    def optimize_graph(graph, debug=False):
-        return optimizer.optimize_graph(graph, debug)
+    def optimize_graph(graph, debug=False, profiler=None, optimizers=None, optimizer_options=None):
+        return optimizer.optimize_graph(graph, debug, profiler, optimizers, optimizer_options=optimizer_options)
 
     @staticmethod
-    def optimize_model_proto(onnx_model_proto, debug=False):
+    def infer_missing_shapes(graph):
+        """Fill in the shapes and dtypes the graph doesn't know, with onnx shape inference.
+        Shape inference needs a serialized model, so it only runs if some node output onnx can infer misses its
+        shape or dtype. Large consts are left out of that model, shape inference only needs their shape and type.
+
+        Returns:
+            number of node outputs that got a shape or dtype
+        """
+        if not GraphUtil._has_missing_shapes(graph):
+            return 0
+        try:
+            inferred_model = shape_inference.infer_shapes(
+                graph.make_model("shape inference", max_initializer_size=SHAPE_INFERENCE_MAX_INITIALIZER_SIZE))
+        except Exception as ex:
+            log.warning("onnx shape inference failed, shapes stay unknown: %s", ex)
+            return 0
+        return GraphUtil._update_missing_shapes(graph, inferred_model.graph)
+
+    @staticmethod
+    def _has_missing_shapes(graph):
+        graphs = [graph]
+        for g in graphs:
+            for node in g.get_nodes():
+                # onnx can't infer the outputs of ops of other domains either
+                if not utils.is_onnx_domain(node.domain):
+                    continue
+                for out in node.output:
+                    if out and (g._output_shapes.get(out) is None or g._dtypes.get(out) is None):
+                        return True
+            for body_graphs in g.contained_graphs.values():
+                graphs.extend(body_graphs.values())
+        return False
+
+    @staticmethod
+    def _update_missing_shapes(graph, graph_proto):
+        value_infos = [v for v in list(graph_proto.value_info) + list(graph_proto.output)
+                       if v.type.tensor_type.HasField("shape")]
+        shapes, dtypes = GraphUtil._parse_shape_and_type_from_value_infos(value_infos)
+        updated = 0
+        for node in graph.get_nodes():
+            for out in node.output:
+                changed = False
+                if out in shapes and graph._output_shapes.get(out) is None:
+                    graph._output_shapes[out] = shapes[out]
+                    changed = True
+                if dtypes.get(out) and graph._dtypes.get(out) is None:
+                    graph._dtypes[out] = dtypes[out]
+                    changed = True
+                updated += changed
+
+        for node_proto in graph_proto.node:
+            body_graphs = graph.contained_graphs.get(node_proto.name, {})
+            for attr in node_proto.attribute:
+                if attr.HasField("g") and attr.name in body_graphs:
+                    updated += GraphUtil._update_missing_shapes(body_graphs[attr.name], attr.g)
+        return updated
+
+    @staticmethod
+    def optimize_model_proto(onnx_model_proto, debug=False, profiler=None, optimizers=None):
         """Optimize the model proto, for example: eliminating all useless Transpose pairs.
 
+        Args:
+            profiler: optional tf2onnx.profiler.Profiler collecting statistics of each optimizer
+            optimizers: names of the optimizers to run, default are the ones of the default optimization level
+
         Returns:
             model proto after optimization, if optimizer run successfully
             or None, if exceptions happens
@@ -1063,7 +1368,7 @@ class GraphUtil(object):
         try:
             kwargs = GraphUtil.get_onnx_model_properties(onnx_model_proto)
             graph = GraphUtil.create_graph_from_onnx_model(onnx_model_proto)
-            graph = GraphUtil.optimize_graph(graph, debug)
+            graph = GraphUtil.optimize_graph(graph, debug, profiler, optimizers)
             model_proto = graph.make_model(onnx_model_proto.graph.doc_string,
                                            graph_name=onnx_model_proto.graph.name, **kwargs)
 
@@ -1102,9 +1407,10 @@ class GraphUtil(object):
     @staticmethod
     def create_graph_from_onnx_model(onnx_model_proto):
         """Create Graph loading onnx model proto."""
-        # apply shape inference on the model
-        inferred_model = shape_inference.infer_shapes(onnx_model_proto)
-        graph_proto = inferred_model.graph
+        # apply shape inference on the model, unless value infos are given for all node outputs
+        graph_proto = onnx_model_proto.graph
+        if not GraphUtil._has_all_value_infos(graph_proto):
+            graph_proto = shape_inference.infer_shapes(onnx_model_proto).graph
 
         opset_version = None
         extra_opset = []
@@ -1159,6 +1465,20 @@ class GraphUtil(object):
                     n.set_body_graph_as_attr(attr_name, sub_g)
         return g
 
+    @staticmethod
+    def _has_all_value_infos(graph_proto):
+        known = set(v.name for v in graph_proto.value_info if v.type.tensor_type.HasField("shape"))
+        known.update(v.name for v in graph_proto.output)
+        known.update(v.name for v in graph_proto.input)
+        known.update(t.name for t in graph_proto.initializer)
+        for n in graph_proto.node:
+            if any(out and out not in known for out in n.output):
+                return False
+            for attr in n.attribute:
+                if attr.HasField("g") and not GraphUtil._has_all_value_infos(attr.g):
+                    return False
+        return True
+
     @staticmethod
     def get_node_count_from_onnx_graph(graph_proto):
         op_cnt = collections.Counter()
@@ -12,6 +12,7 @@ import collections
 import inspect
 
 from tf2onnx import constants
+from tf2onnx.context import get_current_context
 
 # pylint: disable=unused-argument,missing-docstring,invalid-name
 
@@ -88,7 +89,11 @@ class tf_op:
                     if target_opset <= m and op_map:
                         ops_mapping.update(op_map)
 
-        tf_op._MAPPING = ops_mapping
+        context = get_current_context()
+        if context is not None:
+            context.ops_mapping = ops_mapping
+        else:
+            tf_op._MAPPING = ops_mapping
         return ops_mapping
 
     @staticmethod
@@ -100,7 +105,9 @@ class tf_op:
 
         :param name: The operator name.
         """
-        map_info = tf_op._MAPPING.get(name)
+        context = get_current_context()
+        mapping = context.ops_mapping if context is not None else tf_op._MAPPING
+        map_info = mapping.get(name)
         if map_info is None:
             return None
         return map_info
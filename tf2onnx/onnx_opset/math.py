@@ -87,8 +87,8 @@ class MinMaxOp:
             cast_node = ctx.insert_new_node_on_output("Cast", node.output[0], name=cast_name, to=origin_dtype)
             ctx.set_dtype(cast_node.output[0], origin_dtype)
             ctx.copy_shape(node.output[0], cast_node.output[0])
-            to_replace = [n for n in ctx.get_nodes() if n != cast_node]
-            ctx.replace_all_inputs(to_replace, node.output[0], cast_node.output[0])
+            to_replace = [n for n in ctx.find_output_consumers(node.output[0]) if n != cast_node]
+            ctx.replace_all_inputs(node.output[0], cast_node.output[0], ops=to_replace)
 
         shapeo = ctx.get_shape(node.output[0])
         needs_broadcast_op = []
@@ -109,7 +109,7 @@ class MinMaxOp:
                 # use add as 'broadcast' op
                 add_node = ctx.make_node("Add", [input_node.output[0], sub_node.output[0]],
                                          op_name_scope=input_node.name)
-                node.input[i] = add_node.output[0]
+                ctx.replace_input(node, node.input[i], add_node.output[0], i)
 
 
 @tf_op("Softmax")
@@ -208,7 +208,7 @@ class Pow:
             ctx.remove_input(node, node.input[1])
             op_name = utils.make_name(node.name)
             mul_op = ctx.insert_new_node_on_output("Mul", node.output[0], name=op_name)
-            mul_op.input.append(b)
+            mul_op.input = mul_op.input + [b]
             op_name = utils.make_name(node.name)
             exp_op = ctx.insert_new_node_on_output("Exp", mul_op.output[0], name=op_name)
             ctx.copy_shape(node.output[0], exp_op.output[0])
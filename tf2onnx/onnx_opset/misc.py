@@ -30,7 +30,7 @@ class MoveToIdent:
             # if identity has a const as input, remove it
             input_name = node.input[0]
             output_name = node.output[0]
-            ctx.replace_all_inputs(ctx.get_nodes(), output_name, input_name)
+            ctx.replace_all_inputs(output_name, input_name)
             ctx.remove_node(node.name)
 
 
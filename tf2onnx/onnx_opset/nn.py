@@ -110,7 +110,7 @@ def conv_convert_inputs(ctx, node, with_kernel=False, new_kernel_shape=None,
                 ctx.make_const(shape_name, np.array(new_kernel_shape, dtype=np.int64))
                 input_name = node.input[1]
                 reshape = ctx.insert_new_node_on_input(node, "Reshape", input_name)
-                reshape.input.append(shape_name)
+                reshape.input = reshape.input + [shape_name]
                 reshape.skip_conversion = True
             ctx.set_shape(reshape.output[0], new_kernel_shape)
 
@@ -348,7 +348,7 @@ class BiasAdd:
                 ctx.make_const(shape_name, np.array(new_broadcast_shape, dtype=np.int64))
                 op_name = node.input[1]
                 reshape_node = ctx.insert_new_node_on_input(node, "Reshape", op_name)
-                reshape_node.input.append(shape_name)
+                reshape_node.input = reshape_node.input + [shape_name]
                 ctx.set_shape(reshape_node.output[0], new_broadcast_shape)
 
 
@@ -421,14 +421,14 @@ class BatchNorm:
                                       dtype=val_type)
             new_mean_node_name = utils.make_name(node.name)
             ctx.make_const(new_mean_node_name, new_mean_value)
-            node.input[3] = new_mean_node_name
+            ctx.replace_input(node, node.input[3], new_mean_node_name, 3)
 
         if var_shape != scale_shape:
             new_var_value = np.array(np.resize(node.inputs[4].get_tensor_value(as_list=False), scale_shape),
                                      dtype=val_type)
             new_val_node_name = utils.make_name(node.name)
             ctx.make_const(new_val_node_name, new_var_value)
-            node.input[4] = new_val_node_name
+            ctx.replace_input(node, node.input[4], new_val_node_name, 4)
 
 
 @tf_op(["SpaceToDepth", "DepthToSpace"])
@@ -673,7 +673,7 @@ class SparseSoftmaxCrossEntropyWithLogits:
         logit_name = node.input[0]
         depth = ctx.get_shape(logit_name)[-1]
         # if number of classes is unknown or too large
-        if depth == utils.ONNX_UNKNOWN_DIMENSION or depth > 20000:
+        if depth == utils.get_unknown_dimension() or depth > 20000:
             sparse_softmax_cross_entropy_with_logits_op_by_gathernd(ctx, node, **kwargs)
             return
         logit_dtype = ctx.get_dtype(logit_name)
@@ -0,0 +1,119 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT license.
+
+"""
+tf2onnx.tf2onnx.onnx_opset.quantize - tensorflow fake quantization to QuantizeLinear/DequantizeLinear pairs
+"""
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import logging
+
+import numpy as np
+from onnx import onnx_pb
+
+from tf2onnx import utils
+from tf2onnx.handler import tf_op
+
+logging.basicConfig(level=logging.INFO)
+log = logging.getLogger("onnx_opset.quantize")
+
+# pylint: disable=unused-argument,missing-docstring
+
+
+def get_fake_quant_params(min_val, max_val, num_bits=8, narrow_range=False):
+    """Scale and uint8 zero point of the range tensorflow fake quantization nudges [min_val, max_val] to.
+    min_val and max_val are scalars or per-channel arrays.
+    """
+    min_val = np.asarray(min_val, dtype=np.float32)
+    max_val = np.asarray(max_val, dtype=np.float32)
+    quant_min = 1 if narrow_range else 0
+    quant_max = 2 ** num_bits - 1
+    scale = (max_val - min_val) / (quant_max - quant_min)
+    scale = np.where(scale > 0, scale, 1.).astype(np.float32)
+    # tensorflow moves the range so that 0 is exactly representable
+    zero_point = np.clip(np.round(quant_min - min_val / scale), quant_min, quant_max)
+    return scale, zero_point.astype(np.uint8)
+
+
+def _find_const_input(node, index):
+    # consts of frozen models are read through Identity ops
+    inp = node.inputs[index]
+    while inp is not None and inp.type == "Identity":
+        inp = inp.inputs[0]
+    return inp.get_tensor_value(as_list=False) if inp is not None and inp.is_const() else None
+
+
+def _get_const_input(node, index):
+    val = _find_const_input(node, index)
+    utils.make_sure(val is not None, "%s: min and max of %s must be const", node.name, node.type)
+    return val
+
+
+def _convert_fake_quant(ctx, node, min_val, max_val, axis=None):
+    """Turn node into DequantizeLinear of a QuantizeLinear of its first input."""
+    num_bits = node.get_attr("num_bits")
+    num_bits = num_bits.i if num_bits else 8
+    # uint8 saturates to [0, 255], other bit widths would need their own clipping
+    utils.make_sure(num_bits == 8, "%s: only 8 bit fake quantization is supported, not %d", node.name, num_bits)
+    narrow_range = node.get_attr("narrow_range")
+    narrow_range = bool(narrow_range.i) if narrow_range else False
+    scale, zero_point = get_fake_quant_params(min_val, max_val, num_bits, narrow_range)
+
+    scale_node = ctx.make_const(utils.make_name(node.name + "_scale"), scale)
+    zero_point_node = ctx.make_const(utils.make_name(node.name + "_zero_point"), zero_point)
+    attr = {"axis": axis} if axis is not None else {}
+    inp = node.input[0]
+    if narrow_range:
+        # tensorflow clips to [1, 255] but uint8 saturates at 0, so clip the input to the nudged min first.
+        # Max broadcasts the per-channel min along the last axis, Clip only takes scalars
+        nudged_min = ((1 - zero_point.astype(np.float32)) * scale).astype(np.float32)
+        weights = _find_const_input(node, 0)
+        if weights is not None:
+            # weights are clipped right away, fold_const then folds the QuantizeLinear into integer weights
+            clipped = ctx.make_const(utils.make_name(node.name + "_clipped"),
+                                     np.maximum(weights, nudged_min).astype(weights.dtype))
+            inp = clipped.output[0]
+        else:
+            # fuse_qlinear moves the clip behind the fused QLinear op
+            nudged_min_node = ctx.make_const(utils.make_name(node.name + "_nudged_min"), nudged_min)
+            clip = ctx.make_node("Max", [inp, nudged_min_node.output[0]], shapes=[ctx.get_shape(inp)],
+                                 dtypes=[ctx.get_dtype(inp)], op_name_scope=node.name)
+            inp = clip.output[0]
+    quantize = ctx.make_node("QuantizeLinear", [inp, scale_node.output[0], zero_point_node.output[0]],
+                             attr=attr, shapes=[ctx.get_shape(node.input[0])], dtypes=[onnx_pb.TensorProto.UINT8],
+                             op_name_scope=node.name)
+    node.type = "DequantizeLinear"
+    node.input = [quantize.output[0], scale_node.output[0], zero_point_node.output[0]]
+    if axis is not None:
+        node.set_attr("axis", axis)
+
+
+@tf_op("FakeQuantWithMinMaxArgs")
+class FakeQuantWithMinMaxArgs:
+    @classmethod
+    def version_10(cls, ctx, node, **kwargs):
+        # T outputs = FakeQuantWithMinMaxArgs(T inputs, @float min, @float max, @int num_bits, @bool narrow_range)
+        min_val = node.get_attr("min")
+        max_val = node.get_attr("max")
+        # defaults of tensorflow
+        _convert_fake_quant(ctx, node, min_val.f if min_val else -6., max_val.f if max_val else 6.)
+
+
+@tf_op("FakeQuantWithMinMaxVars")
+class FakeQuantWithMinMaxVars:
+    @classmethod
+    def version_10(cls, ctx, node, **kwargs):
+        # T outputs = FakeQuantWithMinMaxVars(T inputs, T min, T max, @int num_bits, @bool narrow_range)
+        _convert_fake_quant(ctx, node, _get_const_input(node, 1), _get_const_input(node, 2))
+
+
+@tf_op("FakeQuantWithMinMaxVarsPerChannel")
+class FakeQuantWithMinMaxVarsPerChannel:
+    @classmethod
+    def version_13(cls, ctx, node, **kwargs):
+        # T outputs = FakeQuantWithMinMaxVarsPerChannel(T inputs, T min, T max, @int num_bits, @bool narrow_range)
+        # min and max are per last dimension, per axis QuantizeLinear is new in opset 13
+        _convert_fake_quant(ctx, node, _get_const_input(node, 1), _get_const_input(node, 2), axis=-1)
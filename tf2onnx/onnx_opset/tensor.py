@@ -73,7 +73,7 @@ class Identity:
             # if identity has a const as input, remove it
             input_name = node.input[0]
             output_name = node.output[0]
-            ctx.replace_all_inputs(ctx.get_nodes(), output_name, input_name)
+            ctx.replace_all_inputs(output_name, input_name)
             ctx.remove_node(node.name)
 
 
@@ -476,7 +476,7 @@ class ExpandDims:
             shape_name = utils.make_name(node.name)
             ctx.make_const(shape_name, np.array(shape, dtype=np.int64))
             node.type = "Reshape"
-            node.input[1] = shape_name
+            ctx.replace_input(node, node.input[1], shape_name, 1)
             return
 
         # if there is more than one -1 in the shape, Reshape won't support.
@@ -661,7 +661,7 @@ class Pack:
             new_node = ctx.make_node("Unsqueeze", [node.input[i]], op_name_scope=node.name, attr={"axes": [axis]},
                                      shapes=[shape], dtypes=[dtype])
             output_name = new_node.output[0]
-            node.input[i] = output_name
+            ctx.replace_input(node, node.input[i], output_name, i)
             inputs.append(output_name)
 
         shapes = node.output_shapes
@@ -670,7 +670,7 @@ class Pack:
         # concat all unqueezes
         concat = ctx.make_node("Concat", inputs, op_name_scope=node.name, attr={"axis": axis},
                                shapes=shapes, dtypes=dtypes)
-        ctx.replace_all_inputs(ctx.get_nodes(), node.output[0], concat.output[0])
+        ctx.replace_all_inputs(node.output[0], concat.output[0])
 
 
 @tf_op("Unpack")
@@ -718,9 +718,7 @@ class OneHot:
         const_name = utils.make_name(node.name)
         ctx.make_const(const_name, eye)
         # setup gather inputs
-        del node.input[:]
-        node.input.append(const_name)
-        node.input.append(indices_name)
+        node.input = [const_name, indices_name]
         node.type = "Gather"
         if axis.i == 0:
             # TODO: revisit for rank > 1
@@ -753,15 +751,15 @@ class OneHot:
         indices = node.input[0]
         if ctx.is_target(constants.TARGET_RS6) and ctx.get_dtype(indices) != onnx_pb.TensorProto.INT64:
             indices = ctx.make_node("Cast", [indices], attr={"to": onnx_pb.TensorProto.INT64}).output[0]
-        node.input[0] = indices
+        ctx.replace_input(node, node.input[0], indices, 0)
 
         if ctx.is_target(constants.TARGET_RS6) and ctx.get_dtype(depth) != onnx_pb.TensorProto.INT64:
             depth = ctx.make_node("Cast", [depth], attr={"to": onnx_pb.TensorProto.INT64}).output[0]
-        node.input[1] = depth
+        ctx.replace_input(node, node.input[1], depth, 1)
 
         if ctx.is_target(constants.TARGET_RS6) and output_dtype != onnx_pb.TensorProto.INT64:
             off_on_value = ctx.make_node("Cast", [off_on_value], attr={"to": onnx_pb.TensorProto.INT64}).output[0]
-        node.input[2] = off_on_value
+        ctx.replace_input(node, node.input[2], off_on_value, 2)
 
         del node.input[3]
 
@@ -6,22 +6,52 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
+import logging
 import sys
+import time
 import traceback
 from collections import OrderedDict
 
+from tf2onnx.optimizer.const_dedup_optimizer import ConstDedupOptimizer
 from tf2onnx.optimizer.const_fold_optimizer import ConstFoldOptimizer
+from tf2onnx.optimizer.conv_bn_optimizer import ConvBatchNormOptimizer
+from tf2onnx.optimizer.float16_optimizer import DEFAULT_KEEP_FP32_OPS, Float16Optimizer
+from tf2onnx.optimizer.gemm_optimizer import GemmOptimizer
 from tf2onnx.optimizer.identity_optimizer import IdentityOptimizer
+from tf2onnx.optimizer.layout_optimizer import LayoutOptimizer
+from tf2onnx.optimizer.loop_invariant_optimizer import LoopInvariantOptimizer
 from tf2onnx.optimizer.merge_duplicated_nodes_optimizer import MergeDuplicatedNodesOptimizer
+from tf2onnx.optimizer.qlinear_optimizer import QLinearFusionOptimizer
+from tf2onnx.optimizer.quantize_optimizer import QUANTIZATION_MODES, QuantizeOptimizer
 from tf2onnx.optimizer.transpose_optimizer import TransposeOptimizer
+from tf2onnx.profiler import Profiler
+from tf2onnx import utils
 
 
 # pylint: disable=missing-docstring, broad-except
 
+logger = logging.getLogger("tf2onnx.optimizer")
+
 # optimizer sequence need to be considered carefully
+# Float16Optimizer and QuantizeOptimizer change the precision of the model, they are not part of any level
+# and run on request only
 _optimizers = OrderedDict([
+    # layout_opt assigns NCHW to whole regions, transpose_opt then cancels the remaining transposes locally
+    ("layout_opt", LayoutOptimizer),
     ("transpose_opt", TransposeOptimizer),
     ("fold_const", ConstFoldOptimizer),
+    # fuse_conv_bn needs the const inputs of BatchNormalization folded
+    ("fuse_conv_bn", ConvBatchNormOptimizer),
+    # fuse_qlinear needs the bias Add of the Conv next to it, after transpose_opt moved the Transposes away
+    ("fuse_qlinear", QLinearFusionOptimizer),
+    # fuse_gemm should be used after fold_const which already transposes const weights
+    ("fuse_gemm", GemmOptimizer),
+    # hoist_loop_invariants should be used before dedup_const and merge_duplicated_nodes,
+    # hoisted consts and nodes may equal those of the outer graph
+    ("hoist_loop_invariants", LoopInvariantOptimizer),
+    # dedup_const should be used after the optimizers creating consts,
+    # nodes consuming merged consts can then be merged by merge_duplicated_nodes
+    ("dedup_const", ConstDedupOptimizer),
     # merge_duplicated_nodes should be used after transpose_opt
     # for transpose_opt may have some trans nodes that can be merge
     ("merge_duplicated_nodes", MergeDuplicatedNodesOptimizer),
@@ -29,14 +59,152 @@ _optimizers = OrderedDict([
 ])
 
 
-def optimize_graph(graph, debug=False):
-    try:
-        opts = _get_optimizers()
-        for opt in opts.values():
-            graph = opt(debug=debug).optimize(graph)
+# lowest optimization level a pass is enabled at:
+# 1 - cleanups keeping the graph structure, 2 - exact rewrites of the graph structure,
+# 3 - rewrites that may change float results slightly, like folding BatchNormalization into Conv weights
+_optimizer_levels = {
+    "layout_opt": 2,
+    "transpose_opt": 2,
+    "fold_const": 1,
+    "fuse_conv_bn": 3,
+    "fuse_qlinear": 3,
+    "fuse_gemm": 2,
+    "hoist_loop_invariants": 2,
+    "dedup_const": 1,
+    "merge_duplicated_nodes": 1,
+    "identity_opt": 1,
+}
+
+# names of all passes in the order they run
+OPTIMIZER_NAMES = list(_optimizers)
+OPTIMIZATION_LEVELS = [0, 1, 2, 3]
+# level 3 may change float results, it runs on request only
+DEFAULT_OPTIMIZATION_LEVEL = 2
+# rounds over the passes until none of them changes the graph
+DEFAULT_MAX_ITERATIONS = 4
+
+
+def get_optimizer_names(level=DEFAULT_OPTIMIZATION_LEVEL):
+    """Return the names of the passes enabled at optimization level, in the order they run."""
+    utils.make_sure(level in OPTIMIZATION_LEVELS, "invalid optimization level %s", level)
+    return [name for name in _optimizers if _optimizer_levels[name] <= level]
+
+
+class PassManager(object):
+    """Run optimizer passes until the graph doesn't change anymore.
+    A pass only runs again if another pass changed the graph since its last run. A failing pass is
+    rolled back with a graph snapshot and disabled, the changes of the other passes are kept.
+    """
+
+    def __init__(self, optimizers=None, level=DEFAULT_OPTIMIZATION_LEVEL, max_iterations=DEFAULT_MAX_ITERATIONS,
+                 debug=False, profiler=None, optimizer_options=None):
+        """Create PassManager.
+        Args:
+            optimizers: names of the passes to run in this order, default are the passes of level
+            level: optimization level 0 to 3, used if optimizers is None
+            max_iterations: max rounds over the passes
+            profiler: optional tf2onnx.profiler.Profiler collecting statistics of each pass run
+            optimizer_options: dict of pass name to keyword arguments of the pass,
+                like {"fold_const": {"max_output_size": 1024}}
+        """
+        if optimizers is None:
+            optimizers = get_optimizer_names(level)
+        for name in optimizers:
+            utils.make_sure(name in _optimizers, "unknown optimizer %s, valid are %s", name, OPTIMIZER_NAMES)
+        self.optimizer_options = optimizer_options or {}
+        for name in self.optimizer_options:
+            utils.make_sure(name in _optimizers, "options for unknown optimizer %s, valid are %s",
+                            name, OPTIMIZER_NAMES)
+        self.optimizers = list(optimizers)
+        self.max_iterations = max_iterations
+        self.debug = debug
+        self.profiler = profiler if profiler is not None else Profiler(enabled=False)
+        # per pass: number of runs, runs changing the graph, failures, seconds, nodes removed
+        self.stats = OrderedDict((name, {"runs": 0, "changed": 0, "failures": 0, "time": 0.0, "nodes_removed": 0})
+                                 for name in self.optimizers)
+        self.iterations = 0
+
+    def run(self, graph):
+        version = 0
+        last_run = {}
+        failed = set()
+        self.iterations = 0
+        while self.iterations < self.max_iterations:
+            self.iterations += 1
+            changed = False
+            for name in self.optimizers:
+                # nothing changed since the last run of the pass, it would not find anything new
+                if name in failed or last_run.get(name) == version:
+                    continue
+                graph, pass_changed, ok = self._run_pass(name, graph)
+                if not ok:
+                    failed.add(name)
+                    continue
+                if pass_changed:
+                    version += 1
+                    changed = True
+                last_run[name] = version
+            if not changed:
+                break
 
         graph.update_proto()
+        for name, stat in self.stats.items():
+            logger.info("%s: %d runs, %d changed, %d failed, %.3fs, %d nodes removed", name, stat["runs"],
+                        stat["changed"], stat["failures"], stat["time"], stat["nodes_removed"])
         return graph
+
+    def _run_pass(self, name, graph):
+        """Run one pass, return the graph, whether the pass changed it and whether it succeeded."""
+        stat = self.stats[name]
+        stat["runs"] += 1
+        snapshot = graph.snapshot()
+        signature = _graph_signature(graph)
+        nodes_before = _count_nodes(graph)
+        start = time.time()
+        try:
+            with self.profiler.phase(name, lambda: len(graph.get_nodes()), category="optimizer"):
+                new_graph = _optimizers[name](debug=self.debug, **self.optimizer_options.get(name, {})).optimize(graph)
+        except Exception:
+            stat["failures"] += 1
+            stat["time"] += time.time() - start
+            logger.warning("optimizer %s failed and is rolled back: %s", name, traceback.format_exc())
+            return snapshot.restore(), False, False
+        stat["time"] += time.time() - start
+        stat["nodes_removed"] += nodes_before - _count_nodes(new_graph)
+        changed = new_graph is not graph or _graph_signature(new_graph) != signature
+        stat["changed"] += changed
+        return new_graph, changed, True
+
+
+def _get_all_graphs(graph):
+    graphs = [graph]
+    for g in graphs:
+        for body_graphs in g.contained_graphs.values():
+            graphs.extend(body_graphs.values())
+    return graphs
+
+
+def _count_nodes(graph):
+    return sum(len(g.get_nodes()) for g in _get_all_graphs(graph))
+
+
+def _graph_signature(graph):
+    # passes replace attributes instead of changing them in place, so their ids tell attribute changes
+    # the node order doesn't matter, passes sort the nodes again, the graph does since nodes may be moved
+    # between body graphs and their outer graphs
+    return frozenset((id(g), n.name, n.type, tuple(n.input), tuple(n.output), tuple(id(a) for a in n.attr.values()))
+                     for g in _get_all_graphs(graph) for n in g.get_nodes())
+
+
+def optimize_graph(graph, debug=False, profiler=None, optimizers=None, level=DEFAULT_OPTIMIZATION_LEVEL,
+                   optimizer_options=None):
+    """Optimize graph with a PassManager, see PassManager for the arguments.
+    Return:
+        the optimized graph or None if optimization failed outside of the passes
+    """
+    try:
+        return PassManager(optimizers, level, debug=debug, profiler=profiler,
+                           optimizer_options=optimizer_options).run(graph)
     except Exception:
         # degradation to non-optimized model proto
         type_, value_, traceback_ = sys.exc_info()
@@ -0,0 +1,105 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT license.
+
+"""Const Dedup Optimizer.
+   Merge Const nodes holding the same tensor, they are grouped by a hash of dtype, shape and bytes of the tensor
+   so the cost is linear in the number of consts. Body graphs of Loop, If and Scan can use tensors of the
+   outer scope, so equal consts in different graphs are merged into a const of their closest common scope.
+"""
+
+from __future__ import unicode_literals
+
+import hashlib
+from collections import OrderedDict
+
+import numpy as np
+
+from tf2onnx import utils
+from tf2onnx.optimizer.optimizer_base import GraphOptimizerBase
+
+# pylint: disable=logging-not-lazy,unused-argument,missing-docstring
+
+
+class ConstDedupOptimizer(GraphOptimizerBase):
+
+    def __init__(self, debug=False):
+        super(ConstDedupOptimizer, self).__init__("ConstDedupOptimizer", debug)
+        self._bytes_saved = 0
+
+    def _optimize(self, graph):
+        self._bytes_saved = 0
+        groups = OrderedDict()
+        for g in self._get_all_graphs(graph):
+            graph_outputs = set(g.outputs)
+            for node in g.get_nodes():
+                if not node.is_const() or graph_outputs.intersection(node.output):
+                    continue
+                key = self._hash_const(node)
+                if key is not None:
+                    groups.setdefault(key, []).append(node)
+
+        for nodes in groups.values():
+            if len(nodes) > 1:
+                self._merge_consts(nodes)
+        self.log.info("merged duplicated consts, %d bytes saved", self._bytes_saved)
+        return graph
+
+    @property
+    def bytes_saved(self):
+        return self._bytes_saved
+
+    @staticmethod
+    def _get_all_graphs(graph):
+        graphs = [graph]
+        for g in graphs:
+            for body_graphs in g.contained_graphs.values():
+                graphs.extend(body_graphs.values())
+        return graphs
+
+    @staticmethod
+    def _hash_const(node):
+        val = node.get_tensor_value(as_list=False)
+        # bytes of object arrays (strings) are pointers
+        if val.dtype == np.object_:
+            return None
+        digest = hashlib.sha256(np.ascontiguousarray(val).tobytes()).hexdigest()
+        return val.dtype.str, val.shape, digest
+
+    @staticmethod
+    def _get_scopes(graph):
+        scopes = []
+        while graph is not None:
+            scopes.append(graph)
+            graph = graph.parent_graph
+        return scopes
+
+    def _find_common_scope(self, nodes):
+        common = self._get_scopes(nodes[0].graph)
+        for node in nodes[1:]:
+            scopes = self._get_scopes(node.graph)
+            common = [g for g in common if any(g is s for s in scopes)]
+        utils.make_sure(common, "consts %s are not in a common graph", [n.name for n in nodes])
+        return common[0]
+
+    def _merge_consts(self, nodes):
+        scope = self._find_common_scope(nodes)
+        val = nodes[0].get_tensor_value(as_list=False)
+        node_to_retain = None
+        for node in nodes:
+            if node.graph is scope:
+                node_to_retain = node
+                break
+        if node_to_retain is None:
+            # equal consts only live in different body graphs, hoist one copy to the common scope
+            node_to_retain = scope.make_const(utils.make_name(nodes[0].name), val)
+            self._bytes_saved -= val.nbytes
+            self.log.debug("hoisted const %s to %s", nodes[0].name, node_to_retain.name)
+
+        for node in nodes:
+            if node is node_to_retain:
+                continue
+            g = node.graph
+            g.replace_all_inputs(node.output[0], node_to_retain.output[0])
+            g.remove_node(node.name)
+            self._bytes_saved += val.nbytes
+            self.log.debug("merged const %s into %s", node.name, node_to_retain.name)
@@ -6,27 +6,78 @@
    for example, input of transpose node is const then we can do transpose statically instead of at runtime
 """
 
+import functools
+
+import numpy as np
+
 from tf2onnx.optimizer.optimizer_base import GraphOptimizerBase
 from tf2onnx import utils
 
 # pylint: disable=logging-not-lazy,unused-argument,missing-docstring
 
 # key is op_type, value is the function to compute outputs
-# the schema of function is: inputs are(node, graph), output is a list of constant values.
+# the schema of function is: inputs are(node, graph), output is a list of constant values,
+# or None if the node can't be folded.
 _func_map = {}
 
+# ops that can be folded without all inputs being const, for example Shape only needs a known input shape
+_non_const_input_ops = set()
+
+# key is op_type, value is the function computing the size in bytes of the outputs from the input shapes,
+# for ops whose outputs can be much larger than their inputs. They are checked against the size budget
+# before the outputs are computed. The schema of function is: input is the node, output is the size or None
+# if the node can't be folded.
+_output_size_map = {}
 
-def _register_func(op_type):
+# folded outputs larger than this (in bytes) are only allowed if they are not larger than the const inputs
+DEFAULT_MAX_OUTPUT_SIZE = 1024 * 1024
+
+
+def _register_func(op_type, const_inputs=True):
     def _internal_fun(func):
         _func_map[op_type] = func
+        if not const_inputs:
+            _non_const_input_ops.add(op_type)
         return func
     return _internal_fun
 
 
+def _register_output_size_func(op_type):
+    def _internal_fun(func):
+        _output_size_map[op_type] = func
+        return func
+    return _internal_fun
+
+
+def _get_const_inputs(node):
+    return [inp.get_tensor_value(as_list=False) if inp else None for inp in node.inputs]
+
+
+def _get_ints_attr_or_input(node, attr_name, input_index):
+    """Get list of ints from attribute (older opsets) or from const input (newer opsets), None if not given."""
+    if len(node.input) > input_index and node.input[input_index]:
+        return node.inputs[input_index].get_tensor_value(as_list=True)
+    attr = node.get_attr(attr_name)
+    return list(attr.ints) if attr else None
+
+
+def _broadcast_shape(shape1, shape2):
+    """Numpy style bidirectional broadcast of two shapes."""
+    rank = max(len(shape1), len(shape2))
+    shape1 = [1] * (rank - len(shape1)) + list(shape1)
+    shape2 = [1] * (rank - len(shape2)) + list(shape2)
+    ret = []
+    for d1, d2 in zip(shape1, shape2):
+        utils.make_sure(d1 == d2 or d1 == 1 or d2 == 1, "shapes %s and %s can't be broadcast", shape1, shape2)
+        ret.append(d2 if d1 == 1 else d1)
+    return ret
+
+
 class ConstFoldOptimizer(GraphOptimizerBase):
 
-    def __init__(self, debug=False):
+    def __init__(self, debug=False, max_output_size=DEFAULT_MAX_OUTPUT_SIZE):
         super(ConstFoldOptimizer, self).__init__("ConstFoldOptimizer", debug)
+        self._max_output_size = max_output_size
 
     def _optimize(self, graph):
         return self._apply_optimization(graph, self._optimize_at_current_graph_level)
@@ -62,14 +113,41 @@ class ConstFoldOptimizer(GraphOptimizerBase):
         """ if node's input are all const and it's not graph's output then it can be fold.
             if node can be fold True will be return indicating that graph is changed
         """
-        if self._all_inputs_are_const(node.inputs) and not self._is_graph_output(node, graph):
-            process_func = _func_map.get(node.type, None)
-            if process_func:
-                const_outputs = process_func(node, graph)
-                self._replace_node_with_const(node, graph, const_outputs)
-                return True
-        self.log.debug("need to add function to fold op %s whose op_type is %s", node.name, node.type)
-        return False
+        if self._is_graph_output(node, graph):
+            return False
+        if node.type not in _non_const_input_ops and not self._all_inputs_are_const(node.inputs):
+            return False
+
+        process_func = _func_map.get(node.type, None)
+        if not process_func:
+            self.log.debug("need to add function to fold op %s whose op_type is %s", node.name, node.type)
+            return False
+
+        # ops that may blow up are checked before their outputs are allocated
+        output_size_func = _output_size_map.get(node.type, None)
+        if output_size_func and self._max_output_size is not None:
+            output_size = output_size_func(node)
+            if output_size is None or not self._is_within_size_budget(node, output_size):
+                self.log.debug("skip folding %s, output is too large", node.name)
+                return False
+
+        const_outputs = process_func(node, graph)
+        if const_outputs is None:
+            return False
+        if not output_size_func and not self._is_within_size_budget(node, sum(val.nbytes for val in const_outputs)):
+            self.log.debug("skip folding %s, output is too large", node.name)
+            return False
+        self._replace_node_with_const(node, graph, const_outputs)
+        return True
+
+    def _is_within_size_budget(self, node, output_size):
+        """Folding must not bloat the model: allow outputs up to max_output_size or the size of the const inputs."""
+        if self._max_output_size is None:
+            return True
+        if output_size <= self._max_output_size:
+            return True
+        input_size = sum(inp.get_tensor_value(as_list=False).nbytes for inp in node.inputs if inp and inp.is_const())
+        return output_size <= input_size
 
     @staticmethod
     def _all_inputs_are_const(nodes):
@@ -88,7 +166,7 @@ class ConstFoldOptimizer(GraphOptimizerBase):
             const_node = graph.make_const(utils.make_name("const_fold_opt"), val)
             graph.set_dtype(const_node.output[0], utils.map_numpy_to_onnx_dtype(val.dtype))
             graph.set_shape(const_node.output[0], val.shape)
-            graph.replace_all_inputs(graph.get_nodes(), old_input, const_node.output[0])
+            graph.replace_all_inputs(old_input, const_node.output[0])
         graph.remove_node(node.name)
 
     @staticmethod
@@ -99,3 +177,239 @@ class ConstFoldOptimizer(GraphOptimizerBase):
         perm = perm_attr.ints if perm_attr else None
         const_val_after_trans = const_val.transpose(perm)
         return [const_val_after_trans]
+
+    @staticmethod
+    @_register_func("Cast")
+    def _fold_cast(node, graph):
+        to = node.get_attr_int("to")
+        if to not in utils.ONNX_TO_NUMPY_DTYPE:
+            return None
+        const_val = node.inputs[0].get_tensor_value(as_list=False)
+        return [const_val.astype(utils.map_onnx_to_numpy_type(to))]
+
+    @staticmethod
+    @_register_func("QuantizeLinear")
+    def _fold_quantize_linear(node, graph):
+        # quantized weights are stored as integers, DequantizeLinear is kept for the QLinear fusion
+        inputs = _get_const_inputs(node)
+        x, scale = inputs[0], inputs[1]
+        zero_point = inputs[2] if len(inputs) > 2 and inputs[2] is not None else np.array(0, dtype=np.uint8)
+        if scale.ndim == 1:
+            axis = node.get_attr("axis")
+            axis = axis.i if axis else 1
+            shape = [1] * x.ndim
+            shape[axis] = -1
+            scale = scale.reshape(shape)
+            zero_point = zero_point.reshape(shape)
+        info = np.iinfo(zero_point.dtype)
+        val = np.clip(np.round(x / scale) + zero_point.astype(np.int32), info.min, info.max)
+        return [val.astype(zero_point.dtype)]
+
+    @staticmethod
+    @_register_func("Reshape")
+    def _fold_reshape(node, graph):
+        const_val = node.inputs[0].get_tensor_value(as_list=False)
+        shape = _get_ints_attr_or_input(node, "shape", 1)
+        if shape is None:
+            return None
+        # 0 means copying the dim from input
+        shape = [const_val.shape[i] if d == 0 else d for i, d in enumerate(shape)]
+        return [const_val.reshape(shape)]
+
+    @staticmethod
+    @_register_func("Unsqueeze")
+    def _fold_unsqueeze(node, graph):
+        const_val = node.inputs[0].get_tensor_value(as_list=False)
+        axes = _get_ints_attr_or_input(node, "axes", 1)
+        rank = const_val.ndim + len(axes)
+        axes = sorted(a + rank if a < 0 else a for a in axes)
+        for a in axes:
+            const_val = np.expand_dims(const_val, a)
+        return [const_val]
+
+    @staticmethod
+    @_register_func("Squeeze")
+    def _fold_squeeze(node, graph):
+        const_val = node.inputs[0].get_tensor_value(as_list=False)
+        axes = _get_ints_attr_or_input(node, "axes", 1)
+        if axes is None:
+            return [np.squeeze(const_val)]
+        return [np.squeeze(const_val, axis=tuple(axes))]
+
+    @staticmethod
+    @_register_func("Concat")
+    def _fold_concat(node, graph):
+        const_vals = [inp.get_tensor_value(as_list=False) for inp in node.inputs]
+        return [np.concatenate(const_vals, axis=node.get_attr_int("axis"))]
+
+    @staticmethod
+    @_register_func("Slice")
+    def _fold_slice(node, graph):
+        const_val = node.inputs[0].get_tensor_value(as_list=False)
+        starts = _get_ints_attr_or_input(node, "starts", 1)
+        ends = _get_ints_attr_or_input(node, "ends", 2)
+        axes = _get_ints_attr_or_input(node, "axes", 3)
+        steps = _get_ints_attr_or_input(node, "steps", 4)
+        if axes is None:
+            axes = list(range(len(starts)))
+        if steps is None:
+            steps = [1] * len(starts)
+        slices = [slice(None)] * const_val.ndim
+        for start, end, axis, step in zip(starts, ends, axes, steps):
+            # python slicing clamps out of range starts and ends the same way onnx does
+            slices[axis] = slice(start, end, step)
+        return [const_val[tuple(slices)]]
+
+    @staticmethod
+    @_register_func("Gather")
+    def _fold_gather(node, graph):
+        const_val = node.inputs[0].get_tensor_value(as_list=False)
+        indices = node.inputs[1].get_tensor_value(as_list=False)
+        axis = node.get_attr("axis")
+        return [np.take(const_val, indices, axis=axis.i if axis else 0)]
+
+    @staticmethod
+    @_register_output_size_func("Gather")
+    def _gather_output_size(node):
+        const_val = node.inputs[0].get_tensor_value(as_list=False)
+        indices = node.inputs[1].get_tensor_value(as_list=False)
+        axis = node.get_attr("axis")
+        axis = axis.i if axis else 0
+        shape = const_val.shape[:axis] + indices.shape + const_val.shape[axis + 1:]
+        return int(np.prod(shape, dtype=np.int64)) * const_val.itemsize
+
+    @staticmethod
+    def _fold_elementwise(node, func):
+        # broadcast with axis attribute of opset < 7 is not numpy compatible
+        if node.get_attr("axis"):
+            return None
+        vals = _get_const_inputs(node)
+        return [func(*vals).astype(vals[0].dtype)]
+
+    @staticmethod
+    def _broadcast_output_size(node, dtype_index=0):
+        if node.get_attr("axis"):
+            return None
+        # np.broadcast only computes the broadcast shape, it doesn't allocate the output
+        vals = _get_const_inputs(node)
+        return np.broadcast(*vals).size * vals[dtype_index].itemsize
+
+    @staticmethod
+    @_register_output_size_func("Add")
+    @_register_output_size_func("Sub")
+    @_register_output_size_func("Mul")
+    @_register_output_size_func("Div")
+    @_register_output_size_func("Max")
+    @_register_output_size_func("Min")
+    def _elementwise_output_size(node):
+        return ConstFoldOptimizer._broadcast_output_size(node)
+
+    @staticmethod
+    @_register_func("Add")
+    def _fold_add(node, graph):
+        return ConstFoldOptimizer._fold_elementwise(node, np.add)
+
+    @staticmethod
+    @_register_func("Sub")
+    def _fold_sub(node, graph):
+        return ConstFoldOptimizer._fold_elementwise(node, np.subtract)
+
+    @staticmethod
+    @_register_func("Mul")
+    def _fold_mul(node, graph):
+        return ConstFoldOptimizer._fold_elementwise(node, np.multiply)
+
+    @staticmethod
+    @_register_func("Div")
+    def _fold_div(node, graph):
+        vals = _get_const_inputs(node)
+        if np.issubdtype(vals[0].dtype, np.integer):
+            # leave division by zero to the runtime
+            if not np.all(vals[1]):
+                return None
+            # integer division of onnx truncates towards zero, not like numpy which rounds towards -inf
+            return ConstFoldOptimizer._fold_elementwise(
+                node, lambda a, b: np.sign(a) * np.sign(b) * (np.abs(a) // np.abs(b)))
+        return ConstFoldOptimizer._fold_elementwise(node, np.divide)
+
+    @staticmethod
+    @_register_func("Max")
+    def _fold_max(node, graph):
+        # Max and Min take any number of inputs
+        return ConstFoldOptimizer._fold_elementwise(node, lambda *vals: functools.reduce(np.maximum, vals))
+
+    @staticmethod
+    @_register_func("Min")
+    def _fold_min(node, graph):
+        return ConstFoldOptimizer._fold_elementwise(node, lambda *vals: functools.reduce(np.minimum, vals))
+
+    @staticmethod
+    @_register_func("Shape", const_inputs=False)
+    def _fold_shape(node, graph):
+        # shapes of loop carried values may change from iteration to iteration, don't trust them
+        producer = node.inputs[0]
+        while producer and producer.type == "Identity":
+            producer = producer.inputs[0]
+        if producer and producer.get_body_graphs():
+            return None
+        shape = graph.get_shape(node.input[0])
+        if shape is None or any(d is None or d < 0 for d in shape):
+            return None
+        if utils.get_unknown_dimension() != utils.ONNX_UNKNOWN_DIMENSION and shape \
+                and shape[0] == utils.get_unknown_dimension():
+            # get_shape replaces an unknown dim 0 by the --unknown-dim override, that must not become a const
+            return None
+        return [np.array(shape, dtype=np.int64)]
+
+    @staticmethod
+    @_register_func("Range")
+    def _fold_range(node, graph):
+        start, limit, delta = _get_const_inputs(node)
+        return [np.arange(start, limit, delta, dtype=start.dtype)]
+
+    @staticmethod
+    @_register_output_size_func("Range")
+    def _range_output_size(node):
+        start, limit, delta = _get_const_inputs(node)
+        if delta == 0:
+            return None
+        return max(int(np.ceil((limit - start) / delta)), 0) * start.itemsize
+
+    @staticmethod
+    @_register_func("Tile")
+    def _fold_tile(node, graph):
+        const_val = node.inputs[0].get_tensor_value(as_list=False)
+        repeats = node.inputs[1].get_tensor_value(as_list=True)
+        return [np.tile(const_val, repeats)]
+
+    @staticmethod
+    @_register_output_size_func("Tile")
+    def _tile_output_size(node):
+        const_val = node.inputs[0].get_tensor_value(as_list=False)
+        repeats = node.inputs[1].get_tensor_value(as_list=True)
+        return const_val.size * int(np.prod(repeats, dtype=np.int64)) * const_val.itemsize
+
+    @staticmethod
+    @_register_func("Expand")
+    def _fold_expand(node, graph):
+        const_val = node.inputs[0].get_tensor_value(as_list=False)
+        shape = node.inputs[1].get_tensor_value(as_list=True)
+        return [np.array(np.broadcast_to(const_val, _broadcast_shape(const_val.shape, shape)))]
+
+    @staticmethod
+    @_register_output_size_func("Expand")
+    def _expand_output_size(node):
+        const_val = node.inputs[0].get_tensor_value(as_list=False)
+        shape = node.inputs[1].get_tensor_value(as_list=True)
+        return int(np.prod(_broadcast_shape(const_val.shape, shape), dtype=np.int64)) * const_val.itemsize
+
+    @staticmethod
+    @_register_func("Where")
+    def _fold_where(node, graph):
+        cond, x, y = _get_const_inputs(node)
+        return [np.where(cond, x, y)]
+
+    @staticmethod
+    @_register_output_size_func("Where")
+    def _where_output_size(node):
+        return ConstFoldOptimizer._broadcast_output_size(node, dtype_index=1)
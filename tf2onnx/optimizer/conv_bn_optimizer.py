@@ -0,0 +1,102 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT license.
+
+"""Conv BatchNormalization fusion Optimizer.
+   BatchNormalization with const scale, bias, mean and var following a Conv or ConvTranspose with const
+   weights is folded into weights and bias of the Conv, so the BatchNormalization is removed.
+"""
+
+from __future__ import unicode_literals
+
+import numpy as np
+
+from tf2onnx.optimizer.optimizer_base import GraphOptimizerBase
+from tf2onnx import utils
+
+# pylint: disable=logging-not-lazy,unused-argument,missing-docstring
+
+
+class ConvBatchNormOptimizer(GraphOptimizerBase):
+
+    def __init__(self, debug=False):
+        super(ConvBatchNormOptimizer, self).__init__("ConvBatchNormOptimizer", debug)
+
+    def _optimize(self, graph):
+        return self._apply_optimization(graph, self._optimize_at_current_graph_level)
+
+    def _optimize_at_current_graph_level(self, graph):
+        for node in list(graph.get_nodes()):
+            if node.type == "BatchNormalization":
+                self._fuse(graph, node)
+        return graph
+
+    def _can_fuse(self, graph, bn, conv):
+        if conv is None or conv.type not in ["Conv", "ConvTranspose"] or conv.graph is not graph:
+            return False
+        # conv output is needed as it is by some other node
+        if len(graph.find_output_consumers(conv.output[0])) != 1 or conv.output[0] in graph.outputs:
+            return False
+        if len(conv.input) < 2 or not conv.inputs[1].is_const():
+            return False
+        if len(conv.input) > 2 and conv.input[2] and not conv.inputs[2].is_const():
+            return False
+        if not all(n.is_const() for n in bn.inputs[1:5]):
+            return False
+        # spatial=0 of older opsets normalizes per element, not per channel
+        spatial = bn.get_attr("spatial")
+        if spatial and spatial.i == 0:
+            return False
+        if bn.output[0] in graph.outputs:
+            return False
+        # outputs other than Y are only available in training mode
+        for out in bn.output[1:]:
+            if out and (out in graph.outputs or graph.find_output_consumers(out)):
+                return False
+        return True
+
+    def _fuse(self, graph, bn):
+        conv = bn.inputs[0]
+        if not self._can_fuse(graph, bn, conv):
+            return False
+
+        weights = conv.inputs[1].get_tensor_value(as_list=False)
+        scale, bias, mean, var = [n.get_tensor_value(as_list=False).astype(np.float64) for n in bn.inputs[1:5]]
+        epsilon = bn.get_attr("epsilon")
+        epsilon = epsilon.f if epsilon else 1e-5
+        factor = scale / np.sqrt(var + epsilon)
+
+        group = conv.get_attr("group")
+        group = group.i if group else 1
+        # Conv weights: [M, C/group, k1, ...], ConvTranspose weights: [C, M/group, k1, ...], M is output channel
+        num_out = weights.shape[0] if conv.type == "Conv" else weights.shape[1] * group
+        if factor.shape != (num_out,):
+            self.log.debug("channel count of %s doesn't match %s, skip", bn.name, conv.name)
+            return False
+
+        if conv.type == "Conv":
+            new_weights = weights * factor.reshape([num_out] + [1] * (weights.ndim - 1))
+        else:
+            # output channel m of group g is g * M/group + m
+            grouped = weights.reshape([group, weights.shape[0] // group, weights.shape[1], -1])
+            grouped = grouped * factor.reshape([group, 1, weights.shape[1], 1])
+            new_weights = grouped.reshape(weights.shape)
+
+        conv_bias = np.zeros(num_out, dtype=np.float64)
+        if len(conv.input) > 2 and conv.input[2]:
+            conv_bias = conv.inputs[2].get_tensor_value(as_list=False).astype(np.float64)
+        new_bias = (conv_bias - mean) * factor + bias
+
+        # weights may be shared with other nodes, so always create new consts
+        dtype = weights.dtype
+        weights_node = graph.make_const(utils.make_name(conv.name + "_bn_weights"), new_weights.astype(dtype))
+        bias_node = graph.make_const(utils.make_name(conv.name + "_bn_bias"), new_bias.astype(dtype))
+        graph.replace_input(conv, conv.input[1], weights_node.output[0], 1)
+        if len(conv.input) > 2:
+            graph.replace_input(conv, conv.input[2], bias_node.output[0], 2)
+        else:
+            conv.input = conv.input + [bias_node.output[0]]
+
+        graph.replace_all_inputs(bn.output[0], conv.output[0])
+        graph.remove_node(bn.name)
+        self.log.debug("fused %s into %s", bn.name, conv.name)
+        return True
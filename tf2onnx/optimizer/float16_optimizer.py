@@ -0,0 +1,207 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT license.
+
+"""Float16 Optimizer.
+   Convert a float32 graph to float16 weights and compute. Float32 consts are stored as float16 and all float32
+   tensors become float16, except for the outputs of ops kept in float32: ops of the keep list (by default
+   Softmax and the summing reductions, which lose too much precision in float16) and ops whose schema doesn't
+   allow float16. Casts are only inserted at the graph inputs and outputs, which keep float32, and around the
+   float32 ops. Cast pairs cancelling each other out are removed afterwards.
+"""
+
+from __future__ import unicode_literals
+
+import numpy as np
+from onnx import numpy_helper, TensorProto
+
+from tf2onnx import schemas, utils
+from tf2onnx.optimizer.optimizer_base import GraphOptimizerBase
+
+# pylint: disable=logging-not-lazy,unused-argument,missing-docstring
+
+FLOAT = TensorProto.FLOAT
+FLOAT16 = TensorProto.FLOAT16
+
+# ops accumulating over many elements or exponentiating, they are kept in float32 by default
+DEFAULT_KEEP_FP32_OPS = [
+    "LogSoftmax", "ReduceL1", "ReduceL2", "ReduceLogSum", "ReduceLogSumExp", "ReduceMean", "ReduceProd",
+    "ReduceSum", "ReduceSumSquare", "Softmax",
+]
+
+# attributes holding the dtype of the output of the node
+_DTYPE_ATTRS = ["dtype", "to"]
+
+
+class Float16Optimizer(GraphOptimizerBase):
+
+    def __init__(self, keep_fp32_ops=None, debug=False):
+        """Create Float16Optimizer.
+        Args:
+            keep_fp32_ops: op types computed in float32, default is DEFAULT_KEEP_FP32_OPS
+        """
+        super(Float16Optimizer, self).__init__("Float16Optimizer", debug)
+        self._keep_fp32_ops = set(DEFAULT_KEEP_FP32_OPS if keep_fp32_ops is None else keep_fp32_ops)
+        self._np_float16 = utils.ONNX_TO_NUMPY_DTYPE[FLOAT16]
+        self._np_float = utils.ONNX_TO_NUMPY_DTYPE[FLOAT]
+        # output name -> float32 value of the consts converted to float16
+        self._fp32_values = {}
+        self._casts_removed = 0
+
+    def _optimize(self, graph):
+        self._fp32_values = {}
+        self._casts_removed = 0
+        graphs = self._get_all_graphs(graph)
+        output_dtypes = {name: graph.get_dtype(name) for name in graph.outputs}
+
+        fp32_nodes = {}
+        for g in graphs:
+            fp32_nodes[g] = [n for n in g.get_nodes() if self._needs_fp32(g, n)]
+            self._convert_graph(g, set(fp32_nodes[g]), is_main_graph=g is graph)
+        for g in graphs:
+            for node in fp32_nodes[g]:
+                self._cast_outputs(g, node, FLOAT, FLOAT16)
+        for g in graphs:
+            self._cast_inputs(g, set(fp32_nodes[g]))
+
+        # the model keeps float32 outputs
+        for name in graph.outputs:
+            if output_dtypes[name] == FLOAT and graph.get_dtype(name) == FLOAT16:
+                self._cast_outputs(graph, graph.get_node_by_output(name), FLOAT16, FLOAT, [name])
+
+        for g in graphs:
+            self._remove_redundant_casts(g)
+        self.log.info("converted graph to float16, %d redundant casts removed", self._casts_removed)
+        return graph
+
+    @staticmethod
+    def _get_all_graphs(graph):
+        graphs = [graph]
+        for g in graphs:
+            for body_graphs in g.contained_graphs.values():
+                graphs.extend(body_graphs.values())
+        return graphs
+
+    def _needs_fp32(self, graph, node):
+        if node.is_const() or node.is_graph_input():
+            return False
+        if node.type in self._keep_fp32_ops:
+            return True
+        float_outputs = [i for i, name in enumerate(node.output) if graph.get_dtype(name) == FLOAT]
+        if not float_outputs:
+            return False
+        schema = schemas.get_schema(node.type, graph.opset, node.domain)
+        # no schema telling that the op supports float16, like custom ops
+        if schema is None:
+            return True
+        return any("tensor(float16)" not in schema.output_types(i) for i in float_outputs)
+
+    def _convert_graph(self, graph, fp32_nodes, is_main_graph):
+        for node in list(graph.get_nodes()):
+            if node in fp32_nodes:
+                continue
+            if node.is_graph_input():
+                if is_main_graph and graph.get_dtype(node.output[0]) == FLOAT:
+                    # the model keeps float32 inputs
+                    cast = graph.insert_new_node_on_output("Cast", node.output[0], utils.make_name(node.name),
+                                                           to=FLOAT16)
+                    graph.copy_shape(node.output[0], cast.output[0])
+                    graph.set_dtype(cast.output[0], FLOAT16)
+                    continue
+            elif node.is_const():
+                val = node.get_tensor_value(as_list=False)
+                if val.dtype == self._np_float:
+                    self._fp32_values[node.output[0]] = val
+                    tensor_name = node.get_attr("value").t.name
+                    node.set_attr("value", numpy_helper.from_array(self._to_float16(val), tensor_name))
+            else:
+                self._convert_attributes(node)
+
+            for name in node.output:
+                if graph.get_dtype(name) == FLOAT:
+                    graph.set_dtype(name, FLOAT16)
+
+    def _to_float16(self, val):
+        # values out of the float16 range would become inf
+        limit = np.finfo(self._np_float16).max
+        return np.clip(val, -limit, limit).astype(self._np_float16)
+
+    def _convert_attributes(self, node):
+        for attr_name in _DTYPE_ATTRS:
+            attr = node.get_attr(attr_name)
+            if attr is not None and attr.i == FLOAT:
+                node.set_attr(attr_name, FLOAT16)
+        value = node.get_attr("value")
+        if value is not None and value.t.data_type == FLOAT:
+            node.set_attr("value", numpy_helper.from_array(self._to_float16(numpy_helper.to_array(value.t)),
+                                                           value.t.name))
+
+    @staticmethod
+    def _cast_outputs(graph, node, from_dtype, to_dtype, names=None):
+        """Rename outputs of node with dtype from_dtype and cast them to to_dtype under their old names."""
+        old_outputs = node.output
+        renamed = [i for i, name in enumerate(old_outputs)
+                   if graph.get_dtype(name) == from_dtype and (names is None or name in names)]
+        if not renamed:
+            return
+        shapes = [graph.get_shape(name) for name in old_outputs]
+        new_outputs = [utils.make_name(name) if i in renamed else name for i, name in enumerate(old_outputs)]
+        node.output = new_outputs
+        for i in renamed:
+            graph.set_shape(new_outputs[i], shapes[i])
+            graph.set_dtype(new_outputs[i], from_dtype)
+            graph.make_node("Cast", [new_outputs[i]], attr={"to": to_dtype}, outputs=[old_outputs[i]],
+                            shapes=[shapes[i]], dtypes=[to_dtype])
+
+    def _cast_inputs(self, graph, fp32_nodes):
+        """Feed float32 to the inputs of float16 tensors that need float32."""
+        fp32_inputs = {}
+        for node in list(graph.get_nodes()):
+            schema = None
+            if node not in fp32_nodes and not node.is_const():
+                schema = schemas.get_schema(node.type, graph.opset, node.domain)
+            for i, name in enumerate(node.input):
+                if not name or graph.get_dtype(name) != FLOAT16:
+                    continue
+                if node not in fp32_nodes and schema is not None:
+                    allowed = schema.input_types(i)
+                    if "tensor(float16)" in allowed or "tensor(float)" not in allowed:
+                        continue
+                if name not in fp32_inputs:
+                    fp32_inputs[name] = self._make_fp32_input(graph, name)
+                graph.replace_input(node, name, fp32_inputs[name], i)
+
+    def _make_fp32_input(self, graph, name):
+        if name in self._fp32_values:
+            # float32 consumers of a const get the original value
+            const = graph.make_const(utils.make_name(name.split(":")[0] + "_fp32"), self._fp32_values[name])
+            return const.output[0]
+        cast = graph.make_node("Cast", [name], attr={"to": FLOAT}, shapes=[graph.get_shape(name)],
+                               dtypes=[FLOAT])
+        return cast.output[0]
+
+    def _remove_redundant_casts(self, graph):
+        # in topological order a chain of casts collapses in one pass
+        graph.topological_sort(graph.get_nodes())
+        for node in [n for n in graph.get_nodes() if n.type == "Cast"]:
+            src = node.input[0]
+            to = node.get_attr_int("to")
+            producer = graph.get_node_by_output_in_current_graph(src)
+            if producer is not None and producer.type == "Cast" and graph.get_dtype(producer.input[0]) == to \
+                    and {to, producer.get_attr_int("to")} == {FLOAT, FLOAT16}:
+                # a cast between float32 and float16 and its inverse
+                src = producer.input[0]
+            elif graph.get_dtype(src) != to:
+                continue
+            self._bypass_cast(graph, node, src)
+            self._casts_removed += 1
+
+    @staticmethod
+    def _bypass_cast(graph, cast, src):
+        output_name = cast.output[0]
+        shape = graph.get_shape(output_name)
+        dtype = graph.get_dtype(output_name)
+        graph.remove_node(cast.name)
+        if output_name in graph.outputs:
+            graph.make_node("Identity", [src], outputs=[output_name], shapes=[shape], dtypes=[dtype])
+        else:
+            graph.replace_all_inputs(output_name, src)
@@ -0,0 +1,93 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT license.
+
+"""Gemm Optimizer.
+   Rewrite rank-2 MatMul followed by Add of a const into a single Gemm,
+   Transposes feeding the MatMul are absorbed into transA and transB.
+"""
+
+from __future__ import unicode_literals
+
+from onnx import onnx_pb
+
+from tf2onnx.optimizer.optimizer_base import GraphOptimizerBase
+
+# pylint: disable=logging-not-lazy,unused-argument,missing-docstring
+
+
+class GemmOptimizer(GraphOptimizerBase):
+
+    _supported_dtypes = [onnx_pb.TensorProto.FLOAT, onnx_pb.TensorProto.FLOAT16, onnx_pb.TensorProto.DOUBLE]
+
+    def __init__(self, debug=False):
+        super(GemmOptimizer, self).__init__("GemmOptimizer", debug)
+
+    def _optimize(self, graph):
+        return self._apply_optimization(graph, self._optimize_at_current_graph_level)
+
+    def _optimize_at_current_graph_level(self, graph):
+        # Gemm before opset 7 needs the broadcast attribute and has no numpy style broadcasting
+        if graph.opset < 7:
+            return graph
+        for node in list(graph.get_nodes()):
+            if node.type == "Add" and node.graph is graph:
+                self._fuse(graph, node)
+        return graph
+
+    def _find_matmul_and_bias(self, graph, add):
+        if add.get_attr("axis") or add.get_attr("broadcast"):
+            return None, None
+        for matmul_index in [0, 1]:
+            matmul = add.inputs[matmul_index]
+            bias = add.inputs[1 - matmul_index]
+            if matmul and matmul.type == "MatMul" and matmul.graph is graph and bias and bias.is_const():
+                return matmul, add.input[1 - matmul_index]
+        return None, None
+
+    def _can_fuse(self, graph, add, matmul, bias):
+        if graph.get_dtype(matmul.output[0]) not in self._supported_dtypes:
+            return False
+        if len(graph.find_output_consumers(matmul.output[0])) != 1 or matmul.output[0] in graph.outputs:
+            return False
+        shape_a = graph.get_shape(matmul.input[0])
+        shape_b = graph.get_shape(matmul.input[1])
+        if shape_a is None or shape_b is None or len(shape_a) != 2 or len(shape_b) != 2:
+            return False
+        # C of Gemm is only unidirectional broadcastable to [M, N]
+        bias_shape = graph.get_shape(bias)
+        out_shape = [shape_a[0], shape_b[1]]
+        if bias_shape is None or len(bias_shape) > 2:
+            return False
+        for dim, out_dim in zip(reversed(bias_shape), reversed(out_shape)):
+            if dim != 1 and dim != out_dim:
+                return False
+        return True
+
+    @staticmethod
+    def _absorb_transpose(graph, inp):
+        """Return (input, trans) with a 2d Transpose feeding inp removed."""
+        node = graph.get_node_by_output_in_current_graph(inp)
+        if node and node.type == "Transpose":
+            perm = node.get_attr("perm")
+            if perm and list(perm.ints) == [1, 0]:
+                return node.input[0], 1
+        return inp, 0
+
+    def _fuse(self, graph, add):
+        matmul, bias = self._find_matmul_and_bias(graph, add)
+        if matmul is None or not self._can_fuse(graph, add, matmul, bias):
+            return False
+
+        input_a, trans_a = self._absorb_transpose(graph, matmul.input[0])
+        input_b, trans_b = self._absorb_transpose(graph, matmul.input[1])
+
+        output_name = add.output[0]
+        shape = graph.get_shape(output_name)
+        dtype = graph.get_dtype(output_name)
+        graph.remove_node(add.name)
+        graph.remove_node(matmul.name)
+        attr = {"alpha": 1.0, "beta": 1.0, "transA": trans_a, "transB": trans_b}
+        gemm = graph.make_node("Gemm", [input_a, input_b, bias], attr=attr, outputs=[output_name],
+                               shapes=[shape], dtypes=[dtype])
+        self.log.debug("fused %s and %s into %s", matmul.name, add.name, gemm.name)
+        return True
@@ -30,7 +30,7 @@ class IdentityOptimizer(GraphOptimizerBase):
         return self._g
 
     def _optimize_recursively(self, g):
-        self._optimize(g)
+        # innermost graphs first, the graph is handled after the graphs nested in it
         nodes = [n for n in g.get_nodes()]
         for n in nodes:
             body_graphs = n.get_body_graphs()
@@ -39,6 +39,7 @@ class IdentityOptimizer(GraphOptimizerBase):
                     self.log.debug("start handling subgraph of %s's attribute %s", n.name, attr)
                     self._optimize_recursively(b_g)
                     self.log.debug("finish handling subgraph of %s's attribute %s", n.name, attr)
+        self._optimize(g)
 
     def _optimize(self, g):
         has_update = True
@@ -58,11 +59,11 @@ class IdentityOptimizer(GraphOptimizerBase):
                     ret = self._handle_non_graph_output_identity(g, n)
                 has_update = ret
 
-        self._g.topological_sort(self._g.get_nodes())
+        g.topological_sort(g.get_nodes())
 
     @staticmethod
     def _handle_non_graph_output_identity(graph, identity):
-        graph.replace_all_inputs(graph.get_nodes(), identity.output[0], identity.input[0])
+        graph.replace_all_inputs(identity.output[0], identity.input[0])
         graph.remove_node(identity.name)
         return True
 
@@ -96,5 +97,5 @@ class IdentityOptimizer(GraphOptimizerBase):
         graph.set_shape(output_id, output_shape)
         graph.set_dtype(output_id, output_dtype)
 
-        graph.replace_all_inputs(graph.get_nodes(), input_id, output_id)
+        graph.replace_all_inputs(input_id, output_id)
         return True
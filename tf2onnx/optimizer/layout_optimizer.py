@@ -0,0 +1,362 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT license.
+
+"""Layout Optimizer.
+   Tensorflow models are NHWC while onnx Conv, pooling, BatchNormalization and DepthToSpace are NCHW, so the
+   converter wraps each of them in a pair of Transposes. This pass assigns NCHW to whole regions of 4D tensors
+   between those ops: nodes of a region are rewritten to work on NCHW data, their axis attributes and const
+   inputs are permuted, and Transposes are only kept where a region meets nodes needing NHWC, graph inputs or
+   graph outputs. A region is rewritten only if that removes more Transposes than it adds.
+"""
+
+from __future__ import unicode_literals
+
+from collections import namedtuple, OrderedDict
+
+import numpy as np
+
+from tf2onnx import utils
+from tf2onnx.optimizer.optimizer_base import GraphOptimizerBase
+from tf2onnx.optimizer.transpose_optimizer import is_nchw_transpose, is_nhwc_transpose
+
+# pylint: disable=logging-not-lazy,unused-argument,missing-docstring
+
+NHWC_TO_NCHW = [0, 3, 1, 2]
+NCHW_TO_NHWC = [0, 2, 3, 1]
+# position of the NHWC axis i in NCHW
+_AXIS_TO_NCHW = [0, 2, 3, 1]
+
+# ops working on each element, inputs broadcast against each other
+_ELEMENTWISE_OPS = {
+    "Abs", "Add", "And", "Cast", "Ceil", "Clip", "Div", "Dropout", "Elu", "Equal", "Erf", "Exp", "Floor",
+    "Greater", "HardSigmoid", "Identity", "LeakyRelu", "Less", "Log", "Max", "Mean", "Min", "Mul", "Neg", "Not",
+    "Or", "Pow", "PRelu", "Reciprocal", "Relu", "Round", "Selu", "Sigmoid", "Sign", "Softplus", "Softsign",
+    "Sqrt", "Sub", "Sum", "Tanh", "ThresholdedRelu", "Where", "Xor",
+}
+
+_REDUCE_OPS = {
+    "ReduceL1", "ReduceL2", "ReduceLogSum", "ReduceLogSumExp", "ReduceMax", "ReduceMean", "ReduceMin",
+    "ReduceProd", "ReduceSum", "ReduceSumSquare",
+}
+
+# data: indices of the inputs holding layout tensors
+# outputs: indices of the outputs holding layout tensors
+# consts: indices of const inputs broadcast against the data, they are transposed as well
+_Plan = namedtuple("_Plan", ["data", "outputs", "consts"])
+
+
+def _axis_to_nchw(axis):
+    return _AXIS_TO_NCHW[axis % 4]
+
+
+def _const_to_nchw(val):
+    """Return the NCHW version of a const broadcast against NHWC tensors."""
+    if val.size == 1:
+        return val
+    val = val.reshape((1,) * (4 - val.ndim) + val.shape)
+    return np.transpose(val, NHWC_TO_NCHW)
+
+
+class LayoutOptimizer(GraphOptimizerBase):
+
+    def __init__(self, debug=False):
+        super(LayoutOptimizer, self).__init__("LayoutOptimizer", debug)
+        self._regions_converted = 0
+
+    def optimize(self, graph):
+        self._regions_converted = 0
+        graph = super(LayoutOptimizer, self).optimize(graph)
+        self.log.info("converted %d region(s) to NCHW", self._regions_converted)
+        return graph
+
+    def _optimize(self, graph):
+        return self._apply_optimization(graph, self._optimize_at_current_graph_level)
+
+    def _optimize_at_current_graph_level(self, graph):
+        done = set()
+        for seed in list(graph.get_nodes()):
+            if seed.graph is not graph or not is_nhwc_transpose(seed) or seed.output[0] in done:
+                continue
+            if not self._is_4d(graph, seed.output[0]):
+                continue
+            nodes, tensors = self._grow_region(graph, seed.output[0])
+            done.update(tensors)
+            gain = self._count_gain(graph, nodes, tensors)
+            if gain > 0:
+                self._convert_region(graph, nodes, tensors)
+                self._regions_converted += 1
+                self.log.debug("converted region of %d nodes to NCHW, %d transposes less", len(nodes), gain)
+        graph.topological_sort(graph.get_nodes())
+        return graph
+
+    @staticmethod
+    def _is_4d(graph, name):
+        shape = graph.get_shape(name)
+        return shape is not None and len(shape) == 4
+
+    @staticmethod
+    def _get_const(graph, name):
+        node = graph.get_node_by_output(name)
+        return node if node is not None and node.is_const() else None
+
+    def _analyze(self, graph, node):
+        """Return the _Plan to run node on NCHW data or None if it can't."""
+        if node.graph is not graph or node.domain or node.get_body_graphs():
+            return None
+        op = node.type
+        if op in _ELEMENTWISE_OPS:
+            plan = self._analyze_elementwise(graph, node)
+        elif op == "Concat":
+            plan = self._analyze_elementwise(graph, node)
+        elif op == "Split":
+            plan = _Plan([0], list(range(len(node.output))), [])
+            if any(inp and self._get_const(graph, inp) is None for inp in node.input[1:]):
+                return None
+        elif op in _REDUCE_OPS:
+            plan = self._analyze_reduce(node)
+        elif op in ["Slice", "Pad"]:
+            plan = _Plan([0], [0], [])
+            # starts, ends, axes and steps of Slice, pads and value of Pad given as inputs
+            if any(inp and self._get_const(graph, inp) is None for inp in node.input[1:]):
+                return None
+            if op == "Pad" and len(node.input) == 1 and node.get_attr("pads") is None:
+                return None
+        elif op in ["Softmax", "LogSoftmax"]:
+            plan = _Plan([0], [0], []) if self._softmax_axis_to_nchw(graph, node) is not None else None
+        else:
+            return None
+
+        if plan is None or not plan.data:
+            return None
+        if not all(self._is_4d(graph, node.input[i]) for i in plan.data):
+            return None
+        if not all(self._is_4d(graph, node.output[i]) for i in plan.outputs):
+            return None
+        return plan
+
+    def _analyze_elementwise(self, graph, node):
+        # broadcast of opset 6 and older is along an axis
+        if node.type != "Concat" and (node.get_attr("axis") or node.get_attr("broadcast")):
+            return None
+        data = []
+        consts = []
+        for i, inp in enumerate(node.input):
+            if not inp:
+                continue
+            const = self._get_const(graph, inp)
+            if const is not None:
+                if const.get_tensor_value(as_list=False).ndim > 4:
+                    return None
+                consts.append(i)
+            else:
+                data.append(i)
+        return _Plan(data, list(range(len(node.output))), consts)
+
+    @staticmethod
+    def _analyze_reduce(node):
+        if len(node.input) != 1:
+            return None
+        keepdims = node.get_attr("keepdims")
+        if keepdims is None or keepdims.i == 1:
+            return _Plan([0], [0], [])
+        axes = node.get_attr("axes")
+        axes = [a % 4 for a in axes.ints] if axes is not None else [0, 1, 2, 3]
+        # without keepdims the output is no 4D tensor, it has the same layout only if the kept dims are in
+        # the same order in NHWC and NCHW
+        kept_nhwc = [a for a in range(4) if a not in axes]
+        kept_nchw = [a for a in NHWC_TO_NCHW if a not in axes]
+        if kept_nhwc != kept_nchw:
+            return None
+        return _Plan([0], [], [])
+
+    @staticmethod
+    def _softmax_axis_to_nchw(graph, node):
+        """Return the NCHW axis of Softmax or None if the op can't work on NCHW data."""
+        axis = node.get_attr("axis")
+        if graph.opset >= 13:
+            return _axis_to_nchw(axis.i if axis is not None else -1)
+        # before opset 13 the input is flattened to 2D at axis, the result doesn't depend on the layout
+        # only if all of H, W and C are behind axis
+        axis = (axis.i if axis is not None else 1) % 4
+        return axis if axis <= 1 else None
+
+    def _grow_region(self, graph, seed):
+        """Collect the nodes that can work on NCHW data and are connected to seed by 4D tensors."""
+        nodes = OrderedDict()
+        tensors = []
+        seen = set()
+        queue = [seed]
+        while queue:
+            name = queue.pop()
+            if name in seen:
+                continue
+            seen.add(name)
+            tensors.append(name)
+            candidates = [graph.get_node_by_output_in_current_graph(name)]
+            candidates.extend(n for n in graph.find_output_consumers(name) if n.graph is graph)
+            for node in candidates:
+                if node is None or node.name in nodes:
+                    continue
+                plan = self._analyze(graph, node)
+                if plan is None:
+                    continue
+                layout_tensors = [node.input[i] for i in plan.data] + [node.output[i] for i in plan.outputs]
+                if name not in layout_tensors:
+                    continue
+                nodes[node.name] = (node, plan)
+                queue.extend(layout_tensors)
+        return nodes, tensors
+
+    @staticmethod
+    def _is_exit_transpose(graph, node):
+        return node.graph is graph and is_nchw_transpose(node)
+
+    def _needs_nhwc(self, graph, name, nodes):
+        if name in graph.outputs:
+            return True
+        for consumer in graph.find_output_consumers(name):
+            if consumer.name not in nodes and not self._is_exit_transpose(graph, consumer):
+                return True
+        return False
+
+    def _count_gain(self, graph, nodes, tensors):
+        """Number of Transposes the conversion of the region removes minus the number it adds."""
+        gain = 0
+        for name in tensors:
+            producer = graph.get_node_by_output_in_current_graph(name)
+            needs_nhwc = self._needs_nhwc(graph, name, nodes)
+            gain += sum(1 for n in graph.find_output_consumers(name) if self._is_exit_transpose(graph, n))
+            if producer is not None and is_nhwc_transpose(producer):
+                if not needs_nhwc:
+                    gain += 1
+            elif producer is not None and producer.name in nodes:
+                if needs_nhwc:
+                    gain -= 1
+            else:
+                gain -= 1
+        return gain
+
+    def _convert_region(self, graph, nodes, tensors):
+        # consumers outside of the region, computed before the graph changes
+        exits = {name: [n for n in graph.find_output_consumers(name) if self._is_exit_transpose(graph, n)]
+                 for name in tensors}
+        needs_nhwc = {name: self._needs_nhwc(graph, name, nodes) for name in tensors}
+
+        # NCHW version of each tensor of the region
+        nchw = {}
+        entries = []
+        for name in tensors:
+            producer = graph.get_node_by_output_in_current_graph(name)
+            if producer is not None and is_nhwc_transpose(producer):
+                nchw[name] = producer.input[0]
+                entries.append(producer)
+            elif producer is not None and producer.name in nodes:
+                # the region node writes NCHW data under a new name
+                nchw[name] = utils.port_name(utils.make_name(producer.name + "_nchw"))
+            else:
+                shape = graph.get_shape(name)
+                trans = graph.make_node("Transpose", [name], attr={"perm": NHWC_TO_NCHW},
+                                        shapes=[[shape[i] for i in NHWC_TO_NCHW]], dtypes=[graph.get_dtype(name)])
+                nchw[name] = trans.output[0]
+
+        for node, plan in nodes.values():
+            self._rename_outputs(graph, node, plan, nchw, needs_nhwc)
+        for node, plan in nodes.values():
+            for i in plan.data:
+                graph.replace_input(node, node.input[i], nchw[node.input[i]], i)
+            for i in plan.consts:
+                self._transpose_const_input(graph, node, i)
+            self._rewrite_attributes(graph, node)
+
+        for name, transposes in exits.items():
+            for trans in transposes:
+                self._remove_exit_transpose(graph, trans, nchw[name])
+
+        # the region reads the input of the NHWC Transposes now, _count_gain counted them as removed
+        for trans in entries:
+            if trans.output[0] not in graph.outputs and not graph.find_output_consumers(trans.output[0]):
+                graph.remove_node(trans.name)
+
+    @staticmethod
+    def _rename_outputs(graph, node, plan, nchw, needs_nhwc):
+        old_outputs = node.output
+        shapes = [graph.get_shape(name) for name in old_outputs]
+        dtypes = [graph.get_dtype(name) for name in old_outputs]
+        node.output = [nchw[name] if i in plan.outputs else name for i, name in enumerate(old_outputs)]
+        for i in plan.outputs:
+            old = old_outputs[i]
+            graph.set_shape(nchw[old], [shapes[i][j] for j in NHWC_TO_NCHW])
+            graph.set_dtype(nchw[old], dtypes[i])
+            if needs_nhwc[old]:
+                # nodes outside of the region and graph outputs keep the NHWC tensor
+                graph.make_node("Transpose", [nchw[old]], attr={"perm": NCHW_TO_NHWC}, outputs=[old],
+                                shapes=[shapes[i]], dtypes=[dtypes[i]])
+
+    @staticmethod
+    def _remove_exit_transpose(graph, trans, nchw_name):
+        output_name = trans.output[0]
+        shape = graph.get_shape(output_name)
+        dtype = graph.get_dtype(output_name)
+        graph.remove_node(trans.name)
+        if output_name in graph.outputs:
+            graph.make_node("Identity", [nchw_name], outputs=[output_name], shapes=[shape], dtypes=[dtype])
+        else:
+            graph.replace_all_inputs(output_name, nchw_name)
+
+    @staticmethod
+    def _transpose_const_input(graph, node, index):
+        val = node.inputs[index].get_tensor_value(as_list=False)
+        new_val = _const_to_nchw(val)
+        if new_val is not val:
+            const = graph.make_const(utils.make_name(node.inputs[index].name + "_nchw"), new_val)
+            graph.replace_input(node, node.input[index], const.output[0], index)
+
+    def _rewrite_attributes(self, graph, node):
+        op = node.type
+        if op in ["Concat", "Split"]:
+            node.set_attr("axis", _axis_to_nchw(node.get_attr("axis").i if node.get_attr("axis") else 0))
+        elif op in _REDUCE_OPS:
+            axes = node.get_attr("axes")
+            if axes is not None:
+                node.set_attr("axes", [_axis_to_nchw(a) for a in axes.ints])
+        elif op == "Slice":
+            self._rewrite_slice(graph, node)
+        elif op == "Pad":
+            self._rewrite_pad(graph, node)
+        elif op in ["Softmax", "LogSoftmax"]:
+            node.set_attr("axis", self._softmax_axis_to_nchw(graph, node))
+
+    @staticmethod
+    def _rewrite_slice(graph, node):
+        if len(node.input) == 1:
+            starts = node.get_attr("starts").ints
+            axes = node.get_attr("axes")
+            axes = axes.ints if axes is not None else range(len(starts))
+            node.set_attr("axes", [_axis_to_nchw(a) for a in axes])
+            return
+        # starts, ends, axes and steps are inputs since opset 10
+        inputs = list(node.input)
+        if len(inputs) > 3 and inputs[3]:
+            axes = node.inputs[3].get_tensor_value(as_list=False)
+        else:
+            axes = np.arange(len(node.inputs[1].get_tensor_value(as_list=False)), dtype=np.int64)
+        new_axes = np.array([_axis_to_nchw(a) for a in axes], dtype=axes.dtype)
+        const = graph.make_const(utils.make_name(node.name + "_axes"), new_axes)
+        if len(inputs) > 3:
+            inputs[3] = const.output[0]
+        else:
+            inputs.append(const.output[0])
+        node.input = inputs
+
+    @staticmethod
+    def _rewrite_pad(graph, node):
+        pads = node.get_attr("pads")
+        if pads is not None:
+            pads = list(pads.ints)
+            node.set_attr("pads", [pads[i] for i in NHWC_TO_NCHW] + [pads[4 + i] for i in NHWC_TO_NCHW])
+            return
+        # pads is an input since opset 11
+        pads = node.inputs[1].get_tensor_value(as_list=False)
+        new_pads = np.concatenate([pads[NHWC_TO_NCHW], pads[[4 + i for i in NHWC_TO_NCHW]]])
+        const = graph.make_const(utils.make_name(node.name + "_pads"), new_pads)
+        graph.replace_input(node, node.input[1], const.output[0], 1)
@@ -0,0 +1,93 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT license.
+
+"""Loop Invariant Optimizer.
+   Body graphs of Loop and Scan often compute tensors that only depend on the outer scope, like transposes of
+   weights or reshapes of the encoder outputs read by an attention decoder. A body node is loop invariant if all
+   its inputs are implicit inputs of the loop, consts or outputs of other loop invariant nodes, the state and scan
+   inputs of the body change every iteration. Invariant nodes are moved to the graph of the loop so they run once,
+   the body reads their outputs from the outer scope. Hoisted nodes run even if the loop has no iteration, so only
+   ops that can't fail at runtime are hoisted: a Gather, Reshape or Div the loop condition protects stays in the body.
+"""
+
+from __future__ import unicode_literals
+
+from tf2onnx import utils
+from tf2onnx.optimizer.optimizer_base import GraphOptimizerBase
+
+# pylint: disable=logging-not-lazy,unused-argument,missing-docstring
+
+_LOOP_OPS = ["Loop", "Scan"]
+# ops that can't fail whatever the values of their inputs are, integer Div, Mod, Gather, Reshape, Slice, Squeeze
+# and the like can, random ops are not listed since their result differs between iterations
+_HOISTABLE_OPS = set([
+    "Abs", "Add", "And", "Cast", "Ceil", "Equal", "Exp", "Floor", "Greater", "Identity", "Less", "Max", "Min",
+    "Mul", "Neg", "Not", "Or", "Relu", "Shape", "Sigmoid", "Sign", "Size", "Sub", "Tanh", "Transpose",
+    "Unsqueeze", "Where", "Xor",
+])
+
+
+class LoopInvariantOptimizer(GraphOptimizerBase):
+
+    def __init__(self, debug=False):
+        super(LoopInvariantOptimizer, self).__init__("LoopInvariantOptimizer", debug)
+
+    def _optimize(self, graph):
+        return self._apply_optimization(graph, self._optimize_at_current_graph_level)
+
+    def _optimize_at_current_graph_level(self, graph):
+        # bodies are optimized before the graph containing them, nodes hoisted from a nested loop to the body
+        # of its outer loop can then be hoisted further
+        for node in list(graph.get_nodes()):
+            if node.type in _LOOP_OPS and node.get_body_graphs():
+                self._hoist_invariants(graph, node, node.get_body_graphs()["body"])
+        return graph
+
+    def _find_invariants(self, body, outer_inputs):
+        """Return the loop invariant nodes of body in topological order."""
+        invariant_outputs = set(outer_inputs)
+        invariants = []
+        body.topological_sort(body.get_nodes())
+        for node in body.get_nodes():
+            if node.is_graph_input():
+                continue
+            if not node.is_const() and (node.type not in _HOISTABLE_OPS or not utils.is_onnx_domain(node.domain)):
+                continue
+            if all(not inp or inp in invariant_outputs for inp in node.input):
+                invariants.append(node)
+                invariant_outputs.update(node.output)
+        return invariants
+
+    def _hoist_invariants(self, graph, loop, body):
+        invariants = self._find_invariants(body, loop.get_implicit_inputs())
+        body_outputs = set(body.outputs)
+        # an Identity passing an outer tensor to a body output must stay, body outputs are produced in the body
+        invariants = [n for n in invariants if not (n.type == "Identity" and body_outputs.intersection(n.output))]
+        hoisted = [n for n in invariants if not n.is_const()]
+        if not hoisted:
+            return
+        # consts are only moved if hoisted nodes read them, the body can read them from the outer scope as well
+        hoisted_inputs = set(inp for n in hoisted for inp in n.input)
+        consts = [n for n in invariants if n.is_const() and hoisted_inputs.intersection(n.output)]
+
+        for node in consts + hoisted:
+            self._move_node(graph, body, node, body_outputs)
+        self.log.debug("hoisted %d nodes out of the body of %s", len(hoisted), loop.name)
+
+    @staticmethod
+    def _move_node(graph, body, node, body_outputs):
+        shapes = [body.get_shape(out) for out in node.output]
+        dtypes = [body.get_dtype(out) for out in node.output]
+        outputs = list(node.output)
+        # keep the body outputs in the body with an Identity of the hoisted tensor
+        for i, out in enumerate(node.output):
+            if out in body_outputs:
+                outputs[i] = utils.make_name(out)
+        name = node.name if graph.get_node_by_name(node.name) is None else utils.make_name(node.name)
+        body.remove_node(node.name)
+        graph.make_node(node.type, node.input, attr=node.attr, outputs=outputs, name=name, shapes=shapes,
+                        dtypes=dtypes, domain=node.domain)
+        for out, new_out in zip(node.output, outputs):
+            if out != new_out:
+                body.make_node("Identity", [new_out], outputs=[out], shapes=[body.get_shape(new_out)],
+                               dtypes=[body.get_dtype(new_out)])
@@ -29,6 +29,7 @@ class MergeDuplicatedNodesOptimizer(GraphOptimizerBase):
         return self._apply_optimization(graph, self._optimize_at_current_graph_level)
 
     def _optimize_at_current_graph_level(self, graph):
+        self._graph_can_be_optimized = True
         while self._graph_can_be_optimized:
             self._graph_can_be_optimized = False
             self._merge_duplicated_nodes(graph)
@@ -74,7 +75,7 @@ class MergeDuplicatedNodesOptimizer(GraphOptimizerBase):
             if set(node_to_delete.output).intersection(set(graph.outputs)):
                 continue
             for old_input, new_input in zip(node_to_delete.output, node_to_retain.output):
-                graph.replace_all_inputs(graph.get_nodes(), old_input, new_input)
+                graph.replace_all_inputs(old_input, new_input)
             graph.remove_node(node_to_delete.name)
             self._graph_can_be_optimized = True
 
@@ -83,6 +84,9 @@ class MergeDuplicatedNodesOptimizer(GraphOptimizerBase):
         # identity node will be handled by identity optimizer so skip it
         if node.type in ["Identity"]:
             return True
+        # const nodes have no inputs and would be compared pairwise, they are merged by the const dedup optimizer
+        if node.is_const():
+            return True
         if node.is_graph_input():
             return True
         return False
@@ -39,18 +39,19 @@ class GraphOptimizerBase(object):
     def _apply_optimization(graph, optimize_func):
         """
         optimize graph
-        will also optimize graph of nodes'
+        will also optimize the body graphs of nodes at any depth, innermost graphs first,
+        so a graph is optimized after the graphs nested in it
         Args:
             graph: the top level graph to be optimized
             optimize_func: function to optimize graph
         """
-        graph = optimize_func(graph)
-        for node in graph.get_nodes():
+        for node in list(graph.get_nodes()):
             body_graphs = node.get_body_graphs()
             if body_graphs:
-                for attr, b_g in body_graphs.items():
-                    b_g = optimize_func(b_g)
+                for attr, b_g in list(body_graphs.items()):
+                    b_g = GraphOptimizerBase._apply_optimization(b_g, optimize_func)
                     node.set_body_graph_as_attr(attr, b_g)
+        graph = optimize_func(graph)
         return graph
 
     def _print_stat_diff(self, nodes_original, nodes_after_optimized):
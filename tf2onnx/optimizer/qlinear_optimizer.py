@@ -0,0 +1,233 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT license.
+
+"""QLinear fusion Optimizer.
+   Quantization aware trained models compute Conv and MatMul in float between DequantizeLinear of the inputs
+   and QuantizeLinear of the result. The pattern
+       DequantizeLinear(x), DequantizeLinear(w) -> Conv -> [Add(const bias)] -> [Relu] -> QuantizeLinear
+   is fused into QLinearConv, with the bias quantized to int32, and MatMul without bias into QLinearMatMul,
+   so runtimes execute integer kernels. Relu is dropped if the output zero point of uint8 is 0, the
+   quantization clips negative values then. The Max against a const min that narrow_range fake quantization
+   puts in front of QuantizeLinear becomes a Clip of the quantized output, quantization is monotonic. Transposes between DequantizeLinear and Conv or MatMul are
+   moved above the DequantizeLinear, fold_const then folds those of weights into the integer weights.
+"""
+
+from __future__ import unicode_literals
+
+import numpy as np
+
+from tf2onnx import utils
+from tf2onnx.optimizer.optimizer_base import GraphOptimizerBase
+from tf2onnx.optimizer.transpose_optimizer import is_nhwc_transpose
+
+# pylint: disable=logging-not-lazy,unused-argument,missing-docstring
+
+# QuantizeLinear and the QLinear ops are new in opset 10
+_MIN_OPSET = 10
+# Clip of integer types is new in opset 12
+_MIN_OPSET_INT_CLIP = 12
+
+
+class QLinearFusionOptimizer(GraphOptimizerBase):
+
+    def __init__(self, debug=False):
+        super(QLinearFusionOptimizer, self).__init__("QLinearFusionOptimizer", debug)
+
+    def _optimize(self, graph):
+        if graph.opset < _MIN_OPSET:
+            return graph
+        return self._apply_optimization(graph, self._optimize_at_current_graph_level)
+
+    def _optimize_at_current_graph_level(self, graph):
+        for node in list(graph.get_nodes()):
+            if node.type == "Transpose":
+                self._move_transpose_above_dequantize(graph, node)
+        for node in list(graph.get_nodes()):
+            if node.type == "QuantizeLinear":
+                self._fuse(graph, node)
+        return graph
+
+    @staticmethod
+    def _get_producer(graph, name, op_type):
+        """Producer of name in the current graph if it has op_type and name has no other consumer."""
+        node = graph.get_node_by_output_in_current_graph(name)
+        if node is None or node.type != op_type or name in graph.outputs:
+            return None
+        if len(graph.find_output_consumers(name)) != 1:
+            return None
+        return node
+
+    @staticmethod
+    def _get_const(graph, name):
+        node = graph.get_node_by_output(name)
+        return node.get_tensor_value(as_list=False) if node is not None and node.is_const() else None
+
+    @staticmethod
+    def _is_per_tensor(graph, node):
+        shape = graph.get_shape(node.input[1])
+        return shape is not None and np.prod(shape) == 1
+
+    @staticmethod
+    def _get_axis(graph, dq):
+        """Axis of a per-channel DequantizeLinear, None if the rank of its input is unknown."""
+        axis = dq.get_attr("axis")
+        axis = axis.i if axis else 1
+        shape = graph.get_shape(dq.input[0])
+        if axis < 0:
+            return axis + len(shape) if shape is not None else None
+        return axis
+
+    def _move_transpose_above_dequantize(self, graph, trans):
+        consumers = graph.find_output_consumers(trans.output[0])
+        if len(consumers) != 1 or consumers[0].type not in ["Conv", "MatMul"] or \
+                trans.output[0] not in consumers[0].input[:2]:
+            return
+        # transpose_opt moves these down through DequantizeLinear
+        if is_nhwc_transpose(trans):
+            return
+        dq = self._get_producer(graph, trans.input[0], "DequantizeLinear")
+        if dq is None or len(dq.input) != 3:
+            return
+        perm = list(trans.get_attr("perm").ints)
+        attr = {}
+        if not self._is_per_tensor(graph, dq):
+            axis = dq.get_attr("axis")
+            axis = axis.i if axis else 1
+            attr["axis"] = perm.index(axis % len(perm))
+
+        output_name = trans.output[0]
+        shape = graph.get_shape(output_name)
+        dtype = graph.get_dtype(output_name)
+        graph.remove_node(trans.name)
+        graph.remove_node(dq.name)
+        new_trans = graph.make_node("Transpose", [dq.input[0]], attr={"perm": perm}, shapes=[shape],
+                                    dtypes=[graph.get_dtype(dq.input[0])])
+        graph.make_node("DequantizeLinear", [new_trans.output[0], dq.input[1], dq.input[2]], attr=attr,
+                        outputs=[output_name], shapes=[shape], dtypes=[dtype])
+
+    def _fuse(self, graph, quantize):
+        if len(quantize.input) != 3 or not self._is_per_tensor(graph, quantize):
+            return False
+        fused = [quantize]
+        name = quantize.input[0]
+        clip_min = None
+        clip = self._get_producer(graph, name, "Max")
+        if clip is not None:
+            name, clip_min = self._get_clip_min(graph, quantize, clip)
+            if clip_min is None:
+                return False
+            fused.append(clip)
+        relu = self._get_producer(graph, name, "Relu")
+        if relu is not None:
+            zero_point = self._get_const(graph, quantize.input[2])
+            if zero_point is None or zero_point.dtype != np.uint8 or zero_point.flatten()[0] != 0:
+                return False
+            fused.append(relu)
+            name = relu.input[0]
+
+        bias = None
+        add = self._get_producer(graph, name, "Add")
+        if add is not None:
+            for i in range(2):
+                bias = self._get_const(graph, add.input[1 - i])
+                if bias is not None:
+                    name = add.input[i]
+                    break
+            if bias is None:
+                return False
+            fused.append(add)
+
+        node = graph.get_node_by_output_in_current_graph(name)
+        if node is None or node.type not in ["Conv", "MatMul"] or name in graph.outputs or \
+                len(graph.find_output_consumers(name)) != 1:
+            return False
+        x_dq = graph.get_node_by_output_in_current_graph(node.input[0])
+        w_dq = graph.get_node_by_output_in_current_graph(node.input[1])
+        for dq in [x_dq, w_dq]:
+            if dq is None or dq.type != "DequantizeLinear" or len(dq.input) != 3:
+                return False
+        if not self._is_per_tensor(graph, x_dq):
+            return False
+        fused.append(node)
+
+        inputs = x_dq.input + w_dq.input + quantize.input[1:]
+        attr = {}
+        if node.type == "Conv":
+            # QLinearConv reads per-channel weight scales along the output channels
+            if not self._is_per_tensor(graph, w_dq) and self._get_axis(graph, w_dq) != 0:
+                return False
+            if bias is not None:
+                bias = self._bias_per_channel(graph, node, bias)
+                if bias is None:
+                    return False
+            if len(node.input) > 2 and node.input[2]:
+                conv_bias = self._get_const(graph, node.input[2])
+                if conv_bias is None:
+                    return False
+                bias = conv_bias if bias is None else conv_bias + bias
+            if bias is not None:
+                bias = self._quantize_bias(graph, x_dq, w_dq, bias)
+                if bias is None:
+                    return False
+                inputs.append(graph.make_const(utils.make_name(node.name + "_bias_quantized"), bias).output[0])
+            op_type = "QLinearConv"
+            attr = dict(node.attr)
+        else:
+            # QLinearMatMul has no bias
+            if bias is not None or not self._is_per_tensor(graph, w_dq):
+                return False
+            op_type = "QLinearMatMul"
+
+        output_name = quantize.output[0]
+        shape = graph.get_shape(output_name)
+        dtype = graph.get_dtype(output_name)
+        for n in fused:
+            graph.remove_node(n.name)
+        if clip_min is None:
+            graph.make_node(op_type, inputs, attr=attr, outputs=[output_name], shapes=[shape], dtypes=[dtype])
+        else:
+            qlinear = graph.make_node(op_type, inputs, attr=attr, shapes=[shape], dtypes=[dtype])
+            clip_min = graph.make_const(utils.make_name(node.name + "_clip_min"), clip_min)
+            graph.make_node("Clip", [qlinear.output[0], clip_min.output[0]], outputs=[output_name],
+                            shapes=[shape], dtypes=[dtype])
+        self.log.debug("fused %s into %s", [n.name for n in fused], op_type)
+        return True
+
+    def _get_clip_min(self, graph, quantize, clip):
+        """Input of the Max clip and its const min quantized like the output, None if it is no such clip."""
+        if graph.opset < _MIN_OPSET_INT_CLIP or len(clip.input) != 2:
+            return None, None
+        scale = self._get_const(graph, quantize.input[1])
+        zero_point = self._get_const(graph, quantize.input[2])
+        if scale is None or zero_point is None:
+            return None, None
+        for i in range(2):
+            clip_min = self._get_const(graph, clip.input[1 - i])
+            if clip_min is not None and clip_min.size == 1:
+                # same rounding as QuantizeLinear, half to even
+                info = np.iinfo(zero_point.dtype)
+                val = np.rint(clip_min.flatten()[0] / scale.flatten()[0]) + zero_point.flatten()[0]
+                return clip.input[i], np.array(np.clip(val, info.min, info.max), dtype=zero_point.dtype)
+        return None, None
+
+    @staticmethod
+    def _bias_per_channel(graph, conv, bias):
+        """Bias added to the NCHW output of conv as vector of the output channels, None if it is not one."""
+        w_shape = graph.get_shape(conv.input[1])
+        channels = w_shape[0] if w_shape else -1
+        if bias.size == 1:
+            return np.full([channels], bias.flatten()[0], dtype=bias.dtype) if channels > 0 else None
+        rank = len(graph.get_shape(conv.output[0]) or [])
+        shape = [1] * (rank - bias.ndim) + list(bias.shape)
+        if rank < 2 or len(shape) != rank or shape[1] != channels or bias.size != channels:
+            return None
+        return bias.flatten()
+
+    def _quantize_bias(self, graph, x_dq, w_dq, bias):
+        x_scale = self._get_const(graph, x_dq.input[1])
+        w_scale = self._get_const(graph, w_dq.input[1])
+        if x_scale is None or w_scale is None:
+            return None
+        # the int32 bias is added to the accumulator of the products of x and w
+        scale = x_scale.astype(np.float64).flatten()[0] * w_scale.astype(np.float64).flatten()
+        return np.round(bias / scale).astype(np.int32)
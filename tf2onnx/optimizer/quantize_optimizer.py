@@ -0,0 +1,178 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT license.
+
+"""Quantize Optimizer.
+   Dynamic int8 quantization of MatMul, Gemm and Conv with const float32 weights. The weights are quantized
+   symmetrically per output channel when converting, the float input is quantized at runtime with
+   DynamicQuantizeLinear and the product is computed by MatMulInteger or ConvInteger. The int32 result is
+   dequantized with the product of the input scale and the per-channel weight scales. Zero points of the weights
+   are the same for all channels since runtimes only support a single one for ConvInteger.
+"""
+
+from __future__ import unicode_literals
+
+import fnmatch
+
+import numpy as np
+from onnx import TensorProto
+
+from tf2onnx import utils
+from tf2onnx.optimizer.optimizer_base import GraphOptimizerBase
+
+# pylint: disable=logging-not-lazy,unused-argument,missing-docstring
+
+QUANTIZATION_MODES = ["dynamic"]
+
+# DynamicQuantizeLinear is new in opset 11
+_MIN_OPSET = 11
+# small weights don't gain from integer kernels
+MIN_WEIGHT_SIZE = 32
+
+
+def quantize_per_channel(weights, axis, dtype):
+    """Quantize weights symmetrically with one scale per slice along axis.
+    Args:
+        weights: float32 numpy array
+        axis: axis of the output channels
+        dtype: np.int8 or np.uint8, uint8 values are shifted by a zero point of 128
+    Return:
+        quantized weights, float32 scales of the channels and the zero point
+    """
+    reduce_axes = tuple(i for i in range(weights.ndim) if i != axis)
+    scale = (np.abs(weights).max(axis=reduce_axes) / 127.).astype(np.float32)
+    scale[scale == 0] = 1.
+    shape = [1] * weights.ndim
+    shape[axis] = -1
+    zero_point = 0 if dtype == np.int8 else 128
+    quantized = np.clip(np.round(weights / scale.reshape(shape)), -127, 127) + zero_point
+    return quantized.astype(dtype), scale, zero_point
+
+
+class QuantizeOptimizer(GraphOptimizerBase):
+
+    def __init__(self, mode="dynamic", exclude_nodes=None, debug=False):
+        """Create QuantizeOptimizer.
+        Args:
+            mode: quantization mode, one of QUANTIZATION_MODES
+            exclude_nodes: fnmatch patterns of node names not to quantize
+        """
+        super(QuantizeOptimizer, self).__init__("QuantizeOptimizer", debug)
+        utils.make_sure(mode in QUANTIZATION_MODES, "unknown quantization mode %s", mode)
+        self._mode = mode
+        self._exclude_nodes = exclude_nodes or []
+        self._quantized = 0
+
+    def _optimize(self, graph):
+        self._quantized = 0
+        if graph.opset < _MIN_OPSET:
+            self.log.warning("dynamic quantization needs opset %d or newer, model is not quantized", _MIN_OPSET)
+            return graph
+        graph = self._apply_optimization(graph, self._optimize_at_current_graph_level)
+        self.log.info("quantized %d nodes", self._quantized)
+        return graph
+
+    def _optimize_at_current_graph_level(self, graph):
+        # float input -> outputs of its DynamicQuantizeLinear, shared by the nodes consuming the input
+        quantized_inputs = {}
+        handlers = {"Conv": self._quantize_conv, "Gemm": self._quantize_gemm, "MatMul": self._quantize_matmul}
+        for node in list(graph.get_nodes()):
+            if node.type not in handlers or self._is_excluded(node):
+                continue
+            weights = self._get_weights(graph, node)
+            if weights is not None and handlers[node.type](graph, node, weights, quantized_inputs):
+                self._quantized += 1
+        return graph
+
+    def _is_excluded(self, node):
+        return any(fnmatch.fnmatchcase(node.name, pattern) for pattern in self._exclude_nodes)
+
+    @staticmethod
+    def _get_weights(graph, node):
+        if len(node.input) < 2 or graph.get_dtype(node.input[0]) != TensorProto.FLOAT:
+            return None
+        if not node.inputs[1].is_const():
+            return None
+        weights = node.inputs[1].get_tensor_value(as_list=False)
+        if weights.dtype != np.float32 or weights.size < MIN_WEIGHT_SIZE:
+            return None
+        return weights
+
+    def _quantize_matmul(self, graph, node, weights, quantized_inputs):
+        if weights.ndim != 2:
+            return False
+        q_weights, scale, zero_point = quantize_per_channel(weights, 1, np.int8)
+        self._replace(graph, node, "MatMulInteger", q_weights, zero_point, scale, quantized_inputs)
+        return True
+
+    def _quantize_gemm(self, graph, node, weights, quantized_inputs):
+        trans_a = node.get_attr("transA")
+        if trans_a and trans_a.i != 0:
+            return False
+        bias = None
+        if len(node.input) > 2 and node.input[2]:
+            if not node.inputs[2].is_const():
+                return False
+            beta = node.get_attr("beta")
+            bias = node.inputs[2].get_tensor_value(as_list=False) * (beta.f if beta else 1.)
+        trans_b = node.get_attr("transB")
+        if trans_b and trans_b.i != 0:
+            weights = weights.T
+        q_weights, scale, zero_point = quantize_per_channel(weights, 1, np.int8)
+        alpha = node.get_attr("alpha")
+        if alpha:
+            scale = scale * np.float32(alpha.f)
+        self._replace(graph, node, "MatMulInteger", q_weights, zero_point, scale, quantized_inputs, bias=bias)
+        return True
+
+    def _quantize_conv(self, graph, node, weights, quantized_inputs):
+        bias = None
+        if len(node.input) > 2 and node.input[2]:
+            if not node.inputs[2].is_const():
+                return False
+            bias = node.inputs[2].get_tensor_value(as_list=False)
+        # ConvInteger of onnxruntime only takes uint8 weights
+        q_weights, scale, zero_point = quantize_per_channel(weights, 0, np.uint8)
+        # scales and bias broadcast along the channel axis of NCHW
+        channel_shape = [1, -1] + [1] * (weights.ndim - 2)
+        scale = scale.reshape(channel_shape)
+        if bias is not None:
+            bias = bias.reshape(channel_shape)
+        self._replace(graph, node, "ConvInteger", q_weights, zero_point, scale, quantized_inputs, bias=bias,
+                      attr=dict(node.attr))
+        return True
+
+    @staticmethod
+    def _quantize_input(graph, name, quantized_inputs):
+        if name not in quantized_inputs:
+            dq = graph.make_node("DynamicQuantizeLinear", [name], output_count=3,
+                                 shapes=[graph.get_shape(name), [], []],
+                                 dtypes=[TensorProto.UINT8, TensorProto.FLOAT, TensorProto.UINT8])
+            quantized_inputs[name] = dq.output
+        return quantized_inputs[name]
+
+    def _replace(self, graph, node, op_type, q_weights, zero_point, scale, quantized_inputs, bias=None, attr=None):
+        """Replace node by op_type on the quantized input and weights followed by the dequantization."""
+        x_quantized, x_scale, x_zero_point = self._quantize_input(graph, node.input[0], quantized_inputs)
+        output_name = node.output[0]
+        shape = graph.get_shape(output_name)
+        graph.remove_node(node.name)
+
+        w = graph.make_const(utils.make_name(node.name + "_w_quantized"), q_weights)
+        w_zero_point = graph.make_const(utils.make_name(node.name + "_w_zero_point"),
+                                        np.array(zero_point, dtype=q_weights.dtype))
+        w_scale = graph.make_const(utils.make_name(node.name + "_w_scale"), scale)
+        integer = graph.make_node(op_type, [x_quantized, w.output[0], x_zero_point, w_zero_point.output[0]],
+                                  attr=attr, shapes=[shape], dtypes=[TensorProto.INT32])
+        cast = graph.make_node("Cast", integer.output, attr={"to": TensorProto.FLOAT}, shapes=[shape],
+                               dtypes=[TensorProto.FLOAT])
+        y_scale = graph.make_node("Mul", [x_scale, w_scale.output[0]], shapes=[list(scale.shape)],
+                                  dtypes=[TensorProto.FLOAT])
+        if bias is None:
+            graph.make_node("Mul", [cast.output[0], y_scale.output[0]], outputs=[output_name], shapes=[shape],
+                            dtypes=[TensorProto.FLOAT])
+            return
+        dequantized = graph.make_node("Mul", [cast.output[0], y_scale.output[0]], shapes=[shape],
+                                      dtypes=[TensorProto.FLOAT])
+        b = graph.make_const(utils.make_name(node.name + "_bias"), bias.astype(np.float32))
+        graph.make_node("Add", [dequantized.output[0], b.output[0]], outputs=[output_name], shapes=[shape],
+                        dtypes=[TensorProto.FLOAT])
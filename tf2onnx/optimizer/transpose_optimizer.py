@@ -65,10 +65,7 @@ class TransposeOptimizer(GraphOptimizerBase):
 
             # point all children nodes inputs to the new node
             for output_name in reshape_op.output:
-                for child in ops:
-                    for i, name in enumerate(child.input):
-                        if name == output_name:
-                            child.input[i] = const_name
+                self._g.replace_all_inputs(output_name, const_name)
             self._g.make_const(const_name, new_data)
             self._g.remove_node(reshape_op.name)
             self._g.topological_sort(self._g.get_nodes())
@@ -122,15 +119,27 @@ class TransposeOptimizer(GraphOptimizerBase):
             transpose_out = transposes[0].output[0]
             for node in transposes[1:]:
                 old_transpose_out = node.output[0]
-                graph.replace_all_inputs(graph.get_nodes(), old_transpose_out, transpose_out)
+                graph.replace_all_inputs(old_transpose_out, transpose_out)
 
         # dangling transpose nodes can be deleted
         graph.delete_unused_nodes(graph.outputs)
 
     def optimize(self, graph):
+        previous_counter = graph.dump_node_statistics()
+        graph = self._apply_optimization(graph, self._optimize_at_current_graph_level)
+        self._g = graph
+
+        current_counter = self._g.dump_node_statistics()
+        transpose_cnt = current_counter["Transpose"]
+        self.log.info(" %d transpose op(s) left", transpose_cnt)
+        self._print_stat_diff(previous_counter, current_counter)
+        if transpose_cnt > 2:
+            self.log.warning("please try add --fold_const to help remove more transpose")
+        return self._g
+
+    def _optimize_at_current_graph_level(self, graph):
         self._g = graph
         self.pre_optimize_action()
-        previous_counter = self._g.dump_node_statistics()
         no_action = False
         iteration_cnt = 0
         while not no_action:
@@ -159,13 +168,6 @@ class TransposeOptimizer(GraphOptimizerBase):
 
         self.merge_duplicated_transposes()
         self.post_optimize_action()
-
-        current_counter = self._g.dump_node_statistics()
-        transpose_cnt = current_counter["Transpose"]
-        self.log.info(" %d transpose op(s) left", transpose_cnt)
-        self._print_stat_diff(previous_counter, current_counter)
-        if transpose_cnt > 2:
-            self.log.warning("please try add --fold_const to help remove more transpose")
         return self._g
 
     def _initialize_handlers(self):
@@ -174,12 +176,14 @@ class TransposeOptimizer(GraphOptimizerBase):
             "Cast": self._simple_through_handler,
             "Clip": self._simple_through_handler,
             "Concat": self._concat_handler,
+            "DequantizeLinear": self._quantize_linear_handler,
             "Identity": self._identity_handler,
             "LeakyRelu": self._simple_through_handler,
             "Max": self._maxmin_handler,
             "Min": self._maxmin_handler,
             "Mul": self._mul_handler,
             "Pad": self._pad_handler,
+            "QuantizeLinear": self._quantize_linear_handler,
             "ReduceMean": self._reducemean_handler,
             "Relu": self._simple_through_handler,
             "Shape": self._shape_handler,
@@ -201,7 +205,7 @@ class TransposeOptimizer(GraphOptimizerBase):
             for n in input_transposes:
                 n_input = n.input[0]
                 utils.make_sure(len(n.output) == 1, "only expect single output")
-                self._g.replace_all_inputs(self._g.get_nodes(), n.output[0], n_input)
+                self._g.replace_all_inputs(n.output[0], n_input)
                 self._g.remove_node(n.name)
 
             utils.make_sure(len(node.output) == 1, "only expect single output")
@@ -212,7 +216,7 @@ class TransposeOptimizer(GraphOptimizerBase):
             for n in output_transposes:
                 n_input = n.input[0]
                 utils.make_sure(len(n.output) == 1, "only expect single output")
-                self._g.replace_all_inputs(self._g.get_nodes(), n.output[0], n_input)
+                self._g.replace_all_inputs(n.output[0], n_input)
                 self._g.remove_node(n.name)
             return True
 
@@ -236,10 +240,9 @@ class TransposeOptimizer(GraphOptimizerBase):
 
         input_index = self._get_input_index_for_trans(node, trans)
 
-        ops = self._g.get_nodes()
-        self._g.replace_all_inputs(ops, node.output[0], trans.output[0])
-        node.input[input_index] = trans.input[0]
-        trans.input[0] = node.output[0]
+        self._g.replace_all_inputs(node.output[0], trans.output[0])
+        self._g.replace_input(node, node.input[input_index], trans.input[0], input_index)
+        self._g.replace_input(trans, trans.input[0], node.output[0], 0)
 
         # need to transpose node shape in backward direction as well after switch
         # otherwise, reshape added in post_optimize_action may not work correctly
@@ -276,7 +279,7 @@ class TransposeOptimizer(GraphOptimizerBase):
         return False
 
     def _remove_useless_tranpose(self, trans):
-        self._g.replace_all_inputs(self._g.get_nodes(), trans.output[0], trans.input[0])
+        self._g.replace_all_inputs(trans.output[0], trans.input[0])
         self._g.remove_node(trans.name)
 
     def _transpose_has_single_consumer_node(self, trans_nodes):
@@ -324,14 +327,13 @@ class TransposeOptimizer(GraphOptimizerBase):
     def _add_handler(self, trans, node):
         if node.inputs[1].is_const():
             t_p = trans.inputs[0]
-            if t_p.type in ("Conv", "ConvTranspose") and len(t_p.input) == 2:
+            if t_p.type in ("Conv", "ConvTranspose") and len(t_p.input) == 2 and t_p.graph is self._g:
                 # if Conv or ConvTranspose's bias input is not set, then we set, otherwise, we don't set
                 # todo: maybe we can add already set bias with the input??? try later
                 conv_inputs = [t_p.input[0], t_p.input[1], node.input[1]]
                 conv_node = self._g.make_node(t_p.type, conv_inputs, attr=t_p.attr_onnx)
-                ops = self._g.get_nodes()
-                trans.input[0] = utils.port_name(conv_node.name)
-                self._g.replace_all_inputs(ops, node.output[0], trans.output[0])
+                self._g.replace_input(trans, trans.input[0], utils.port_name(conv_node.name), 0)
+                self._g.replace_all_inputs(node.output[0], trans.output[0])
 
                 self._g.remove_node(t_p.name)
                 self._g.remove_node(node.name)
@@ -341,8 +343,7 @@ class TransposeOptimizer(GraphOptimizerBase):
 
     def _transpose_handler(self, trans, node):
         if is_nchw_transpose(node):
-            ops = self._g.get_nodes()
-            self._g.replace_all_inputs(ops, node.output[0], trans.input[0])
+            self._g.replace_all_inputs(node.output[0], trans.input[0])
 
             shape = self._g.get_shape(node.output[0])
             dtype = self._g.get_dtype(node.output[0])
@@ -361,10 +362,13 @@ class TransposeOptimizer(GraphOptimizerBase):
         all_other_inputs_const = all([self._g.get_node_by_output(i).is_const() for i in all_other_inputs])
         if all_other_inputs_const is False:
             return False
+        # consts of an outer graph may have other consumers there
+        if any(self._g.get_node_by_output(i).graph is not self._g for i in all_other_inputs):
+            return False
 
-        shapes = [len(self._g.get_shape(i)) for i in all_other_inputs]
-        shapes_not_one_and_four = [s for s in shapes if s not in [1, 4]]
-        if shapes_not_one_and_four:
+        vals = [self._g.get_node_by_output(i).get_tensor_value(as_list=False) for i in all_other_inputs]
+        # vectors broadcast along the last axis, they are not independent of the layout
+        if any(val.ndim != 4 and val.size != 1 for val in vals):
             return False
 
         for i in all_other_inputs:
@@ -374,11 +378,7 @@ class TransposeOptimizer(GraphOptimizerBase):
             if rank == 4:
                 transposed_val = np.transpose(numpy_val, (0, 3, 1, 2))
                 target_node.set_tensor_value(transposed_val)
-            elif rank == 1:  # scalar
-                # do nothing
-                pass
-            else:
-                raise ValueError("find rank !=1 and rank !=4, should not go here.")
+            # scalars and single element tensors stay as they are
         return self._switch_transpose_and_node(node, trans)
 
     def _mul_handler(self, trans, node):
@@ -398,7 +398,8 @@ class TransposeOptimizer(GraphOptimizerBase):
         if multiplier_input_id == node.input[1]:
             t_p = trans.inputs[0]
             # make sure conv don't have bias set
-            if t_p.type == "Conv" and t_p.inputs[1].is_const() and len(t_p.input) == 2:
+            if t_p.type == "Conv" and t_p.graph is self._g and t_p.inputs[1].is_const() \
+                    and t_p.inputs[1].graph is self._g and len(t_p.input) == 2:
                 conv = t_p
                 numpy_val = conv.inputs[1].get_tensor_value(as_list=False)
                 transposed_val = np.transpose(numpy_val, (2, 3, 1, 0))
@@ -406,8 +407,7 @@ class TransposeOptimizer(GraphOptimizerBase):
                 result = np.multiply(transposed_val, mul_val)
                 conv.inputs[1].set_tensor_value(np.transpose(result, (3, 2, 0, 1)))
 
-                ops = self._g.get_nodes()
-                self._g.replace_all_inputs(ops, node.output[0], trans.output[0])
+                self._g.replace_all_inputs(node.output[0], trans.output[0])
                 self._g.remove_node(node.name)
                 return True
 
@@ -420,8 +420,7 @@ class TransposeOptimizer(GraphOptimizerBase):
     def _identity_handler(self, trans, node):
         if node.output[0] in self._g.outputs:
             return False
-        ops = self._g.get_nodes()
-        self._g.replace_all_inputs(ops, node.output[0], trans.output[0])
+        self._g.replace_all_inputs(node.output[0], trans.output[0])
         self._g.remove_node(node.name)
         return True
 
@@ -468,6 +467,15 @@ class TransposeOptimizer(GraphOptimizerBase):
     def _simple_through_handler(self, trans, node):
         return self._switch_transpose_and_node(node, trans)
 
+    def _quantize_linear_handler(self, trans, node):
+        # per-tensor (de)quantization works on each element, per-axis would need the axis changed
+        if trans.output[0] != node.input[0]:
+            return False
+        scale_shape = self._g.get_shape(node.input[1])
+        if scale_shape is None or np.prod(scale_shape) != 1:
+            return False
+        return self._switch_transpose_and_node(node, trans)
+
     def _shape_handler(self, trans, node):
         # input > trans > shape  can be changed into  input > shape > gather
         if not self._transpose_has_single_consumer_node([trans]):
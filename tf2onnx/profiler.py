@@ -0,0 +1,143 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT license.
+
+"""
+tf2onnx.profiler - collect per-phase statistics of a conversion
+"""
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import collections
+import contextlib
+import json
+import time
+import tracemalloc
+
+# pylint: disable=missing-docstring
+
+
+class Profiler(object):
+    """Record wall time, node count delta and peak memory of conversion phases.
+
+    Phases are opened with the phase() context manager and may be nested, for example
+    a handler call inside tensorflow_onnx_mapping. Phases of category "handler" are
+    aggregated per op type, all other phases are kept in the order they ran.
+    Memory is measured with tracemalloc which slows down the conversion noticeably,
+    pass trace_memory=False if only timings are of interest.
+    """
+
+    def __init__(self, enabled=True, trace_memory=True):
+        self.enabled = enabled
+        self._trace_memory = enabled and trace_memory
+        self._started_tracing = False
+        self._phases = []
+        self._handlers = collections.OrderedDict()
+        self._stack = []
+        self._start_time = time.time()
+
+    @contextlib.contextmanager
+    def phase(self, name, count_nodes=None, category="phase"):
+        """Profile the code run in the with block.
+        Args:
+            name: name of the phase, for handlers the op type
+            count_nodes: callable returning the current number of nodes, called on enter and exit
+            category: kind of phase, for example rewriter, handler or optimizer
+        Yields:
+            the record of the phase which can be updated by the caller
+        """
+        if not self.enabled:
+            yield {}
+            return
+
+        self._start_memory_trace()
+        record = {
+            "name": name,
+            "category": category,
+            "depth": len(self._stack),
+            "nodes_before": count_nodes() if count_nodes else None,
+        }
+        frame = self._enter_memory_frame()
+        self._stack.append(frame)
+        start = time.time()
+        try:
+            yield record
+        finally:
+            record["time"] = time.time() - start
+            self._stack.pop()
+            record["peak_memory"] = self._exit_memory_frame(frame)
+            if count_nodes:
+                record["nodes_after"] = count_nodes()
+            record.setdefault("nodes_after", None)
+            self._add_record(record)
+
+    def report(self):
+        """Stop profiling and return all collected statistics as dict."""
+        self._stop_memory_trace()
+        handlers = sorted(self._handlers.values(), key=lambda h: h["time"], reverse=True)
+        return {
+            "total_time": time.time() - self._start_time,
+            "trace_memory": self._trace_memory,
+            "phases": self._phases,
+            "handlers": handlers,
+        }
+
+    def save(self, path):
+        """Write report as json to path."""
+        with open(path, "w") as f:
+            json.dump(self.report(), f, indent=2)
+
+    def _add_record(self, record):
+        if record["nodes_before"] is not None and record["nodes_after"] is not None:
+            record["node_delta"] = record["nodes_after"] - record["nodes_before"]
+        else:
+            record["node_delta"] = None
+
+        if record["category"] != "handler":
+            self._phases.append(record)
+            return
+
+        stats = self._handlers.get(record["name"])
+        if stats is None:
+            stats = {"op_type": record["name"], "calls": 0, "time": 0., "node_delta": 0, "peak_memory": 0}
+            self._handlers[record["name"]] = stats
+        stats["calls"] += 1
+        stats["time"] += record["time"]
+        stats["node_delta"] += record["node_delta"] or 0
+        stats["peak_memory"] = max(stats["peak_memory"], record["peak_memory"])
+
+    def _start_memory_trace(self):
+        if self._trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+
+    def _stop_memory_trace(self):
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+    def _read_peak(self):
+        """Return current and peak traced memory, peak is reset so nested phases can be told apart."""
+        if not tracemalloc.is_tracing():
+            return 0, 0
+        current, peak = tracemalloc.get_traced_memory()
+        # reset_peak is only available in python >= 3.9, the peak is monotonic without it
+        if hasattr(tracemalloc, "reset_peak"):
+            tracemalloc.reset_peak()
+        return current, peak
+
+    def _enter_memory_frame(self):
+        current, peak = self._read_peak()
+        if self._stack:
+            parent = self._stack[-1]
+            parent["peak"] = max(parent["peak"], peak)
+        return {"start": current, "peak": current}
+
+    def _exit_memory_frame(self, frame):
+        _, peak = self._read_peak()
+        frame["peak"] = max(frame["peak"], peak)
+        if self._stack:
+            parent = self._stack[-1]
+            parent["peak"] = max(parent["peak"], frame["peak"])
+        return frame["peak"] - frame["start"]
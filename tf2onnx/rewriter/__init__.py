@@ -12,6 +12,7 @@ from tf2onnx.rewriter.leakyrelu_rewriter import rewrite_leakyrelu
 from tf2onnx.rewriter.rnn import rewrite_single_direction_lstm, rewrite_bi_direction_lstm, \
     rewrite_single_direction_gru, rewrite_bi_direction_gru, \
     rewrite_custom_rnn_cell, rewrite_generic_loop
+from tf2onnx.rewriter.unrolled_rnn_rewriter import rewrite_unrolled_lstm, rewrite_unrolled_gru
 
 __all__ = [
     "rewrite_cond",
@@ -22,6 +23,8 @@ __all__ = [
     "rewrite_bi_direction_lstm",
     "rewrite_single_direction_gru",
     "rewrite_bi_direction_gru",
+    "rewrite_unrolled_lstm",
+    "rewrite_unrolled_gru",
     "rewrite_custom_rnn_cell",
     "rewrite_generic_loop"
 ]
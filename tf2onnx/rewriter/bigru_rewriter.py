@@ -109,8 +109,7 @@ def process_bigru(g, bi_grus):
             if reverse_node.type == "Transpose":
                 reverse_node = reverse_node.inputs[0]
 
-            g.replace_all_inputs(
-                g.get_nodes(), reverse_node.output[0], reverse_node.input[0])
+            g.replace_all_inputs(reverse_node.output[0], reverse_node.input[0])
             g.remove_node(reverse_node.name)
         else:
             raise ValueError(
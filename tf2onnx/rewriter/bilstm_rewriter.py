@@ -96,7 +96,7 @@ def process_bilstm(g, bi_lstms):
             if reverse_node.type == "Transpose":
                 reverse_node = reverse_node.inputs[0]
 
-            g.replace_all_inputs(g.get_nodes(), reverse_node.output[0], reverse_node.input[0])
+            g.replace_all_inputs(reverse_node.output[0], reverse_node.input[0])
             g.remove_node(reverse_node.name)
         else:
             raise ValueError("Reverse is still used by LSTM as input, cannot remove")
@@ -119,7 +119,7 @@ def slice_bilstm_for_original_lstm_consumers(g, lstm_fw, lstm_bw, bi_lstm, lstm_
 
         for r_op in reverse_nodes:
             log.debug("remove reverse op called %s", r_op.name)
-            g.replace_all_inputs(all_nodes, r_op.output[0], r_op.input[0])
+            g.replace_all_inputs(r_op.output[0], r_op.input[0])
             to_remove.append(r_op.name)
     elif lstm_output_index in [1, 2]:
         axis = 0
@@ -130,13 +130,13 @@ def slice_bilstm_for_original_lstm_consumers(g, lstm_fw, lstm_bw, bi_lstm, lstm_
         attr = {"axes": [axis], "starts": [0], "ends": [1]}
         slice_node_fw = g.make_node("Slice", [bi_lstm.output[lstm_output_index]], attr=attr)
         all_nodes.append(slice_node_fw)
-        g.replace_all_inputs(fw_consumers, lstm_fw.output[lstm_output_index], slice_node_fw.output[0])
+        g.replace_all_inputs(lstm_fw.output[lstm_output_index], slice_node_fw.output[0], ops=fw_consumers)
 
     if bw_consumers:
         attr = {"axes": [axis], "starts": [1], "ends": [2]}
         slice_node_bw = g.make_node("Slice", [bi_lstm.output[lstm_output_index]], attr=attr)
         all_nodes.append(slice_node_bw)
-        g.replace_all_inputs(bw_consumers, lstm_bw.output[lstm_output_index], slice_node_bw.output[0])
+        g.replace_all_inputs(lstm_bw.output[lstm_output_index], slice_node_bw.output[0], ops=bw_consumers)
 
 
 def check_const(g, input_id):
@@ -144,9 +144,9 @@ class CustomRnnRewriter(LoopRewriterBase):
                 if self.g.opset == 8:
                     nodes = self._adapt_scan_sequence_input_or_output("state_output_reshape",
                                                                       scan_node.output[index], True)
-                    self.g.replace_all_inputs(self.g.get_nodes(), out_tensor_value_info.id, nodes[-1].output[0])
+                    self.g.replace_all_inputs(out_tensor_value_info.id, nodes[-1].output[0])
                 else:  # since opset 9
-                    self.g.replace_all_inputs(self.g.get_nodes(), out_tensor_value_info.id, scan_node.output[index])
+                    self.g.replace_all_inputs(out_tensor_value_info.id, scan_node.output[index])
             index += 1
 
         for out_tensor_value_info in context.loop_properties.scan_outputs_exits:
@@ -154,9 +154,9 @@ class CustomRnnRewriter(LoopRewriterBase):
                 if self.g.opset == 8:
                     nodes = self._adapt_scan_sequence_input_or_output("scan_output_reshape",
                                                                       scan_node.output[index], True)
-                    self.g.replace_all_inputs(self.g.get_nodes(), out_tensor_value_info.id, nodes[-1].output[0])
+                    self.g.replace_all_inputs(out_tensor_value_info.id, nodes[-1].output[0])
                 else:  # since opset 9
-                    self.g.replace_all_inputs(self.g.get_nodes(), out_tensor_value_info.id, scan_node.output[index])
+                    self.g.replace_all_inputs(out_tensor_value_info.id, scan_node.output[index])
             index += 1
 
 
@@ -168,8 +168,8 @@ class GRUUnitRewriter(UnitRnnRewriterBase):
             context.onnx_input_ids["initial_state"] = const_node.output[0]
             return
         squeeze_node = self.g.make_node("Unsqueeze", [initializer_input_id], attr={"axes": [0]})
-        to_replace = [n for n in self.g.get_nodes() if n != squeeze_node]
-        self.g.replace_all_inputs(to_replace, initializer_input_id, squeeze_node.output[0])
+        to_replace = [n for n in self.g.find_output_consumers(initializer_input_id) if n != squeeze_node]
+        self.g.replace_all_inputs(initializer_input_id, squeeze_node.output[0], ops=to_replace)
         context.onnx_input_ids["initial_state"] = squeeze_node.output[0]
 
     def create_rnn_node(self, context):
@@ -208,4 +208,4 @@ class GRUUnitRewriter(UnitRnnRewriterBase):
         squeeze_node = self.g.make_node("Squeeze", [output_id], attr={"axes": [0]},
                                         shapes=[output_shape], dtypes=[self.g.get_dtype(output_id)])
 
-        self.g.replace_all_inputs(self.g.get_nodes(), exit_output_id, squeeze_node.output[0])
+        self.g.replace_all_inputs(exit_output_id, squeeze_node.output[0])
@@ -43,7 +43,7 @@ def rewrite_leakyrelu(g, ops):
             ops.remove(max_node)
             ops.remove(mul_node)
             ops.append(leakyrelu)
-            g.replace_all_inputs(ops, max_node.output[0], leakyrelu.output[0])
+            g.replace_all_inputs(max_node.output[0], leakyrelu.output[0])
 
     return ops
 
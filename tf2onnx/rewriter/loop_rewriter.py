@@ -46,13 +46,17 @@ class LoopRewriter(LoopRewriterBase):
 
             # todo(pengwa): we don't check the case where loop body won't be executed at all.
 
+            if loop_props.has_scan_semantics and self.g.opset >= 9:
+                # Scan iterates the scan inputs without evaluating the condition and preallocates the outputs
+                return self._rewrite_to_scan(context)
+
             ## create Loop body graph with existing nodes
 
             # replace condition graph's inputs to be cell graph's outputs, because we want condition graph
             # to consumer cell graph outputs.
             for loop_var in cond_g_info.dependent_vars:
-                self.g.replace_all_inputs(cond_g_info.nodes, loop_var.switch_true_identity_output.id,
-                                          loop_var.next_iteration_input.id)
+                self.g.replace_all_inputs(loop_var.switch_true_identity_output.id,
+                                          loop_var.next_iteration_input.id, ops=cond_g_info.nodes)
 
             body_nodes = set(cell_g_info.nodes + cond_g_info.nodes)
             body_outputs = cond_g_info.outputs + cell_g_info.outputs
@@ -64,27 +68,14 @@ class LoopRewriter(LoopRewriterBase):
             # create loop body graph inputs
             loop_body_g.add_graph_input(utils.make_name("i"), TensorProto.INT64, ())
             loop_body_g.add_graph_input(utils.make_name("cond"), TensorProto.BOOL, ())
-            for i, tensor_value_info in enumerate(loop_props.state_inputs):
-                input_name = tensor_value_info.id
-                if input_name is None:
-                    # if the variable is not used in the body graph, then we created a fake one,
-                    # the same type and shape as its corresponding output.
-                    out_tensor_value_info = loop_props.state_outputs[i]
-                    dtype = out_tensor_value_info.dtype
-                    shape = out_tensor_value_info.shape
-                    input_name = utils.make_name("unused_state_input_")
-                else:
-                    dtype = tensor_value_info.dtype
-                    shape = tensor_value_info.shape
-
-                loop_body_g.add_graph_input(input_name, dtype, utils.create_vague_shape_like(shape))
+            self._add_state_inputs(loop_body_g, loop_props)
 
             for input_ta in loop_props.tensor_array_inputs:
                 # Loop does not have scan inputs, so we use Gather to get data for each iteration.
                 index_node = loop_body_g.make_node("Unsqueeze", [input_ta.index_input_id], attr={"axes": [0]})
                 gather_node = loop_body_g.make_node("Gather", [input_ta.data_input_id, index_node.output[0]])
                 data_node = loop_body_g.make_node("Squeeze", [gather_node.output[0]], attr={"axes": [0]})
-                loop_body_g.replace_all_inputs(loop_body_g.get_nodes(), input_ta.consumer.id, data_node.output[0])
+                loop_body_g.replace_all_inputs(input_ta.consumer.id, data_node.output[0])
 
             ## create Loop node
             loop_node = self._create_loop_node(context, loop_props)
@@ -101,7 +92,51 @@ class LoopRewriter(LoopRewriterBase):
             log.error("loop rewrite failed, due to exception: %s, details:%s", ex, tb)
             return REWRITER_RESULT.FAIL
 
-    def _create_loop_node(self, context, loop_props):
+    def _rewrite_to_scan(self, context):
+        loop_props = context.loop_properties
+        cell_g_info = context.cell_graph
+
+        # the condition graph is not needed, the cell graph gets the elements of the tensor arrays as scan inputs
+        body_outputs = cell_g_info.outputs
+        for out_tensor_value_info in body_outputs:
+            out_tensor_value_info.shape = utils.create_vague_shape_like(out_tensor_value_info.shape)
+        scan_body_g = LoopRewriterBase.construct_graph_from_nodes(self.g, cell_g_info.nodes, body_outputs)
+        self._add_state_inputs(scan_body_g, loop_props)
+        for tensor_value_info in loop_props.scan_inputs:
+            scan_body_g.add_graph_input(tensor_value_info.id, tensor_value_info.dtype,
+                                        utils.create_vague_shape_like(tensor_value_info.shape))
+
+        scan_outputs, scan_output_shapes, scan_output_dtypes = self._get_loop_outputs(loop_props)
+        scan_node = self.g.make_node("Scan", loop_props.state_inputs_initial_values +
+                                     loop_props.scan_inputs_initial_values,
+                                     attr={"num_scan_inputs": len(loop_props.scan_inputs)},
+                                     outputs=scan_outputs, op_name_scope="generic_scan",
+                                     shapes=scan_output_shapes, dtypes=scan_output_dtypes,
+                                     skip_conversion=False)
+        scan_node.set_body_graph_as_attr("body", scan_body_g)
+
+        log.debug("rewrite to scan successfully")
+        return REWRITER_RESULT.OK
+
+    @staticmethod
+    def _add_state_inputs(body_g, loop_props):
+        for i, tensor_value_info in enumerate(loop_props.state_inputs):
+            input_name = tensor_value_info.id
+            if input_name is None:
+                # if the variable is not used in the body graph, then we created a fake one,
+                # the same type and shape as its corresponding output.
+                out_tensor_value_info = loop_props.state_outputs[i]
+                dtype = out_tensor_value_info.dtype
+                shape = out_tensor_value_info.shape
+                input_name = utils.make_name("unused_state_input_")
+            else:
+                dtype = tensor_value_info.dtype
+                shape = tensor_value_info.shape
+
+            body_g.add_graph_input(input_name, dtype, utils.create_vague_shape_like(shape))
+
+    def _get_loop_outputs(self, loop_props):
+        """Names, shapes and dtypes of the outputs of the loop, reusing the names of the exits."""
         loop_outputs = []
         loop_output_shapes = []
         loop_output_dtypes = []
@@ -116,6 +151,10 @@ class LoopRewriter(LoopRewriterBase):
                 loop_outputs.append(utils.make_name("unused_loop_output_"))
                 loop_output_shapes.append([-1])
                 loop_output_dtypes.append(None)
+        return loop_outputs, loop_output_shapes, loop_output_dtypes
+
+    def _create_loop_node(self, context, loop_props):
+        loop_outputs, loop_output_shapes, loop_output_dtypes = self._get_loop_outputs(loop_props)
 
         # trip count and cond are not used, giving them values just because bug
         # (https://github.com/Microsoft/onnxruntime/issues/255) of onnxruntime.
@@ -53,6 +53,11 @@ class LoopProperties(object):
 
         self.tensor_array_inputs = []  # list of type InputTensorArray
 
+        # True if the loop runs exactly once per element of its scan inputs: the condition only compares counters
+        # starting at 0 and increased by 1 with the length of all scan inputs, and these counters are the indices
+        # of all tensor array reads and writes.
+        self.has_scan_semantics = False
+
     def add_variable(self, var):
         utils.make_sure(var.enter_name not in self.scan_variables,
                         "variable %s already exists as scan variable.", var.enter_name)
@@ -154,15 +159,16 @@ class LoopVariable(object):
 
         # only applicable for tensor array variable
         self.is_tensor_array = is_tensor_array
-        # todo: need check ta's index variable is a scalar starting from 1, and increase by 1 each iteration.
-        # then we can be sure this is equivalent to scan output behavior.
+        # the index of the write, equivalent to scan output behavior if LoopProperties.has_scan_semantics
         self.ta_index_id = ta_index_id
 
 
 class InputTensorArray(object):
-    def __init__(self, data_input_id, index_input_id, consumer_id, g):
+    def __init__(self, data_input_id, index_input_id, consumer_id, tensor_array_id, g):
         self.index_input_id = index_input_id
         self.data_input_id = data_input_id
+        # handle of the tensor array the data is unstacked to
+        self.tensor_array_id = tensor_array_id
 
         # tensor array is unstacked before being used in loop, consumer_id is the node
         # (in the iteration body graph) consuming one of the element of tensor array.
@@ -229,6 +235,7 @@ class LoopRewriterBase(object):
     def _check_in_read_only_mode(self, context):
         self._parse_loop_variables(context)
         self._parse_input_ta(context)
+        context.loop_properties.has_scan_semantics = self._parse_scan_semantics(context)
 
     def _parse_loop_variables(self, context):
         loop_cond_op = context.loop_cond
@@ -256,13 +263,112 @@ class LoopRewriterBase(object):
             data_input_id = ta_input_scatter.input[2]
             ta_read_node = match.get_op("ta_read")
 
-            # todo: need check ta's index variable is a scalar starting from 1, and increase by 1 each iteration.
-            # then we can be sure this is equivalent to scan input behavior.
+            # equivalent to scan input behavior if LoopProperties.has_scan_semantics
             index_input_id = ta_read_node.input[1]
             unstacked_ta_consumer = match.get_op("ta_read").output[0]
-            ta = InputTensorArray(data_input_id, index_input_id, unstacked_ta_consumer, self.g)
+            tensor_array_id = match.get_op("ta_enter").input[0]
+            ta = InputTensorArray(data_input_id, index_input_id, unstacked_ta_consumer, tensor_array_id, self.g)
             context.loop_properties.add_scan_input(ta)
 
+    def _parse_scan_semantics(self, context):
+        loop_props = context.loop_properties
+        # Scan gets the number of iterations from the scan inputs
+        if not loop_props.tensor_array_inputs:
+            return False
+
+        counters = [v.switch_true_identity_output.id for v in loop_props.state_variables.values()
+                    if self._is_unit_step_counter(v)]
+        indices = [ta.index_input_id for ta in loop_props.tensor_array_inputs] + \
+                  [v.ta_index_id for v in loop_props.scan_variables.values()]
+        if any(i not in counters for i in indices):
+            log.debug("tensor arrays are not indexed by a counter starting at 0 with step 1")
+            return False
+
+        # every condition must end the loop after the last element, tf.while_loop adds one for maximum_iterations
+        conditions = [context.loop_cond.inputs[0]]
+        while conditions:
+            cond = conditions.pop()
+            if cond is not None and cond.type == "LogicalAnd":
+                conditions.extend(cond.inputs)
+                continue
+            if cond is None or cond.type != "Less":
+                log.debug("loop condition is not a comparison of a counter and the scan length")
+                return False
+            var = self._get_loop_var_from_merge(context, cond.input[0])
+            if var is None or var.switch_true_identity_output.id not in counters:
+                return False
+            if not all(self._is_length_of(cond.input[1], ta) for ta in loop_props.tensor_array_inputs):
+                log.debug("cannot prove that %s is the length of the scan inputs", cond.input[1])
+                return False
+        return True
+
+    def _get_loop_var_from_merge(self, context, merge_output_id):
+        # the condition graph reads the loop variables from Merge
+        merge_node = self.g.get_node_by_output(merge_output_id)
+        if merge_node is None or merge_node.type != "Merge":
+            return None
+        enter_nodes = [n for n in merge_node.inputs if n.type == "Enter"]
+        if not enter_nodes:
+            return None
+        return context.loop_properties.all_variables.get(enter_nodes[0].name)
+
+    def _is_unit_step_counter(self, var):
+        """Check that var starts at 0 and is increased by 1 each iteration."""
+        identity_output_id = var.switch_true_identity_output.id
+        if var.is_tensor_array or not identity_output_id:
+            return False
+        initial_value = self.g.get_node_by_output(var.enter_input_id)
+        if initial_value is None or not initial_value.is_const() or initial_value.get_tensor_value() != 0:
+            return False
+        add_node = self.g.get_node_by_output(var.next_iteration_input.id)
+        if add_node is None or add_node.type != "Add" or identity_output_id not in add_node.input:
+            return False
+        step = add_node.inputs[1 - add_node.input.index(identity_output_id)]
+        return step is not None and step.is_const() and step.get_tensor_value() == 1
+
+    def _skip_identity_and_enter(self, tensor_id):
+        node = self.g.get_node_by_output(tensor_id)
+        while node is not None and node.type in ["Identity", "Enter"]:
+            node = node.inputs[0]
+        return node
+
+    def _is_length_of(self, length_id, input_ta):
+        """Check that length_id is the length of the first dimension of the tensor unstacked to input_ta."""
+        length = self._skip_identity_and_enter(length_id)
+        if length is None:
+            return False
+        shape = self.g.get_shape(input_ta.data_input_id)
+        if length.is_const() and shape and shape[0] == length.get_tensor_value():
+            return True
+        tensor_array = self._skip_identity_and_enter(input_ta.tensor_array_id)
+        if length.type == "TensorArraySizeV3":
+            return self._skip_identity_and_enter(length.input[0]) == tensor_array
+        if length.type == "StridedSlice" and self._is_first_dim(length):
+            shape_node = self._skip_identity_and_enter(length.input[0])
+            data = self._skip_identity_and_enter(input_ta.data_input_id)
+            if shape_node is not None and shape_node.type == "Shape" and \
+                    self._skip_identity_and_enter(shape_node.input[0]) == data:
+                return True
+        # unstacking fails for tensor arrays of fixed size if the tensor doesn't have this length
+        if tensor_array is None or tensor_array.type != "TensorArrayV3":
+            return False
+        dynamic_size = tensor_array.get_attr("dynamic_size")
+        return not (dynamic_size and dynamic_size.i) and \
+            self._skip_identity_and_enter(tensor_array.input[0]) == length
+
+    @staticmethod
+    def _is_first_dim(strided_slice):
+        # shape[0]
+        for attr_name, value in [("begin_mask", 0), ("end_mask", 0), ("ellipsis_mask", 0), ("new_axis_mask", 0),
+                                 ("shrink_axis_mask", 1)]:
+            attr = strided_slice.get_attr(attr_name)
+            if (attr.i if attr else 0) != value:
+                return False
+        for node, value in zip(strided_slice.inputs[1:], [[0], [1], [1]]):
+            if node is None or not node.is_const() or node.get_tensor_value() != value:
+                return False
+        return True
+
     def _crop_loop_body_sub_graph(self, context):
         # according to input and output, find the body graph
         loop_props = context.loop_properties
@@ -275,7 +381,7 @@ class LoopRewriterBase(object):
 
         for enter_node in enter_nodes:
             # connect Enter's output to Enter's input
-            self.g.replace_all_inputs(ops, enter_node.output[0], enter_node.input[0])
+            self.g.replace_all_inputs(enter_node.output[0], enter_node.input[0], ops=ops)
 
         return GraphInfo(ops, inputs, outputs)
 
@@ -287,7 +393,7 @@ class LoopRewriterBase(object):
 
         for enter_node in enter_nodes:
             # connect Enter's output to Enter's input
-            self.g.replace_all_inputs(ops, enter_node.output[0], enter_node.input[0])
+            self.g.replace_all_inputs(enter_node.output[0], enter_node.input[0], ops=ops)
 
         dependent_vars = []
         for merge_node in merge_nodes:
@@ -296,12 +402,12 @@ class LoopRewriterBase(object):
 
             # cut off connection between condition graph and Merge node.
             non_switch_consumers = [n for n in self.g.find_output_consumers(merge_node.output[0]) if n.type != "Switch"]
-            self.g.replace_all_inputs(non_switch_consumers, merge_node.output[0],
-                                      loop_var.switch_true_identity_output.id)
+            self.g.replace_all_inputs(merge_node.output[0], loop_var.switch_true_identity_output.id,
+                                      ops=non_switch_consumers)
             dependent_vars.append(loop_var)
 
         # cut off connection between condition graph and LoopCond node.
-        self.g.replace_all_inputs([context.loop_cond], context.loop_cond.output[0], INVALID_INPUT_ID)
+        self.g.replace_all_inputs(context.loop_cond.output[0], INVALID_INPUT_ID, ops=[context.loop_cond])
 
         graph_info = GraphInfo(ops, [], outputs)
         graph_info.dependent_vars = dependent_vars
@@ -317,11 +423,11 @@ class LoopRewriterBase(object):
             if val.is_tensor_array:
                 # connect NextIteration to an invalid node, to cut off an ending node of the cell.
                 ta_write_nodes = [n for n in self.g.get_nodes() if is_tensor_array_write_op(n)]
-                self.g.replace_all_inputs(ta_write_nodes, val.next_iteration_input.id, INVALID_INPUT_ID)
+                self.g.replace_all_inputs(val.next_iteration_input.id, INVALID_INPUT_ID, ops=ta_write_nodes)
             else:
                 # connect NextIteration to an invalid node, to cut off an ending node of the cell.
                 next_iter_nodes = [n for n in self.g.get_nodes() if n.type == "NextIteration"]
-                self.g.replace_all_inputs(next_iter_nodes, val.next_iteration_input.id, INVALID_INPUT_ID)
+                self.g.replace_all_inputs(val.next_iteration_input.id, INVALID_INPUT_ID, ops=next_iter_nodes)
 
         for scan_input in context.loop_properties.scan_inputs:
             # remove the node to cut off connection between scan_input and the cell.
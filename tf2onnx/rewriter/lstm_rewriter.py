@@ -302,8 +302,8 @@ class LSTMUnitRewriter(UnitRnnRewriterBase):
             const_node = self.g.make_const(initial_name, new_val)
             return const_node.output[0]
         squeeze_node = self.g.make_node("Unsqueeze", [initializer_input_id], attr={"axes": [0]})
-        to_replace = [n for n in self.g.get_nodes() if n != squeeze_node]
-        self.g.replace_all_inputs(to_replace, initializer_input_id, squeeze_node.output[0])
+        to_replace = [n for n in self.g.find_output_consumers(initializer_input_id) if n != squeeze_node]
+        self.g.replace_all_inputs(initializer_input_id, squeeze_node.output[0], ops=to_replace)
         return squeeze_node.output[0]
 
     def create_rnn_node(self, context):
@@ -343,7 +343,7 @@ class LSTMUnitRewriter(UnitRnnRewriterBase):
                                         shapes=[[lstm_yh_shape[1], lstm_yh_shape[2]]],
                                         dtypes=[self.g.get_dtype(output_id)])
 
-        self.g.replace_all_inputs(self.g.get_nodes(), exit_output.id, squeeze_node.output[0])
+        self.g.replace_all_inputs(exit_output.id, squeeze_node.output[0])
 
     def _connect_lstm_yc_to_graph(self, context):
         # in tf, y_c output shape is: [batch, hidden]
@@ -355,7 +355,7 @@ class LSTMUnitRewriter(UnitRnnRewriterBase):
                                         shapes=[[lstm_yc_shape[1], lstm_yc_shape[2]]],
                                         dtypes=[self.g.get_dtype(output_id)])
 
-        self.g.replace_all_inputs(self.g.get_nodes(), exit_output.id, squeeze_node.output[0])
+        self.g.replace_all_inputs(exit_output.id, squeeze_node.output[0])
 
     def _connect_lstm_ych_to_graph(self, context):
         # in tf, concat of y_c and y_h output shape is: [batch, hidden *2]
@@ -373,4 +373,4 @@ class LSTMUnitRewriter(UnitRnnRewriterBase):
                                         shapes=[squeeze_output_shape],
                                         dtypes=[self.g.get_dtype(concat.output[0])])
 
-        self.g.replace_all_inputs(self.g.get_nodes(), exit_output.id, squeeze_node.output[0])
+        self.g.replace_all_inputs(exit_output.id, squeeze_node.output[0])
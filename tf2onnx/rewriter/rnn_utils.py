@@ -188,6 +188,33 @@ def get_pattern(cell_type_name):
     return rnn_cell_patterns[cell_type_name]
 
 
+def get_unrolled_pattern(cell_type_name):
+    """Pattern of the cell called outside of a while loop, like by static_rnn: weights are read without Enter
+    and the state is the tensor passed to the cell instead of the Identity after the loop's Switch.
+    """
+    return _strip_loop_ops(rnn_cell_patterns[cell_type_name], {})
+
+
+def _strip_loop_ops(pattern, stripped):
+    # patterns shared by several inputs stay shared
+    if id(pattern) in stripped:
+        return stripped[id(pattern)]
+    if pattern.op_type == "Enter":
+        res = _strip_loop_ops(pattern.inputs[0], stripped)
+    elif pattern.op_type == "Identity":
+        res = OpTypePattern("*", name=pattern.name)
+    else:
+        inputs = [_strip_loop_ops(p, stripped) for p in pattern.inputs]
+        # tensorflow passes weights as the last input, the graph matcher assigns the inputs that don't
+        # match by op type in order
+        enter_inputs = [p.op_type == "Enter" for p in pattern.inputs]
+        inputs = [p for p, enter in zip(inputs, enter_inputs) if not enter] + \
+                 [p for p, enter in zip(inputs, enter_inputs) if enter]
+        res = OpTypePattern(pattern.op_type, name=pattern.name, inputs=inputs)
+    stripped[id(pattern)] = res
+    return res
+
+
 def get_rnn_scope_name(while_scope_name):
     parts = while_scope_name.split('/')
     rnn_scope = '/'.join(parts[0:-2]) + "/"
@@ -0,0 +1,278 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT license.
+
+"""
+tf2onnx.rewriter.unrolled_rnn_rewriter - rewrite statically unrolled lstm/gru cells to onnx LSTM/GRU
+"""
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import logging
+import numpy as np
+from tf2onnx import utils
+from tf2onnx.graph_matcher import GraphMatcher
+from tf2onnx.rewriter.gru_rewriter import GRUUnitRewriter
+from tf2onnx.rewriter.lstm_rewriter import LSTMUnitRewriter
+from tf2onnx.rewriter.rnn_utils import RNNUnitType, get_unrolled_pattern
+from tf2onnx.rewriter.unit_rnn_rewriter_base import UnitRnnContext
+
+# pylint: disable=invalid-name,unused-argument,missing-docstring
+
+logging.basicConfig(level=logging.INFO)
+log = logging.getLogger("tf2onnx.rewriter.unrolled_rnn_rewriter")
+
+
+class UnrolledCell(object):
+    """One time step of a cell called outside of a while loop."""
+
+    def __init__(self, match, xh, state_consumers, state_outputs, weights_key):
+        self.match = match
+        # concat of the input of the step and the hidden state
+        self.xh = xh
+        # (node, input index) reading each state variable, the hidden state first
+        self.state_consumers = state_consumers
+        self.state_outputs = state_outputs
+        self.weights_key = weights_key
+        self.nodes = set(match.get_nodes())
+
+    # inputs are read from the nodes since rewriting another rnn may have replaced them
+
+    @property
+    def x(self):
+        return self.xh.input[0]
+
+    @property
+    def state_inputs(self):
+        return [node.input[i] for node, i in self.state_consumers]
+
+    @property
+    def output(self):
+        return self.state_outputs[0]
+
+
+class UnrolledRnnRewriterBase(object):
+    """
+    tf.nn.static_rnn and python loops calling a cell repeat the cell subgraph for every time step.
+    main procedures:
+    1 match the cell patterns of the while loop rewriters without the loop ops
+    2 chain the cells sharing the same weights by their state variables
+    3 stack the inputs of the steps in time and build a single rnn node with the unit rnn rewriter
+    4 connect the outputs of the steps and the final state variables to the outputs of the rnn node
+    """
+    def __init__(self, g, unit_rewriter, cell_type):
+        self.g = g
+        self.unit_rewriter = unit_rewriter
+        self.cell_type = cell_type
+        # onnx input names of the initial values of the state variables
+        self.initial_state_names = []
+
+    def run(self, ops):
+        matcher = GraphMatcher(get_unrolled_pattern(self.cell_type), allow_reorder=True)
+        cells = [self.parse_cell(match) for match in matcher.match_ops(ops)]
+        for chain in self._find_chains([c for c in cells if c]):
+            if self._is_valid_chain(chain):
+                self._rewrite_chain(chain)
+        return self.g.get_nodes()
+
+    def parse_cell(self, match):
+        raise NotImplementedError()
+
+    def get_weight_and_bias(self, match):
+        context = UnitRnnContext()
+        context.cell_match = match
+        return self.unit_rewriter.get_weight_and_bias(context)
+
+    @staticmethod
+    def _is_concat_of_input_and_state(node):
+        if node.type != "ConcatV2" or len(node.input) != 3 or not node.inputs[2].is_const():
+            return False
+        return node.inputs[2].get_tensor_value() in [1, -1]
+
+    @staticmethod
+    def _find_chains(cells):
+        by_state_outputs = {tuple(c.state_outputs): c for c in cells}
+        followers = {}
+        for c in cells:
+            prev = by_state_outputs.get(tuple(c.state_inputs))
+            if prev is not None and prev.weights_key == c.weights_key:
+                followers.setdefault(prev, []).append(c)
+        # a state consumed by two cells with the same weights doesn't form one sequence
+        next_cell = {prev: f[0] for prev, f in followers.items() if len(f) == 1}
+        has_prev = set(next_cell.values())
+
+        chains = []
+        for c in cells:
+            if c in has_prev:
+                continue
+            chain = [c]
+            while chain[-1] in next_cell:
+                chain.append(next_cell[chain[-1]])
+            if len(chain) > 1:
+                chains.append(chain)
+        return chains
+
+    def _is_valid_chain(self, chain):
+        chain_nodes = set().union(*[c.nodes for c in chain])
+        for c in chain:
+            if any(name in self.g.outputs for name in c.state_outputs):
+                return False
+        # rnn nodes only output the hidden state of the steps, other state variables must stay inside the chain
+        for c in chain[:-1]:
+            for name in c.state_outputs[1:]:
+                if any(n not in chain_nodes for n in self.g.find_output_consumers(name)):
+                    log.debug("state %s is consumed outside of the unrolled rnn, skip", name)
+                    return False
+        return True
+
+    def _rewrite_chain(self, chain):
+        log.debug("rewrite %d unrolled steps ending with %s", len(chain), chain[-1].output)
+        context = UnitRnnContext()
+        context.cell_match = chain[0].match
+        context.weights = self.get_weight_and_bias(chain[0].match)
+        if not context.weights or not self.unit_rewriter.parse_attributes(context):
+            return
+        self.unit_rewriter.process_weights_and_bias(context)
+
+        context.onnx_input_ids["X"] = self._stack_inputs([c.x for c in chain])
+        # all sequences have the full length
+        context.onnx_input_ids["sequence_lens"] = ""
+        for name, state in zip(self.initial_state_names, chain[0].state_inputs):
+            context.onnx_input_ids[name] = self._make_initial_state(state)
+        rnn_node = self.unit_rewriter.create_rnn_node(context)
+
+        chain_nodes = set().union(*[c.nodes for c in chain])
+        self._connect_outputs(chain, rnn_node, chain_nodes)
+        for i, name in enumerate(chain[-1].state_outputs):
+            consumers = [n for n in self.g.find_output_consumers(name) if n not in chain_nodes]
+            if consumers:
+                state = self._squeeze(rnn_node.output[i + 1], 0)
+                self.g.replace_all_inputs(name, state, ops=consumers)
+
+    def _stack_inputs(self, inputs):
+        """Stack the inputs of the steps to a time major tensor, reuses the tensor unstacked by tf.unstack."""
+        shape = self.g.get_shape(inputs[0]) or [-1, -1]
+        x_shape = [len(inputs)] + shape
+        dtype = self.g.get_dtype(inputs[0])
+        unstack = self.g.get_node_by_output(inputs[0])
+        if unstack is not None and unstack.type == "Unpack" and unstack.output == inputs:
+            axis = unstack.get_attr("axis")
+            axis = axis.i if axis else 0
+            if axis < 0:
+                axis += len(x_shape)
+            if axis == 0 and self.g.get_shape(unstack.input[0]) is not None:
+                return unstack.input[0]
+            if axis == 1:
+                transpose = self.g.make_node("Transpose", [unstack.input[0]], attr={"perm": [1, 0, 2]},
+                                             shapes=[x_shape], dtypes=[dtype])
+                return transpose.output[0]
+        steps = [self.g.make_node("Unsqueeze", [name], attr={"axes": [0]}, shapes=[[1] + shape],
+                                  dtypes=[dtype]).output[0] for name in inputs]
+        concat = self.g.make_node("Concat", steps, attr={"axis": 0}, shapes=[x_shape], dtypes=[dtype])
+        return concat.output[0]
+
+    def _make_initial_state(self, name):
+        # in tf, state shape is: [batch, hidden], in onnx: [num_directions, batch, hidden]
+        node = self.g.get_node_by_output(name)
+        if node.is_const():
+            val = node.get_tensor_value(as_list=False)
+            return self.g.make_const(utils.make_name("Const"), np.expand_dims(val, axis=0)).output[0]
+        shape = self.g.get_shape(name)
+        unsqueeze = self.g.make_node("Unsqueeze", [name], attr={"axes": [0]},
+                                     shapes=[[1] + shape if shape else None], dtypes=[self.g.get_dtype(name)])
+        return unsqueeze.output[0]
+
+    def _squeeze(self, name, axis):
+        shape = self.g.get_shape(name)
+        if shape:
+            shape = shape[:axis] + shape[axis + 1:]
+        squeeze = self.g.make_node("Squeeze", [name], attr={"axes": [axis]}, shapes=[shape],
+                                   dtypes=[self.g.get_dtype(name)])
+        return squeeze.output[0]
+
+    def _connect_outputs(self, chain, rnn_node, chain_nodes):
+        """Feed the consumers of the hidden state of every step but the last from Y of the rnn node."""
+        # in onnx, Y shape is: [time, num_directions, batch, hidden]
+        outputs = [c.output for c in chain]
+        y = None
+        for t, name in enumerate(outputs[:-1]):
+            consumers = [n for n in self.g.find_output_consumers(name) if n not in chain_nodes]
+            if not consumers:
+                continue
+            if y is None:
+                y = self._squeeze(rnn_node.output[0], 1)
+            stacks = [n for n in consumers if n.type == "Pack" and n.input == outputs]
+            for stack in stacks:
+                # the outputs of static_rnn are stacked again by tf.stack in most models
+                axis = stack.get_attr("axis")
+                axis = axis.i if axis else 0
+                if axis < 0:
+                    axis += 3
+                if axis not in [0, 1]:
+                    continue
+                consumers.remove(stack)
+                stacked = y
+                if axis == 1:
+                    stacked = self.g.make_node("Transpose", [y], attr={"perm": [1, 0, 2]},
+                                               shapes=[self.g.get_shape(stack.output[0])],
+                                               dtypes=[self.g.get_dtype(y)]).output[0]
+                self.g.replace_all_inputs(stack.output[0], stacked)
+            if consumers:
+                index = self.g.make_const(utils.make_name("time_step"), np.array(t, dtype=np.int64))
+                gather = self.g.make_node("Gather", [y, index.output[0]], attr={"axis": 0},
+                                          shapes=[self.g.get_shape(name)], dtypes=[self.g.get_dtype(name)])
+                self.g.replace_all_inputs(name, gather.output[0], ops=consumers)
+
+
+class UnrolledLSTMRewriter(UnrolledRnnRewriterBase):
+    def __init__(self, g):
+        unit_rewriter = LSTMUnitRewriter(g)
+        unit_rewriter.lstm_cell_type = RNNUnitType.LSTMCell
+        super(UnrolledLSTMRewriter, self).__init__(g, unit_rewriter, RNNUnitType.LSTMCell)
+        self.initial_state_names = ["initial_h", "initial_c"]
+
+    def parse_cell(self, match):
+        xh = match.get_op("xh")
+        ft = match.get_op("ft")
+        ct_identity_consumer = match.get_op("ct_identity_consumer")
+        if not self._is_concat_of_input_and_state(xh):
+            return None
+        c_index = 1 if ct_identity_consumer.input[0] == ft.output[0] else 0
+        weights = self.get_weight_and_bias(match)
+        if not weights:
+            return None
+        weights_key = (weights["weight"].node.name, weights["bias"].node.name, float(weights["ft_bias"].value))
+        return UnrolledCell(match, xh, [(xh, 1), (ct_identity_consumer, c_index)],
+                            [match.get_op("ht").output[0], match.get_op("ct").output[0]], weights_key)
+
+
+class UnrolledGRURewriter(UnrolledRnnRewriterBase):
+    def __init__(self, g):
+        unit_rewriter = GRUUnitRewriter(g)
+        unit_rewriter.gru_cell_type = RNNUnitType.GRUCell
+        super(UnrolledGRURewriter, self).__init__(g, unit_rewriter, RNNUnitType.GRUCell)
+        self.initial_state_names = ["initial_state"]
+
+    def parse_cell(self, match):
+        cell_inputs = match.get_op("cell_inputs")
+        cell_output = match.get_op("cell_output")
+        if not self._is_concat_of_input_and_state(cell_inputs):
+            return None
+        # the new state mixes the previous state and the candidate: u * state + (1 - u) * c
+        state = cell_inputs.input[1]
+        if not any(n.type == "Mul" and state in n.input for n in cell_output.inputs):
+            return None
+        weights = self.get_weight_and_bias(match)
+        if not weights:
+            return None
+        weights_key = tuple(weights[k].node.name for k in sorted(weights))
+        return UnrolledCell(match, cell_inputs, [(cell_inputs, 1)], [cell_output.output[0]], weights_key)
+
+
+def rewrite_unrolled_lstm(g, ops):
+    return UnrolledLSTMRewriter(g).run(ops)
+
+
+def rewrite_unrolled_gru(g, ops):
+    return UnrolledGRURewriter(g).run(ops)
@@ -9,7 +9,6 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
-from collections import defaultdict, OrderedDict
 from onnx import defs
 
 from . import constants
@@ -18,18 +17,22 @@ from . import constants
 class OnnxOpSchema(object):
     """Wrapper for Onnx schema."""
 
-    def __init__(self, name, domain, since_version, attributes):
+    def __init__(self, name, domain, since_version, attributes, input_types=None, output_types=None):
         """Create a Onnx schema
         Args:
             name (str): op name
             attributes (List[str]): valid attributes
             domain (str): default value "" means it's Onnx domain
             since_version (int): opset version, default is 1
+            input_types (List[Set[str]]): allowed types of each formal input, like "tensor(float)"
+            output_types (List[Set[str]]): allowed types of each formal output
         """
         self._name = name
         self._domain = domain
         self._attributes = attributes
         self._since_version = since_version
+        self._input_types = input_types or []
+        self._output_types = output_types or []
 
     @property
     def attributes(self):
@@ -53,62 +56,69 @@ class OnnxOpSchema(object):
         domain = onnx_schema.domain
         since_version = int(onnx_schema.since_version)
         attributes = onnx_schema.attributes
-        return OnnxOpSchema(name, domain, since_version, attributes)
+        constraints = {c.type_param_str: set(c.allowed_type_strs) for c in onnx_schema.type_constraints}
+        input_types = [constraints.get(_type_str(i), {_type_str(i)}) for i in onnx_schema.inputs]
+        output_types = [constraints.get(_type_str(o), {_type_str(o)}) for o in onnx_schema.outputs]
+        return OnnxOpSchema(name, domain, since_version, attributes, input_types, output_types)
 
     def has_attribute(self, attr):
         return attr in self.attributes
 
+    def input_types(self, index):
+        """Allowed types of input index, the last formal input is variadic."""
+        if not self._input_types:
+            return set()
+        return self._input_types[min(index, len(self._input_types) - 1)]
 
-def _register_all_schemas_with_history():
-    """Register all schemas with history"""
-    onnx_schemas = defs.get_all_schemas_with_history()
-    name_domain_version_schema_map = defaultdict(lambda: defaultdict(dict))
-    for s in onnx_schemas:
-        schema = OnnxOpSchema.from_onnx_schema(s)
-        name_domain_version_schema_map[schema.name][schema.domain][schema.since_version] = schema
+    def output_types(self, index):
+        """Allowed types of output index, the last formal output is variadic."""
+        if not self._output_types:
+            return set()
+        return self._output_types[min(index, len(self._output_types) - 1)]
 
-    ordered_map = defaultdict(lambda: defaultdict(OrderedDict))
-    for name, domain_version_schema_map in name_domain_version_schema_map.items():
-        for domain, version_schema_map in domain_version_schema_map.items():
-            ordered_map[name][domain] = OrderedDict(
-                sorted(version_schema_map.items(), key=lambda x: -x[0])
-            )
-    return ordered_map
 
+def _type_str(formal_parameter):
+    # typeStr is renamed to type_str in newer onnx versions
+    return getattr(formal_parameter, "type_str", None) or formal_parameter.typeStr
 
-def _parse_domain_opset_versions(schemas):
+
+def _parse_domain_opset_versions():
     """ Get max opset version among all schemas within each domain. """
     domain_opset_versions = dict()
-    for domain_version_schema_map in schemas.values():
-        for domain, version_schema_map in domain_version_schema_map.items():
-            # version_schema_map is sorted by since_version in descend order
-            max_version = next(iter(version_schema_map))
-            if domain not in domain_opset_versions:
-                domain_opset_versions[domain] = int(max_version)
-            else:
-                domain_opset_versions[domain] = max(domain_opset_versions[domain], int(max_version))
+    # the latest schema of each op has the highest since_version of the op
+    for s in defs.get_all_schemas():
+        version = int(s.since_version)
+        domain_opset_versions[s.domain] = max(domain_opset_versions.get(s.domain, version), version)
     return domain_opset_versions
 
 
-# format is <OpName, <Domain, <SinceVersion, OpSchema>>>
-# SinceVersion is sorted from high to low
-_schemas = _register_all_schemas_with_history()
+# schemas are looked up on first use, building the whole history of all ops takes long
+# format is <(OpName, Domain, MaxInclusiveVersion), OpSchema or None>
+_schemas = {}
 
-_domain_opset_versions = _parse_domain_opset_versions(_schemas)
+_domain_opset_versions = None
 
 
 def get_schema(name, max_inclusive_opset_version, domain=None):
     """Get schema by name within specific version."""
     domain = domain or constants.ONNX_DOMAIN
-    domain_version_schema_map = _schemas[name]
-    version_schema_map = domain_version_schema_map[domain]
-    for version, schema in version_schema_map.items():
-        if version <= max_inclusive_opset_version:
-            return schema
-    return None
+    key = (name, domain, max_inclusive_opset_version)
+    if key not in _schemas:
+        schema = None
+        if defs.has(name, domain):
+            try:
+                schema = OnnxOpSchema.from_onnx_schema(defs.get_schema(name, max_inclusive_opset_version, domain))
+            except defs.SchemaError:
+                # raised if the op has no version up to max_inclusive_opset_version
+                pass
+        _schemas[key] = schema
+    return _schemas[key]
 
 
 def get_max_supported_opset_version(domain=None):
     """Get max supported opset version by current onnx package given a domain."""
+    global _domain_opset_versions
     domain = domain or constants.ONNX_DOMAIN
+    if _domain_opset_versions is None:
+        _domain_opset_versions = _parse_domain_opset_versions()
     return _domain_opset_versions.get(domain, None)
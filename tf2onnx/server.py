@@ -0,0 +1,337 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT license.
+
+"""
+python -m tf2onnx.server : conversion daemon with a pool of warm worker processes
+
+The worker processes import tensorflow, the handlers and the onnx schemas once, so a conversion
+only pays for the conversion itself. Jobs are sent as json to POST /convert, over localhost http
+(--port) or over a unix socket (--unix-socket):
+
+    {
+      "args": ["--inputs", "X:0", "--outputs", "output:0", "--opset", "10"],
+      "graphdef": "<base64 encoded GraphDef>"
+    }
+
+args are the options of python -m tf2onnx.convert. Instead of graphdef the model can be given by path
+with --graphdef, --checkpoint or --saved-model in args. The response is
+
+    {"status": "OK", "model": "<base64 encoded onnx model>", "time": 1.2, "timings": {...}}
+
+or {"status": "FAIL", "error": "..."}. timings is the profiler report of the conversion phases. A job whose
+worker process dies fails with status CRASH, one running longer than --timeout fails with status TIMEOUT
+and its worker process is killed.
+GET /status returns the number of workers and of the jobs done so far.
+"""
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import argparse
+import base64
+import http.client
+import itertools
+import json
+import logging
+import multiprocessing
+import os
+import socket
+import socketserver
+import tempfile
+import threading
+import time
+import traceback
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from tf2onnx import utils
+
+# pylint: disable=broad-except,missing-docstring,invalid-name
+
+logging.basicConfig(level=logging.INFO)
+log = logging.getLogger("tf2onnx.server")
+
+DEFAULT_PORT = 8765
+# seconds between checks of a running job
+_POLL_INTERVAL = 1
+
+
+def get_args(argv=None):
+    """Parse commandline."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="localhost port to listen on")
+    parser.add_argument("--unix-socket", help="listen on this unix socket instead of localhost http")
+    parser.add_argument("--workers", type=int, default=multiprocessing.cpu_count(), help="number of worker processes")
+    parser.add_argument("--max-tasks-per-worker", type=int, default=None,
+                        help="restart a worker process after converting this many models")
+    parser.add_argument("--timeout", type=float, default=None,
+                        help="seconds a single conversion may take from its start in a worker, default is no limit")
+    return parser.parse_args(argv)
+
+
+def _init_worker():
+    """Pay the import cost of tensorflow, the handlers and the onnx schemas once per worker process."""
+    os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
+    import tensorflow as tf  # pylint: disable=import-outside-toplevel,unused-import
+    import tf2onnx.convert  # pylint: disable=import-outside-toplevel,unused-import
+    import tf2onnx.tfonnx  # pylint: disable=import-outside-toplevel,unused-import
+
+
+def _parse_job(job):
+    """Validate a job and return the commandline of tf2onnx.convert for it, raises ValueError."""
+    from tf2onnx import convert  # pylint: disable=import-outside-toplevel
+
+    if not isinstance(job, dict):
+        raise ValueError("job must be a json object")
+    argv = job.get("args") or []
+    if not isinstance(argv, list) or not all(isinstance(a, str) for a in argv):
+        raise ValueError("args must be a list of strings")
+    if job.get("graphdef") is not None:
+        # the real path is filled in by the worker
+        argv = argv + ["--graphdef", "-"]
+    try:
+        convert.get_args(argv)
+    except SystemExit:
+        raise ValueError("invalid args {}".format(argv))
+    return argv
+
+
+def convert_job(argv, graphdef=None, job_id=None, started=None):
+    """Run a conversion in a worker process.
+    Args:
+        argv: commandline of tf2onnx.convert, --output and --profile are ignored
+        graphdef: serialized GraphDef, used for --graphdef -
+        job_id: key of the job in started
+        started: optional dict shared with the server process, gets job_id -> (pid, start time) of the conversion
+    Return:
+        dict with the serialized onnx model and the profiler report
+    """
+    from tf2onnx import convert  # pylint: disable=import-outside-toplevel
+    from tf2onnx.profiler import Profiler  # pylint: disable=import-outside-toplevel
+
+    if started is not None:
+        started[job_id] = (os.getpid(), time.time())
+    tmp_path = None
+    try:
+        if graphdef is not None:
+            fd, tmp_path = tempfile.mkstemp(suffix=".pb")
+            with os.fdopen(fd, "wb") as f:
+                f.write(graphdef)
+            argv = [tmp_path if a == "-" and i > 0 and argv[i - 1] == "--graphdef" else a for i, a in enumerate(argv)]
+        args = convert.get_args(argv)
+        profiler = Profiler(enabled=True, trace_memory=False)
+        model_proto = convert.run_conversion(args, profiler)
+        return {"model": model_proto.SerializeToString(), "timings": profiler.report()}
+    finally:
+        if tmp_path:
+            os.remove(tmp_path)
+
+
+class ConversionServer(object):
+    """Accept conversion jobs and run them on a pool of warm worker processes."""
+
+    def __init__(self, workers=None, max_tasks_per_worker=None, timeout=None):
+        self.workers = workers or multiprocessing.cpu_count()
+        self.timeout = timeout
+        self.jobs_done = 0
+        self.jobs_failed = 0
+        self._lock = threading.Lock()
+        self._job_ids = itertools.count()
+        # pid and start time of the running jobs, to tell crashed and hanging workers
+        self._manager = multiprocessing.Manager()
+        self._started = self._manager.dict()
+        self._pool = multiprocessing.Pool(self.workers, initializer=_init_worker,
+                                          maxtasksperchild=max_tasks_per_worker)
+        self._httpd = None
+
+    def convert(self, job):
+        """Run job, return (http status, response dict)."""
+        start = time.time()
+        try:
+            argv = _parse_job(job)
+            graphdef = base64.b64decode(job["graphdef"]) if job.get("graphdef") is not None else None
+        except Exception as ex:
+            return 400, {"status": "FAIL", "error": str(ex)}
+
+        with self._lock:
+            job_id = next(self._job_ids)
+        try:
+            async_result = self._pool.apply_async(convert_job, (argv, graphdef, job_id, self._started))
+            while not utils.poll_worker(async_result, self._started, job_id, self.timeout, _POLL_INTERVAL):
+                async_result.wait(_POLL_INTERVAL)
+            result = async_result.get()
+            response = {
+                "status": "OK",
+                "model": base64.b64encode(result["model"]).decode("ascii"),
+                "time": time.time() - start,
+                "timings": result["timings"],
+            }
+            status = 200
+        except utils.WorkerFailure as ex:
+            response = {"status": ex.status, "error": str(ex)}
+            status = 504 if ex.status == "TIMEOUT" else 500
+        except Exception as ex:
+            response = {"status": "FAIL", "error": "{}\n{}".format(ex, traceback.format_exc())}
+            status = 500
+        finally:
+            self._started.pop(job_id, None)
+
+        with self._lock:
+            self.jobs_done += 1
+            if status != 200:
+                self.jobs_failed += 1
+        log.info("job done in %.2fs: %s", time.time() - start, response["status"])
+        return status, response
+
+    def status(self):
+        with self._lock:
+            return {"workers": self.workers, "jobs_done": self.jobs_done, "jobs_failed": self.jobs_failed}
+
+    def serve(self, port=DEFAULT_PORT, unix_socket=None, ready=None):
+        """Serve requests until shutdown() is called.
+        Args:
+            port: localhost port, 0 picks a free one
+            unix_socket: path of a unix socket to listen on instead of the port
+            ready: optional threading.Event set once the server accepts requests
+        """
+        handler = _make_request_handler(self)
+        if unix_socket:
+            if os.path.exists(unix_socket):
+                os.remove(unix_socket)
+            self._httpd = _ThreadingUnixHTTPServer(unix_socket, handler)
+            log.info("listening on unix socket %s", unix_socket)
+        else:
+            self._httpd = _ThreadingHTTPServer(("127.0.0.1", port), handler)
+            log.info("listening on http://127.0.0.1:%d", self._httpd.server_address[1])
+        if ready is not None:
+            ready.set()
+        try:
+            self._httpd.serve_forever()
+        finally:
+            self._httpd.server_close()
+            if unix_socket and os.path.exists(unix_socket):
+                os.remove(unix_socket)
+
+    @property
+    def address(self):
+        """Address the server listens on, (host, port) or the unix socket path."""
+        return self._httpd.server_address if self._httpd else None
+
+    def shutdown(self):
+        if self._httpd:
+            self._httpd.shutdown()
+        self._pool.terminate()
+        self._pool.join()
+        self._manager.shutdown()
+
+
+class _ThreadingHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class _ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def _make_request_handler(server):
+    class _RequestHandler(BaseHTTPRequestHandler):
+
+        def do_GET(self):
+            if self.path != "/status":
+                self._send(404, {"status": "FAIL", "error": "unknown path " + self.path})
+                return
+            self._send(200, server.status())
+
+        def do_POST(self):
+            if self.path != "/convert":
+                self._send(404, {"status": "FAIL", "error": "unknown path " + self.path})
+                return
+            try:
+                length = int(self.headers.get("Content-Length", 0))
+                job = json.loads(self.rfile.read(length).decode("utf-8"))
+            except ValueError as ex:
+                self._send(400, {"status": "FAIL", "error": "invalid json: {}".format(ex)})
+                return
+            self._send(*server.convert(job))
+
+        def _send(self, status, response):
+            body = json.dumps(response).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def address_string(self):
+            # client address of unix sockets is empty
+            return self.client_address[0] if self.client_address else "unix"
+
+        def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+            log.debug("%s - %s", self.address_string(), format % args)
+
+    return _RequestHandler
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path, timeout=None):
+        super(_UnixHTTPConnection, self).__init__("localhost", timeout=timeout)
+        self._path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if self.timeout is not None:
+            self.sock.settimeout(self.timeout)
+        self.sock.connect(self._path)
+
+
+def request(path, job=None, port=DEFAULT_PORT, unix_socket=None, timeout=None):
+    """Send a request to a running server, GET if job is None else POST.
+    Return:
+        http status and the decoded json response
+    """
+    if unix_socket:
+        conn = _UnixHTTPConnection(unix_socket, timeout=timeout)
+    else:
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=timeout)
+    try:
+        if job is None:
+            conn.request("GET", path)
+        else:
+            conn.request("POST", path, body=json.dumps(job).encode("utf-8"),
+                         headers={"Content-Type": "application/json"})
+        response = conn.getresponse()
+        return response.status, json.loads(response.read().decode("utf-8"))
+    finally:
+        conn.close()
+
+
+def convert_remote(graphdef=None, args=None, port=DEFAULT_PORT, unix_socket=None, timeout=None):
+    """Convert with a running server.
+    Args:
+        graphdef: serialized GraphDef, or None if the model is given in args
+        args: commandline options of tf2onnx.convert
+    Return:
+        serialized onnx model and the timings of the conversion phases, raises RuntimeError on failure
+    """
+    job = {"args": args or []}
+    if graphdef is not None:
+        job["graphdef"] = base64.b64encode(graphdef).decode("ascii")
+    status, response = request("/convert", job, port=port, unix_socket=unix_socket, timeout=timeout)
+    if status != 200:
+        raise RuntimeError("conversion failed with status {}: {}".format(status, response.get("error")))
+    return base64.b64decode(response["model"]), response["timings"]
+
+
+def main(argv=None):
+    args = get_args(argv)
+    server = ConversionServer(args.workers, args.max_tasks_per_worker, args.timeout)
+    try:
+        server.serve(args.port, args.unix_socket)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -8,6 +8,7 @@ tf2onnx.shape_inference - shape inference function for tf2onnx
 from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
+import collections
 import logging
 from onnx import onnx_pb
 from tf2onnx import utils
@@ -45,13 +46,53 @@ broadcast_ops = [
 
 
 def infer_shape_for_graph(g):
-    no_shape_updated = True
-    while no_shape_updated:
-        no_shape_updated = False
-        for o in g.get_nodes():
-            updated = infer_shape_for_node(g, o)
-            if updated:
-                no_shape_updated = True
+    """Infer shapes with a worklist seeded once with all nodes.
+    A node is visited again only if the shape of one of its inputs or outputs changed, or the shape of
+    a tensor it reads through a TensorArray (see _indirect_consumers).
+    """
+    queue = collections.deque(g.get_nodes())
+    queued = set(n.name for n in queue)
+    while queue:
+        node = queue.popleft()
+        queued.discard(node.name)
+        tensors = [t for t in node.input + node.output if t]
+        shapes_before = [g.get_shape(t) for t in tensors]
+        infer_shape_for_node(g, node)
+        changed = [t for t, before in zip(tensors, shapes_before) if g.get_shape(t) != before]
+        if not changed:
+            continue
+
+        # the node itself may infer more now, as well as producers and consumers of the changed tensors
+        to_visit = [node]
+        for t in changed:
+            producer = g.get_node_by_output_in_current_graph(t)
+            if producer:
+                to_visit.append(producer)
+            for n in g.find_output_consumers(t):
+                if n.graph is g:
+                    to_visit.append(n)
+                    to_visit.extend(_indirect_consumers(g, n))
+        for n in to_visit:
+            if n.name not in queued:
+                queued.add(n.name)
+                queue.append(n)
+
+
+def _indirect_consumers(g, node):
+    """Nodes whose shape inference reads inputs of node without consuming any output of node."""
+    if node.type == "TensorArrayWriteV3":
+        # TensorArrayGatherV3 takes the shape of the written value, see _find_tensorarray_write
+        enter_node = node.inputs[0]
+        if enter_node and enter_node.type == "Enter":
+            handle_node = enter_node.inputs[0]
+            if handle_node and handle_node.type == "TensorArrayV3":
+                return [n for n in g.find_output_consumers(handle_node.output[0])
+                        if n.type == "TensorArrayGatherV3"]
+    elif node.type == "TensorArrayScatterV3":
+        # TensorArrayReadV3 takes the shape of the scattered value
+        return [n for enter_node in g.find_output_consumers(node.output[0]) if enter_node.type == "Enter"
+                for n in g.find_output_consumers(enter_node.output[0]) if n.type == "TensorArrayReadV3"]
+    return []
 
 
 def infer_shape_for_node(g, node):
@@ -13,6 +13,7 @@ import collections
 import logging
 import sys
 import traceback
+from concurrent.futures import ThreadPoolExecutor
 
 import numpy as np
 from onnx import helper, onnx_pb
@@ -24,8 +25,11 @@ import tf2onnx
 import tf2onnx.onnx_opset # pylint: disable=unused-import
 import tf2onnx.custom_opsets # pylint: disable=unused-import
 from tf2onnx import constants, schemas, utils, handler
+from tf2onnx.cache import process_tf_graph_cached
+from tf2onnx.context import ConversionContext, activate_context
 from tf2onnx.graph import Graph
 from tf2onnx.graph_matcher import OpTypePattern, GraphMatcher
+from tf2onnx.profiler import Profiler
 from tf2onnx.rewriter import *  # pylint: disable=wildcard-import
 from tf2onnx.shape_inference import infer_shape_for_graph
 from tf2onnx.utils import port_name
@@ -121,11 +125,18 @@ def tflist_to_onnx(node_list, shape_override):
     return onnx_nodes, op_cnt, attr_cnt, output_shapes, dtypes
 
 
-def tensorflow_to_onnx(graph, shape_override):
+def tensorflow_to_onnx(graph, shape_override, profiler=None):
     """
     Load tensorflow graph and do a conversion.
     """
-    return tflist_to_onnx(graph.get_operations(), shape_override)
+    if profiler is None:
+        profiler = Profiler(enabled=False)
+    tf_ops = graph.get_operations()
+    with profiler.phase("tflist_to_onnx") as record:
+        ret = tflist_to_onnx(tf_ops, shape_override)
+        record["nodes_before"] = len(tf_ops)
+        record["nodes_after"] = len(ret[0])
+    return ret
 
 
 def rewrite_transpose(g, ops):
@@ -179,7 +190,7 @@ def rewrite_random_normal(g, ops):
             new_node = g.make_node("RandomNormal", [], outputs=[out_name], name=op_name,
                                    attr={"shape": shape, "mean": mean, "scale": 1.0, "dtype": dtype})
 
-        g.replace_all_inputs(ops, output.output[0], new_node.output[0])
+        g.replace_all_inputs(output.output[0], new_node.output[0])
         for n in set(match.get_nodes()):
             g.remove_node(n.name)
     return ops
@@ -212,7 +223,7 @@ def rewrite_dropout(g, ops):
             shapes=[g.get_shape(inputs2.input[0])],
             dtypes=[g.get_dtype(inputs2.input[0])]
         )
-        g.replace_all_inputs(ops, outputs.output[0], new_node.output[0])
+        g.replace_all_inputs(outputs.output[0], new_node.output[0])
         for n in set(match.get_nodes()):
             g.remove_node(n.name)
 
@@ -292,7 +303,7 @@ def rewrite_flatten(g, ops):
                 new_dim = -1
 
             g.set_shape(out_name, input_shape[:-2] + [new_dim])
-            g.replace_all_inputs(ops, reshape_node.output[0], out_name)
+            g.replace_all_inputs(reshape_node.output[0], out_name)
 
             for n in set(match.get_nodes()):
                 if n != input_node:
@@ -520,7 +531,9 @@ def rewrite_conv2d_with_pad(g, ops):
     return ops
 
 
-def tensorflow_onnx_mapping(g, continue_on_error, ops_mapping):
+def tensorflow_onnx_mapping(g, continue_on_error, ops_mapping, profiler=None):
+    if profiler is None:
+        profiler = Profiler(enabled=False)
     mapped_op = collections.Counter()
     unmapped_op = collections.Counter()
 
@@ -554,12 +567,13 @@ def tensorflow_onnx_mapping(g, continue_on_error, ops_mapping):
                     # we assume only ONNX nodes have subgraph defined in pre-rewriters.
                     # that means, if we create node having subgraphs in this step, the
                     # created subgraphs' nodes won't be mapped.
-                    m_ops, unm_ops = tensorflow_onnx_mapping(b_g, continue_on_error, ops_mapping)
+                    m_ops, unm_ops = tensorflow_onnx_mapping(b_g, continue_on_error, ops_mapping, profiler)
                     mapped_op += m_ops
                     unmapped_op += unm_ops
                     log.debug("finish handling subgraph of %s's attribute %s", node.name, attr)
 
-            func(g, node, **kwargs)
+            with profiler.phase(op, lambda: len(g.get_nodes()), category="handler"):
+                func(g, node, **kwargs)
             node.skip_conversion = True
         except Exception as ex:
             type_, value_, traceback_ = sys.exc_info()
@@ -628,15 +642,18 @@ def topological_sort(g, continue_on_error):
             pass
 
 
-def run_rewriters(g, funcs, continue_on_error):
+def run_rewriters(g, funcs, continue_on_error, profiler=None):
     """Rewrite the original graph and body graphs of nodes"""
     # NOTE(wayuanho):
     # 1. we don't sort graph here, rewriter is expected to do it on its own.
     # 2. the graph here may have circles, current topological_sort cannot handle it.
+    if profiler is None:
+        profiler = Profiler(enabled=False)
     for func in funcs:
         try:
-            ops = func(g, g.get_nodes())
-            g.reset_nodes(ops)
+            with profiler.phase(func.__name__, lambda: len(g.get_nodes()), category="rewriter"):
+                ops = func(g, g.get_nodes())
+                g.reset_nodes(ops)
         except Exception as ex:
             type_, value_, traceback_ = sys.exc_info()
             log.error("rewriter %s: exception %s", func, ex)
@@ -649,13 +666,13 @@ def run_rewriters(g, funcs, continue_on_error):
     if g.contained_graphs:
         for dict_val in g.contained_graphs.values():
             for attr_name, b_g in dict_val.items():
-                run_rewriters(b_g, funcs, attr_name)
+                run_rewriters(b_g, funcs, attr_name, profiler)
 
 
 def process_tf_graph(tf_graph, continue_on_error=False, verbose=False, target=None,
                      opset=None, custom_op_handlers=None, custom_rewriter=None,
                      extra_opset=None, shape_override=None, inputs_as_nchw=None,
-                     input_names=None, output_names=None):
+                     input_names=None, output_names=None, profiler=None, context=None):
     """Convert tensorflow graph to onnx graph.
         Args:
             tf_graph: tensorflow graph
@@ -670,9 +687,22 @@ def process_tf_graph(tf_graph, continue_on_error=False, verbose=False, target=No
             inputs_as_nchw: transpose inputs in list from nchw to nchw
             input_names: list of input node names in graph, input name format as node_name:port_id
             output_names: list of output node names in graph, output name format as node_name:port_id
+            profiler: optional tf2onnx.profiler.Profiler collecting statistics of each conversion phase
+            context: optional tf2onnx.context.ConversionContext holding the state of this conversion,
+                needed to run conversions concurrently in threads
         Return:
             onnx graph
     """
+    with activate_context(context):
+        return _process_tf_graph(tf_graph, continue_on_error, verbose, target, opset, custom_op_handlers,
+                                 custom_rewriter, extra_opset, shape_override, inputs_as_nchw, input_names,
+                                 output_names, profiler)
+
+
+def _process_tf_graph(tf_graph, continue_on_error, verbose, target, opset, custom_op_handlers, custom_rewriter,
+                      extra_opset, shape_override, inputs_as_nchw, input_names, output_names, profiler):
+    if profiler is None:
+        profiler = Profiler(enabled=False)
     opset = utils.find_opset(opset)
     print("using tensorflow={}, onnx={}, opset={}, tfonnx={}/{}".format(
         tf.__version__, utils.get_onnx_version(), opset,
@@ -690,7 +720,7 @@ def process_tf_graph(tf_graph, continue_on_error=False, verbose=False, target=No
     if target is None:
         target = constants.DEFAULT_TARGET
 
-    onnx_nodes, op_cnt, attr_cnt, output_shapes, dtypes = tensorflow_to_onnx(tf_graph, shape_override)
+    onnx_nodes, op_cnt, attr_cnt, output_shapes, dtypes = tensorflow_to_onnx(tf_graph, shape_override, profiler)
 
     io_to_check = []
     if input_names:
@@ -738,14 +768,13 @@ def process_tf_graph(tf_graph, continue_on_error=False, verbose=False, target=No
                 kwargs["onnx_op"] = onnx_op
                 args = args[1:]
             kwargs["args"] = args
-            new_handler = handler.tf_op(k,
-                                        domain=constants.TENSORFLOW_OPSET.domain,
-                                        kwargs=kwargs)
-            new_handler.register_compat_handler(compat_handler, 1)
+            # only added to the mapping of this conversion, registering the handler globally
+            # would leak it into other conversions
             custom_opset[k] = (compat_handler, kwargs)
         ops_mapping.update(custom_opset)
 
-    infer_shape_for_graph(g)
+    with profiler.phase("infer_shape_for_graph", lambda: len(g.get_nodes())):
+        infer_shape_for_graph(g)
 
     if inputs_as_nchw:
         transpose_inputs(g, inputs_as_nchw)
@@ -758,19 +787,21 @@ def process_tf_graph(tf_graph, continue_on_error=False, verbose=False, target=No
                  rewrite_leakyrelu, rewrite_conv2d_with_pad,
                  rewrite_single_direction_lstm, rewrite_bi_direction_lstm,
                  rewrite_single_direction_gru, rewrite_bi_direction_gru,
+                 rewrite_unrolled_lstm, rewrite_unrolled_gru,
                  rewrite_custom_rnn_cell, rewrite_generic_loop, rewrite_cond
                  ]
 
     if custom_rewriter is not None:
         rewriters.extend(custom_rewriter)
 
-    run_rewriters(g, rewriters, continue_on_error)
+    run_rewriters(g, rewriters, continue_on_error, profiler)
 
     # some nodes may already copied into inner Graph, so remove them from main Graph.
     g.delete_unused_nodes(output_names)
     topological_sort(g, continue_on_error)
 
-    mapped_op, unmapped_op = tensorflow_onnx_mapping(g, continue_on_error, ops_mapping)
+    with profiler.phase("tensorflow_onnx_mapping", lambda: len(g.get_nodes())):
+        mapped_op, unmapped_op = tensorflow_onnx_mapping(g, continue_on_error, ops_mapping, profiler)
 
     # post-processing rewriters
     late_rewriters = []
@@ -779,7 +810,7 @@ def process_tf_graph(tf_graph, continue_on_error=False, verbose=False, target=No
     if constants.TARGET_RS6 in target:
         late_rewriters.append(rewrite_incomplete_type_support_rs6)
     if late_rewriters:
-        run_rewriters(g, late_rewriters, continue_on_error)
+        run_rewriters(g, late_rewriters, continue_on_error, profiler)
 
     # onnx requires topological sorting
     topological_sort(g, continue_on_error)
@@ -793,3 +824,28 @@ def process_tf_graph(tf_graph, continue_on_error=False, verbose=False, target=No
         print("onnx unmapped: {}".format(unmapped_op))
 
     return g
+
+
+def convert_many(graphs, max_workers=None, cache=None, doc_string="", optimize=True, unknown_dimension=None,
+                 optimizers=None, **kwargs):
+    """Convert tensorflow graphs concurrently in a pool of threads.
+    Every conversion has its own ConversionContext, so the conversions don't share any state.
+        Args:
+            graphs: list of tensorflow GraphDef, after tf_optimize
+            max_workers: number of threads, None for the default of ThreadPoolExecutor
+            cache: optional tf2onnx.cache.ConversionCache shared by the conversions
+            doc_string: doc string of the models
+            optimize: run the onnx optimizers on the converted models
+            unknown_dimension: value of unknown dimensions of the model inputs and outputs, default is -1
+            optimizers: names of the onnx optimizers to run, default are the ones of the default optimization level
+            kwargs: passed to process_tf_graph for every graph
+        Return:
+            list of onnx ModelProto in the order of graphs, the exception of a failed conversion is raised
+    """
+    def _convert(graph_def):
+        context = ConversionContext(unknown_dimension=unknown_dimension)
+        return process_tf_graph_cached(graph_def, cache, doc_string=doc_string, optimize=optimize,
+                                       context=context, optimizers=optimizers, **kwargs)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(_convert, graphs))
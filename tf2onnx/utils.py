@@ -9,38 +9,45 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
+import multiprocessing
 import os
 import re
 import shutil
+import signal
+import tarfile
 import tempfile
+import time
+import zipfile
 import six
+from six.moves.urllib.request import urlretrieve
 import numpy as np
-import tensorflow as tf
-from tensorflow.core.framework import types_pb2, tensor_pb2
 from google.protobuf import text_format
 import onnx
 from onnx import helper, onnx_pb, defs, numpy_helper
 from . import constants
+from .context import get_current_context
 
 #
 #  mapping dtypes from tensorflow to onnx
+#  keys are the values of the tensorflow DataType proto enum (types_pb2.DT_*), spelled out
+#  so that tensorflow does not need to be imported for the mapping
 #
 TF_TO_ONNX_DTYPE = {
-    types_pb2.DT_FLOAT: onnx_pb.TensorProto.FLOAT,
-    types_pb2.DT_HALF: onnx_pb.TensorProto.FLOAT16,
-    types_pb2.DT_DOUBLE: onnx_pb.TensorProto.DOUBLE,
-    types_pb2.DT_INT32: onnx_pb.TensorProto.INT32,
-    types_pb2.DT_INT16: onnx_pb.TensorProto.INT16,
-    types_pb2.DT_INT8: onnx_pb.TensorProto.INT8,
-    types_pb2.DT_UINT8: onnx_pb.TensorProto.UINT8,
-    types_pb2.DT_UINT16: onnx_pb.TensorProto.UINT16,
-    types_pb2.DT_INT64: onnx_pb.TensorProto.INT64,
-    types_pb2.DT_STRING: onnx_pb.TensorProto.STRING,
-    types_pb2.DT_COMPLEX64: onnx_pb.TensorProto.COMPLEX64,
-    types_pb2.DT_COMPLEX128: onnx_pb.TensorProto.COMPLEX128,
-    types_pb2.DT_BOOL: onnx_pb.TensorProto.BOOL,
-    types_pb2.DT_RESOURCE: onnx_pb.TensorProto.INT64,  # TODO: hack to allow processing on control flow
-    types_pb2.DT_QUINT8: onnx_pb.TensorProto.UINT8,  # TODO: map quint8 to  uint8 for now
+    1: onnx_pb.TensorProto.FLOAT,  # DT_FLOAT
+    19: onnx_pb.TensorProto.FLOAT16,  # DT_HALF
+    2: onnx_pb.TensorProto.DOUBLE,  # DT_DOUBLE
+    3: onnx_pb.TensorProto.INT32,  # DT_INT32
+    5: onnx_pb.TensorProto.INT16,  # DT_INT16
+    6: onnx_pb.TensorProto.INT8,  # DT_INT8
+    4: onnx_pb.TensorProto.UINT8,  # DT_UINT8
+    17: onnx_pb.TensorProto.UINT16,  # DT_UINT16
+    9: onnx_pb.TensorProto.INT64,  # DT_INT64
+    7: onnx_pb.TensorProto.STRING,  # DT_STRING
+    8: onnx_pb.TensorProto.COMPLEX64,  # DT_COMPLEX64
+    18: onnx_pb.TensorProto.COMPLEX128,  # DT_COMPLEX128
+    10: onnx_pb.TensorProto.BOOL,  # DT_BOOL
+    20: onnx_pb.TensorProto.INT64,  # DT_RESOURCE, TODO: hack to allow processing on control flow
+    12: onnx_pb.TensorProto.UINT8,  # DT_QUINT8, TODO: map quint8 to  uint8 for now
 }
 
 #
@@ -87,6 +94,12 @@ class TensorValueInfo(object):
 
 ONNX_UNKNOWN_DIMENSION = -1
 
+# initializers of at least this many bytes are written to the side file in external data mode
+DEFAULT_EXTERNAL_DATA_THRESHOLD = 1024
+
+# offsets of external tensors are aligned to pages, so runtimes can memory map them
+EXTERNAL_DATA_ALIGNMENT = 4096
+
 # index for internally generated names
 INTERNAL_NAME = 1
 
@@ -95,12 +108,23 @@ GRAPH_INPUT_TYPE = "NON_EXISTENT_ONNX_TYPE"
 
 
 def make_name(name):
-    """Make op name for inserted ops."""
+    """Make op name for inserted ops, unique within the active ConversionContext if there is one."""
+    context = get_current_context()
+    if context is not None:
+        return context.make_name(name)
     global INTERNAL_NAME
     INTERNAL_NAME += 1
     return "{}__{}".format(name, INTERNAL_NAME)
 
 
+def get_unknown_dimension():
+    """Value of unknown dimensions, set by the active ConversionContext or ONNX_UNKNOWN_DIMENSION."""
+    context = get_current_context()
+    if context is not None and context.unknown_dimension is not None:
+        return context.unknown_dimension
+    return ONNX_UNKNOWN_DIMENSION
+
+
 def split_nodename_and_shape(name):
     """input name with shape into name and shape."""
     # pattern for a node name
@@ -158,6 +182,8 @@ def tf_to_onnx_tensor(tensor, name=""):
 
 def get_tf_tensor_data(tensor):
     """Get data from tensor."""
+    import tensorflow as tf  # pylint: disable=import-outside-toplevel
+    from tensorflow.core.framework import tensor_pb2  # pylint: disable=import-outside-toplevel
     assert isinstance(tensor, tensor_pb2.TensorProto)
     is_raw = False
     if tensor.tensor_content:
@@ -263,8 +289,12 @@ def get_tf_node_attr(node, name):
     return node.get_attr(name)
 
 
-def save_onnx_model(save_path_root, onnx_file_name, feed_dict, model_proto, include_test_data=False, as_text=False):
-    """Save onnx model as file. Save a pbtxt file as well if as_text is True"""
+def save_onnx_model(save_path_root, onnx_file_name, feed_dict, model_proto, include_test_data=False, as_text=False,
+                    external_data=False, external_data_threshold=DEFAULT_EXTERNAL_DATA_THRESHOLD):
+    """Save onnx model as file. Save a pbtxt file as well if as_text is True.
+    If external_data is True, initializers of at least external_data_threshold bytes are written to a side file,
+    see save_model_with_external_data.
+    """
     save_path = save_path_root
     if not os.path.exists(save_path):
         os.makedirs(save_path)
@@ -284,7 +314,10 @@ def save_onnx_model(save_path_root, onnx_file_name, feed_dict, model_proto, incl
             i += 1
 
     target_path = os.path.join(save_path, onnx_file_name + ".onnx")
-    save_protobuf(target_path, model_proto)
+    if external_data:
+        save_model_with_external_data(target_path, model_proto, external_data_threshold)
+    else:
+        save_protobuf(target_path, model_proto)
     if as_text:
         save_protobuf(target_path + ".pbtxt", model_proto, as_text=True)
     return target_path
@@ -344,6 +377,80 @@ def delete_directory(path):
         shutil.rmtree(path)
 
 
+def download_model(url, local, download_dir):
+    """Download the model archive at url and extract it unless that was done before.
+    Args:
+        url: url of the model, .tar.gz, .tgz and .zip archives are extracted
+        local: path of the model inside the archive
+        download_dir: directory the model is downloaded to
+    Returns:
+        path of the downloaded file and the directory it is extracted to
+    """
+    fname = url[url.rfind('/') + 1:]
+    dir_name = fname + "_dir"
+    ftype = None
+    if url.endswith(".tar.gz") or url.endswith(".tgz"):
+        ftype = 'tgz'
+        dir_name = fname.replace(".tar.gz", "").replace(".tgz", "")
+    elif url.endswith('.zip'):
+        ftype = 'zip'
+        dir_name = fname.replace(".zip", "")
+    dir_name = os.path.join(download_dir, dir_name)
+    os.makedirs(dir_name, exist_ok=True)
+    fpath = os.path.join(dir_name, fname)
+    if not os.path.exists(fpath):
+        urlretrieve(url, fpath)
+    model_path = os.path.join(dir_name, local)
+    if not os.path.exists(model_path):
+        if ftype == 'tgz':
+            with tarfile.open(fpath) as tar:
+                tar.extractall(dir_name)
+        elif ftype == 'zip':
+            with zipfile.ZipFile(fpath, 'r') as zip_ref:
+                zip_ref.extractall(dir_name)
+    return fpath, dir_name
+
+
+class WorkerFailure(Exception):
+    """A task of a multiprocessing pool didn't finish, status is CRASH or TIMEOUT."""
+
+    def __init__(self, status, message, elapsed):
+        super(WorkerFailure, self).__init__(message)
+        self.status = status
+        self.elapsed = elapsed
+
+
+def poll_worker(async_result, started, key, timeout=None, interval=1):
+    """Return True once the result of a pool task is ready, False while it is queued or running.
+    Args:
+        async_result: multiprocessing AsyncResult of the task
+        started: dict shared with the worker processes, the task sets started[key] = (os.getpid(), time.time())
+        timeout: seconds the task may run counted from its start in the worker, None or 0 for no limit
+        interval: seconds to wait for the result of a task whose worker process exited
+    Raises WorkerFailure if the worker process died or the task ran longer than timeout, the worker of a
+    timed out task is killed so the pool replaces it.
+    """
+    if async_result.ready():
+        return True
+    if key not in started:
+        return False
+    pid, start = started[key]
+    elapsed = time.time() - start
+    if pid not in [p.pid for p in multiprocessing.active_children()]:
+        # the result may still be on its way if the worker exited after the task
+        async_result.wait(interval)
+        if async_result.ready():
+            return True
+        raise WorkerFailure("CRASH", "worker process {} died".format(pid), elapsed)
+    if timeout and elapsed > timeout:
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except OSError:
+            pass
+        raise WorkerFailure("TIMEOUT", "no result after {} seconds".format(timeout), elapsed)
+    return False
+
+
 def save_protobuf(path, message, as_text=False):
     dir_name = os.path.dirname(path)
     if dir_name:
@@ -356,6 +463,128 @@ def save_protobuf(path, message, as_text=False):
             f.write(message.SerializeToString())
 
 
+def _get_all_initializers(graph_proto):
+    """Initializers of graph_proto and of all its body graphs."""
+    initializers = list(graph_proto.initializer)
+    for node in graph_proto.node:
+        for attr in node.attribute:
+            if attr.type == onnx_pb.AttributeProto.GRAPH:
+                initializers.extend(_get_all_initializers(attr.g))
+            elif attr.type == onnx_pb.AttributeProto.GRAPHS:
+                for g in attr.graphs:
+                    initializers.extend(_get_all_initializers(g))
+    return initializers
+
+
+def get_tensor_nbytes(tensor):
+    """Size in bytes of the data of an onnx TensorProto, computed without decoding the data."""
+    if tensor.HasField("raw_data"):
+        return len(tensor.raw_data)
+    if tensor.data_type == onnx_pb.TensorProto.STRING:
+        return sum(len(v) for v in tensor.string_data)
+    return int(np.prod(tensor.dims, dtype=np.int64)) * np.dtype(ONNX_TO_NUMPY_DTYPE[tensor.data_type]).itemsize
+
+
+class ExternalDataWriter(object):
+    """Write the data of large tensors to the side file of an onnx model, page aligned and one tensor at a time.
+    Used as context manager, the side file is open while inside the with block.
+    """
+
+    def __init__(self, model_path, threshold=DEFAULT_EXTERNAL_DATA_THRESHOLD, location=None):
+        """
+        Args:
+            model_path: path of the onnx model file
+            threshold: min size in bytes of tensors that are stored externally
+            location: file name of the side file relative to the model file, default is the model file name + ".data"
+        """
+        if location is None:
+            location = os.path.basename(model_path) + ".data"
+        self.location = location
+        self.threshold = threshold
+        self._dir_name = os.path.dirname(model_path)
+        self.path = os.path.join(self._dir_name, location)
+        self._file = None
+
+    def __enter__(self):
+        if self._dir_name:
+            os.makedirs(self._dir_name, exist_ok=True)
+        self._file = open(self.path, "wb")
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._file.close()
+        self._file = None
+
+    def write(self, tensor):
+        """Append the data of tensor to the side file if it is large enough.
+        Returns:
+            (offset, length) of the data in the side file, None if the tensor stays inline
+        """
+        make_sure(self._file is not None, "external data file %s is not open", self.path)
+        if tensor.data_type not in ONNX_TO_NUMPY_DTYPE or tensor.data_type == onnx_pb.TensorProto.STRING:
+            return None
+        if tensor.data_location == onnx_pb.TensorProto.EXTERNAL or get_tensor_nbytes(tensor) < self.threshold:
+            return None
+        if tensor.HasField("raw_data"):
+            data = tensor.raw_data
+        else:
+            data = np.ascontiguousarray(numpy_helper.to_array(tensor)).data.cast("B")
+        offset = self._file.tell()
+        padding = -offset % EXTERNAL_DATA_ALIGNMENT
+        if padding:
+            self._file.write(b"\0" * padding)
+            offset += padding
+        self._file.write(data)
+        return offset, len(data)
+
+    def make_external(self, tensor, in_place=False):
+        """Write the data of tensor to the side file if it is large enough.
+        Returns:
+            TensorProto referencing the side file, a new one unless in_place is True,
+            or tensor itself if it stays inline
+        """
+        written = self.write(tensor)
+        if written is None:
+            return tensor
+        if in_place:
+            for field in ["raw_data", "float_data", "int32_data", "int64_data", "double_data", "uint64_data"]:
+                tensor.ClearField(field)
+            del tensor.external_data[:]
+            external = tensor
+        else:
+            external = onnx_pb.TensorProto()
+            external.name = tensor.name
+            external.data_type = tensor.data_type
+            external.dims.extend(tensor.dims)
+        external.data_location = onnx_pb.TensorProto.EXTERNAL
+        offset, length = written
+        for key, value in [("location", self.location), ("offset", offset), ("length", length)]:
+            entry = external.external_data.add()
+            entry.key = key
+            entry.value = str(value)
+        return external
+
+
+def save_model_with_external_data(path, model_proto, threshold=DEFAULT_EXTERNAL_DATA_THRESHOLD, location=None):
+    """Save an existing onnx model with initializers of at least threshold bytes in a side file.
+    model_proto is changed in place to reference the side file. To avoid holding all weights in the model proto
+    in the first place, pass an ExternalDataWriter to Graph.make_model instead.
+    Args:
+        path: path of the onnx model file
+        model_proto: onnx ModelProto
+        threshold: min size in bytes of initializers that are stored externally
+        location: file name of the side file relative to the model file, default is the model file name + ".data"
+    Returns:
+        path of the side file
+    """
+    with ExternalDataWriter(path, threshold, location) as writer:
+        for tensor in _get_all_initializers(model_proto.graph):
+            writer.make_external(tensor, in_place=True)
+
+    save_protobuf(path, model_proto)
+    return writer.path
+
+
 def is_list_or_tuple(obj):
     return isinstance(obj, (list, tuple))
 
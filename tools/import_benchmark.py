@@ -0,0 +1,78 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT license.
+
+"""
+import_benchmark.py - measure the import time of tf2onnx modules in fresh interpreters.
+
+The onnx only modules (graph, optimizer) must not import tensorflow, the script fails if they do
+or if an import takes longer than --max-seconds.
+"""
+
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import subprocess
+import sys
+
+# module -> whether tensorflow may be imported by it
+MODULES = [
+    ("tf2onnx", False),
+    ("tf2onnx.graph", False),
+    ("tf2onnx.optimizer", False),
+    ("tf2onnx.tfonnx", True),
+]
+
+_SCRIPT = """
+import sys, time
+start = time.time()
+import {module}
+print(time.time() - start, "tensorflow" in sys.modules)
+"""
+
+
+def _get_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=3, help="number of runs per module, the fastest one counts")
+    parser.add_argument("--max-seconds", type=float, default=2.0,
+                        help="max import time of the modules that don't need tensorflow")
+    parser.add_argument("--modules", help="comma separated modules to measure, default is all")
+    args = parser.parse_args()
+    return args
+
+
+def measure(module, repeat=3):
+    """Return the fastest import time of module and whether tensorflow got imported."""
+    best = None
+    imports_tf = False
+    for _ in range(repeat):
+        out = subprocess.check_output([sys.executable, "-c", _SCRIPT.format(module=module)])
+        seconds, tf_imported = out.decode("utf-8").split()[-2:]
+        best = float(seconds) if best is None else min(best, float(seconds))
+        imports_tf = tf_imported == "True"
+    return best, imports_tf
+
+
+def main():
+    args = _get_args()
+    modules = MODULES
+    if args.modules:
+        names = args.modules.split(",")
+        modules = [(m, tf_allowed) for m, tf_allowed in MODULES if m in names]
+
+    failed = []
+    print("{:<24} {:>10} {:>12}".format("module", "time(s)", "tensorflow"))
+    for module, tf_allowed in modules:
+        seconds, imports_tf = measure(module, args.repeat)
+        print("{:<24} {:>10.3f} {:>12}".format(module, seconds, str(imports_tf)))
+        if not tf_allowed and (imports_tf or seconds > args.max_seconds):
+            failed.append(module)
+
+    if failed:
+        print("FAILED: {} import tensorflow or take longer than {}s".format(", ".join(failed), args.max_seconds))
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
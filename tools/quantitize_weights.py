@@ -3,6 +3,8 @@
 
 """
 quantitize_weights.py - simple script to quantitize weights (not the model) to 8 bits.
+
+This only makes the model smaller, for int8 inference use python -m tf2onnx.convert --quantize dynamic.
 """
 
 from __future__ import division